@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""Measure how long setting up a Bot takes against the local plantOS stub, with and without prefetch
+
+The stub adds latency to every response, like a slow link to the server. Without prefetch the element constructors
+get everything one request at a time, with it the resource graph is got level by level on the fetch threads
+(see Server.prefetch). Also times starting from a topology snapshot, which needs no requests at all.
+Run from the repo root: python3 -m benchmarks.bot_bootstrap
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from services.bot import Bot
+from services.server import Server
+from simulation.plantosStub import PlantosStub
+
+
+class _NoGroduino:
+    """Bot only needs this for status, setting up doesn't talk to the groduino"""
+    def getStatusList(self):
+        return []
+
+
+def timeBootstrap(stub, prefetch, snapshot_file_name=None):
+    """Set up a Bot on a new Server
+    :return: (seconds, requests made, sensing points, actuators)
+    """
+    Bot.prefetch_server_info = prefetch
+    request_count = stub.request_count
+    start_time = time.time()
+    server = Server(stub.base_url, snapshot_file_name=snapshot_file_name)
+    bot = Bot(_NoGroduino(), server)
+    elapsed = time.time() - start_time
+    server.close()
+    return (elapsed, stub.request_count - request_count, len(bot.getElementByCodeIndex('sensing_point')),
+            len(bot.getElementByCodeIndex('actuator')))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bot setup benchmark')
+    parser.add_argument('-s', '--sensing-points', type=int, default=60)
+    parser.add_argument('-a', '--actuators', type=int, default=15)
+    parser.add_argument('-l', '--latency', type=float, default=0.05, help='seconds added to every response')
+    args = parser.parse_args()
+
+    Server._outbox_file_name = None
+    stub = PlantosStub(latency=args.latency)
+    stub.start()
+    stub.addTopology(args.sensing_points, args.actuators)
+    snapshot_file_name = os.path.join(tempfile.mkdtemp(), 'topology_snapshot.json')
+    try:
+        for name, prefetch, file_name in (('sequential', False, None), ('prefetch', True, None),
+                                          ('snapshot save', True, snapshot_file_name),
+                                          ('snapshot load', True, snapshot_file_name)):
+            elapsed, request_count, sensing_point_count, actuator_count = timeBootstrap(stub, prefetch, file_name)
+            print('%-14s %7.3f secs, %4d requests (%d sensing points, %d actuators, %.0f ms latency)' %
+                  (name, elapsed, request_count, sensing_point_count, actuator_count, args.latency * 1000))
+    finally:
+        stub.stop()
+        Bot.prefetch_server_info = True
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""Compare Actuator.simpleControl on every actuator with the numpy ControlEngine, at several bot sizes
+
+Sets up a real Bot from the local plantOS stub's made up topology (scaled up from 6 sensing points and 3 actuators),
+then sets random values, set points and actuator states and prints the time for one control pass of each.
+That they give the same states is checked in tests/test_controlEngine.py.
+Run from the repo root: python3 -m benchmarks.control
+"""
+
+import argparse
+import logging
+import random
+import timeit
+
+from services.bot import Bot
+from services.bot.controlEngine import ControlEngine
+from services.server import Server
+from simulation.plantosStub import PlantosStub
+
+
+class _NoGroduino:
+    def getStatusList(self):
+        return []
+
+
+def randomize(bot, rng):
+    """Random values/set points (some missing) and actuator states (some None, some 0)"""
+    for sensing_point in bot.getElementByCodeIndex('sensing_point'):
+        sensing_point._last_value = None if rng.random() < 0.05 else rng.uniform(0, 40)
+        sensing_point._desired_value = None if rng.random() < 0.05 else rng.uniform(0, 40)
+    for actuator in bot.getElementByCodeIndex('actuator'):
+        actuator._state = rng.choice([None, 0, 0, 1, rng.uniform(0, 1)])
+
+
+def runSimpleControl(bot):
+    for actuator in bot.getElementByCodeIndex('actuator'):
+        actuator.simpleControl()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Control benchmark')
+    parser.add_argument('-s', '--scales', type=int, nargs='+', default=[1, 10, 100],
+                        help='multiples of 6 sensing points and 3 actuators')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    Server._outbox_file_name = None
+    rng = random.Random(1)
+    for scale in args.scales:
+        stub = PlantosStub()
+        stub.start()
+        stub.addTopology(6 * scale, 3 * scale)
+        server = Server(stub.base_url)
+        bot = Bot(_NoGroduino(), server)
+        engine = ControlEngine(bot)
+        engine.compile()
+
+        randomize(bot, rng)
+        number = max(1, 2000 // scale)
+        simple_time = min(timeit.repeat(lambda: runSimpleControl(bot), number=number, repeat=3)) / number
+        engine_time = min(timeit.repeat(engine.evaluate, number=number, repeat=3)) / number
+        print('%4d sensing points, %4d actuators, %6d effects: simpleControl %8.1f us, ControlEngine %8.1f us (%.1fx)'
+              % (len(bot.getElementByCodeIndex('sensing_point')), len(engine.actuator_list), engine.row_count,
+                 simple_time * 1e6, engine_time * 1e6, simple_time / engine_time))
+        server.close()
+        stub.stop()
+
+
+if __name__ == '__main__':
+    main()
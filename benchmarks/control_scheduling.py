@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""Measure control cost per groduino frame, running control for every actuator vs only the ones whose inputs changed
+
+Sets up a real Bot from the local plantOS stub's made up topology, then feeds it frames like the groduino sends (every
+sensing point, then GEND) through handleMessage and updateActuators, like Bot.run does. In each frame only some of
+the values change. With use_dirty_control, control only runs for actuators affected by those (see Bot.runControl),
+so its cost follows the rate of change instead of the loop speed.
+Run from the repo root: python3 -m benchmarks.control_scheduling
+"""
+
+import argparse
+import json
+import logging
+import random
+import time
+
+from services.bot import Bot
+from services.server import Server
+from simulation.plantosStub import PlantosStub
+
+
+class _NoGroduino:
+    """Takes what the actuators send and throws it away"""
+    def send(self, message):
+        pass
+
+    def getStatusList(self):
+        return []
+
+
+def makeFrames(bot, frame_count, change_fraction, rng):
+    """Frames as the groduino would send them, each changing about change_fraction of the values
+    :return: list of json strings
+    """
+    value_dictby_key = {}
+    for sensing_point in bot.getElementByCodeIndex('sensing_point'):
+        value_dictby_key['%s %d' % (sensing_point.code, sensing_point.index)] = round(rng.uniform(0, 40), 1)
+    frame_list = []
+    for i in range(frame_count):
+        for key in value_dictby_key:
+            if rng.random() < change_fraction:
+                value_dictby_key[key] = round(rng.uniform(0, 40), 1)
+        frame_list.append(json.dumps(dict(value_dictby_key, GEND=0)))
+    return frame_list
+
+
+def timeFrames(bot, frame_list, dirty_control):
+    """Handle the frames and update the actuators after each, like Bot.run
+    :return: (secs per frame, actuators control ran for per frame)
+    """
+    Bot.use_dirty_control = dirty_control
+    bot._controlled_actuator_count = 0
+    for frame in frame_list[:10]:       # warm up, and get the values from the previous run out of the way
+        bot.handleMessage(time.time(), frame)
+        bot.updateActuators()
+    controlled_count = bot._controlled_actuator_count
+    start_time = time.perf_counter()
+    for frame in frame_list:
+        bot.handleMessage(time.time(), frame)
+        bot.updateActuators()
+    elapsed = time.perf_counter() - start_time
+    return elapsed / len(frame_list), (bot._controlled_actuator_count - controlled_count) / len(frame_list)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Control scheduling benchmark')
+    parser.add_argument('-s', '--scale', type=int, default=10, help='multiple of 6 sensing points and 3 actuators')
+    parser.add_argument('-f', '--frames', type=int, default=500)
+    parser.add_argument('-c', '--changes', type=float, nargs='+', default=[0, 0.05, 0.2, 1],
+                        help='fraction of values that change in each frame')
+    parser.add_argument('--no-engine', action='store_true', help="don't use the ControlEngine, only simpleControl")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    Server._outbox_file_name = None
+    Bot.use_control_engine = not args.no_engine
+    rng = random.Random(1)
+    stub = PlantosStub()
+    stub.start()
+    stub.addTopology(6 * args.scale, 3 * args.scale)
+    server = Server(stub.base_url)
+    try:
+        bot = Bot(_NoGroduino(), server)
+        for sensing_point in bot.getElementByCodeIndex('sensing_point'):
+            sensing_point.desired_value = rng.uniform(0, 40)
+        print('%d sensing points, %d actuators' % (len(bot.getElementByCodeIndex('sensing_point')),
+                                                   len(bot.getElementByCodeIndex('actuator'))))
+        for change_fraction in args.changes:
+            frame_list = makeFrames(bot, args.frames, change_fraction, rng)
+            all_time, all_count = timeFrames(bot, frame_list, False)
+            dirty_time, dirty_count = timeFrames(bot, frame_list, True)
+            print('%3.0f%% changing: every actuator %7.1f us/frame (%5.1f controlled), '
+                  'dirty only %7.1f us/frame (%5.1f controlled)' %
+                  (change_fraction * 100, all_time * 1e6, all_count, dirty_time * 1e6, dirty_count))
+    finally:
+        Bot.use_dirty_control = True
+        Bot.use_control_engine = True
+        server.close()
+        stub.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""Microbenchmark for Crc8. Compares the original per-character digest with Crc8.crc and Crc8.crcMany
+
+Frames are built like the groduino builds them, with 6, 20 and 60 sensors per frame. That they all give the same crc
+is checked in tests/test_crc8.py.
+Run from the repo root: python3 -m benchmarks.crc8
+"""
+
+import argparse
+import timeit
+
+from services.arduino.communication.communication import Crc8, numpy
+
+
+class LegacyCrc8(object):
+    """The Crc8 implementation before it took bytes. Walks a str one char at a time through ord and _update"""
+    TABLE = Crc8.TABLE
+
+    def __init__(self, sum_=0x00):
+        self.sum = sum_
+
+    def _update(self, b):
+            self.sum = self.TABLE[self.sum ^ b]
+
+    def digest(self, st):
+        self.sum = 0
+        for ch in st:
+            self._update(ord(ch))
+        return self.sum
+
+
+def makeFrameText(sensor_count: int) -> bytes:
+    """Make the text of a groduino frame with sensor_count sensing point values, ex '"SATM 1":22.80,'"""
+    codes = ['SATM', 'SAHU', 'SACO', 'SWTM', 'SWPH', 'SWEC', 'SLIN', 'SLPA']
+    parts = ['"%s %d":%.2f,' % (codes[i % len(codes)], i // len(codes) + 1, 20 + i * 0.37)
+             for i in range(sensor_count)]
+    return ('{' + ''.join(parts) + '"GEND":0}').encode('ASCII')
+
+
+def bench(fn, number):
+    """Best of 3, in microseconds per call"""
+    return min(timeit.repeat(fn, number=number, repeat=3)) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Crc8 microbenchmark')
+    parser.add_argument('-n', '--number', type=int, default=2000, help='calls per measurement')
+    parser.add_argument('-b', '--batch', type=int, default=256, help='frames per crcMany batch')
+    args = parser.parse_args()
+
+    print('numpy backend: %s' % ('yes' if numpy is not None else 'not installed'))
+    for sensor_count in [6, 20, 60]:
+        text = makeFrameText(sensor_count)
+        text_str = text.decode('ASCII')
+        batch = [text] * args.batch
+        legacy = LegacyCrc8()
+
+        legacy_us = bench(lambda: legacy.digest(text_str), args.number)
+        crc_us = bench(lambda: Crc8.crc(text), args.number)
+        many_us = bench(lambda: Crc8.crcMany(batch), max(1, args.number // args.batch)) / args.batch
+        print('%2d sensors, %4d bytes: legacy %7.2f us  crc %7.2f us (%.1fx)  crcMany %7.2f us/frame (%.1fx)' %
+              (sensor_count, len(text), legacy_us, crc_us, legacy_us / crc_us, many_us, legacy_us / many_us))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""Run the whole controller against stand-ins and measure it: Bot.run, a real Groduino and Server, the local plantOS
+stub (with latency, like a slow link to the server) and a VirtualGroduino streaming frames on a pty.
+
+The bot runs in its own process, so its CPU time and RSS are only its own, not the stub's or the device's.
+For each size (sensing points and actuators, paired up) reports:
+    loop    time per Bot.run loop, not counting the time it sleeps waiting for serial (p50/p95/p99/max, ms)
+    frames  frames the bot handled per second, and frames lost: pushed out of the reader's ring, failed the crc, or
+            sent but never handled. Frames that queued up while the bot was being set up are skipped
+    message time from a frame arriving to it being handled (p50/p95/max, ms)
+    upload  time from a value being read to its data point arriving at the stub (p50/max, secs). Mostly the wait for
+            a batch to fill up or get old (see DataPointBatcher), so run for longer than its max_age. Data point
+            timestamps are whole seconds, so these are up to a second long
+    status  time to format Bot.getStatusList once (done every Bot.status_period in the loop)
+    cpu     bot process CPU time, as % of one core, and its peak RSS
+Run from the repo root: python3 -m benchmarks.end_to_end
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import resource
+import time
+from collections import deque
+
+from services.arduino.communication import Groduino
+from services.bot import Bot
+from services.configuration import ManualProfiler, SerialParameters
+from services.server import Server
+from simulation.plantosStub import PlantosStub
+from simulation.virtualGroduino import VirtualGroduino, makeKeyList
+
+
+class _StopBot(Exception):
+    pass
+
+
+class _TimedGroduino(Groduino):
+    """Groduino that counts the frames it hands out and the time spent waiting for them, and raises _StopBot from
+    receive once stop_time is past"""
+    def __init__(self, port, serial_parameters, stop_time):
+        super().__init__(port, serial_parameters)
+        self.stop_time = stop_time
+        self.received_count = 0
+        self.wait_time = 0          # total time blocked in receive
+
+    def receiveWithTimestamp(self, blocking=False, timeout=None):
+        start_time = time.time()
+        if start_time > self.stop_time:
+            raise _StopBot
+        timestamped_message = super().receiveWithTimestamp(blocking, timeout)
+        self.wait_time += time.time() - start_time
+        if timestamped_message is not None:
+            self.received_count += 1
+        return timestamped_message
+
+
+class _LoopTimer(ManualProfiler):
+    """Bot's run profiler, also keeping how long every loop took less the time the groduino spent waiting"""
+    def __init__(self, groduino):
+        super().__init__()
+        self.groduino = groduino
+        self.loop_time_list = []
+        self._start = None
+
+    def startLoop(self):
+        super().startLoop()
+        self._start = (time.time(), self.groduino.wait_time)
+
+    def endLoop(self):
+        super().endLoop()
+        start_time, start_wait_time = self._start
+        self.loop_time_list.append(time.time() - start_time - (self.groduino.wait_time - start_wait_time))
+
+
+def percentile(sorted_list, fraction):
+    if not sorted_list:
+        return float('nan')
+    return sorted_list[min(len(sorted_list) - 1, int(len(sorted_list) * fraction))]
+
+
+def runBot(base_url, port_name, baud_rate, duration, status_period, result_queue):
+    """Run a Bot for duration secs, in the benchmark's child process. Puts a dict of results on result_queue"""
+    logging.basicConfig(level=logging.CRITICAL)
+    Server._outbox_file_name = None
+    server = Server(base_url)
+    serial_parameters = SerialParameters()
+    serial_parameters.baud_rate = baud_rate
+    serial_parameters.use_binary_protocol = True    # the virtual groduino knows GBIN (up to 256 keys)
+    groduino = _TimedGroduino(port_name, serial_parameters, float('inf'))
+    bot = Bot(groduino, server)
+    bot.status_period = status_period
+    bot.status_file_name = os.devnull
+    bot._message_latency_list = deque()         # keep all of them, not just the last few
+    bot._run_profiler = loop_timer = _LoopTimer(groduino)
+    drained_count = 0
+    while groduino.receiveWithTimestamp() is not None:      # frames that queued up while the bot was set up
+        drained_count += 1
+    groduino.received_count = 0
+
+    start_usage = resource.getrusage(resource.RUSAGE_SELF)
+    start_time = time.time()
+    groduino.stop_time = start_time + duration
+    try:
+        bot.run()
+    except _StopBot:
+        pass
+    elapsed = time.time() - start_time
+    end_usage = resource.getrusage(resource.RUSAGE_SELF)
+
+    status_start_time = time.perf_counter()
+    bot.getStatusList()
+    status_time = time.perf_counter() - status_start_time
+    reader = groduino._reader
+    result_queue.put({'loop_time_list': sorted(loop_timer.loop_time_list),
+                      'message_latency_list': sorted(bot._message_latency_list),
+                      'frames': groduino.received_count, 'drained': drained_count, 'elapsed': elapsed,
+                      'ring_dropped': reader.dropped_frame_count, 'bad_crc': reader.bad_crc_count,
+                      'status_time': status_time,
+                      'cpu_time': (end_usage.ru_utime - start_usage.ru_utime + end_usage.ru_stime -
+                                   start_usage.ru_stime),
+                      'max_rss_kb': end_usage.ru_maxrss})
+    groduino.close()
+    server.close()
+
+
+def measure(sensing_point_count, actuator_count, frame_rate, latency, baud_rate, duration, status_period):
+    """Run the bot against a new stub and virtual groduino of this size
+    :return: dict of results, see runBot
+    """
+    stub = PlantosStub(latency=latency)
+    stub.start()
+    stub.addTopology(sensing_point_count, actuator_count)
+    device = VirtualGroduino(makeKeyList(sensing_point_count, actuator_count), baud_rate=baud_rate,
+                             frame_rate=frame_rate, seed=1, reliable_baud_rate=baud_rate)
+    device.start()
+    result_queue = multiprocessing.get_context('spawn').Queue()
+    process = multiprocessing.get_context('spawn').Process(
+        target=runBot, args=(stub.base_url, device.port_name, baud_rate, duration, status_period, result_queue))
+    try:
+        process.start()
+        while not device.is_connected and process.is_alive():
+            time.sleep(0.01)
+        start_frame_count = device.frame_count
+        result = result_queue.get(timeout=duration + 120)
+        result['sent_frames'] = device.frame_count - start_frame_count
+        process.join()
+        result['upload_latency_list'] = sorted(arrival_time - data_point['timestamp'] for data_point, arrival_time in
+                                               zip(stub.datapoint_list, stub.datapoint_arrival_time_list))
+        result['data_points'] = len(stub.datapoint_list)
+        result['link_baud_rate'] = device.baud_rate
+        return result
+    finally:
+        if process.is_alive():
+            process.terminate()
+        device.stop()
+        stub.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End to end benchmark')
+    parser.add_argument('-s', '--sensing-points', type=int, nargs='+', default=[20, 200, 1000])
+    parser.add_argument('-a', '--actuators', type=int, nargs='+', default=[5, 50, 250],
+                        help='one per --sensing-points, the sizes are paired up')
+    parser.add_argument('-r', '--rate', type=float, default=5, help='frames per second the groduino sends')
+    parser.add_argument('-l', '--latency', type=float, default=0.05, help='seconds the stub adds to every response')
+    parser.add_argument('-b', '--baud', type=int, default=115200)
+    parser.add_argument('-d', '--duration', type=float, default=30, help='seconds to run the bot for, per size')
+    parser.add_argument('--status-period', type=float, default=5, help='Bot.status_period')
+    args = parser.parse_args()
+    if len(args.sensing_points) != len(args.actuators):
+        parser.error('need as many --actuators as --sensing-points')
+
+    logging.basicConfig(level=logging.CRITICAL)
+    print('%.1f frames/s at %d baud, server latency %.3f secs, %.0f secs per size' %
+          (args.rate, args.baud, args.latency, args.duration))
+    for sensing_point_count, actuator_count in zip(args.sensing_points, args.actuators):
+        result = measure(sensing_point_count, actuator_count, args.rate, args.latency, args.baud, args.duration,
+                         args.status_period)
+        loop_time_list = result['loop_time_list']
+        latency_list = result['message_latency_list']
+        upload_latency_list = result['upload_latency_list']
+        lost_count = max(0, result['sent_frames'] - result['frames'] - result['drained'])
+        print('%5d sensing points, %4d actuators (%d baud):' % (sensing_point_count, actuator_count,
+                                                                 result['link_baud_rate']))
+        print('    loop    %d loops, p50 %.2f  p95 %.2f  p99 %.2f  max %.2f ms' %
+              (len(loop_time_list), percentile(loop_time_list, 0.5) * 1e3, percentile(loop_time_list, 0.95) * 1e3,
+               percentile(loop_time_list, 0.99) * 1e3, percentile(loop_time_list, 1) * 1e3))
+        print('    frames  %.1f/s handled, %d sent, %d lost (%d pushed out of the ring, %d bad crc)' %
+              (result['frames'] / result['elapsed'], result['sent_frames'], lost_count, result['ring_dropped'],
+               result['bad_crc']))
+        print('    message p50 %.2f  p95 %.2f  max %.2f ms' %
+              (percentile(latency_list, 0.5) * 1e3, percentile(latency_list, 0.95) * 1e3,
+               percentile(latency_list, 1) * 1e3))
+        print('    upload  %d data points, p50 %.2f  max %.2f secs' %
+              (result['data_points'], percentile(upload_latency_list, 0.5), percentile(upload_latency_list, 1)))
+        print('    status  %.2f ms to format' % (result['status_time'] * 1e3))
+        print('    cpu     %.1f%% of a core, peak RSS %.1f MB' %
+              (result['cpu_time'] / result['elapsed'] * 100, result['max_rss_kb'] / 1024))
+
+
+if __name__ == '__main__':
+    main()
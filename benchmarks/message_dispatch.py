@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""Measure the cost of giving each part of a groduino frame to its element, with and without the message routes
+
+Sets up a real Bot from the local plantOS stub's made up topology and makes a frame with every sensing point, every
+actuator, some keys nothing handles, and GEND. Without routes, every key is split, its element looked up and the
+ignored keys checked, like mainMessageHandler does. With them (Bot.dispatchMessageItems) it is one dict lookup.
+Only the dispatch is timed, the frame is already parsed.
+Run from the repo root: python3 -m benchmarks.message_dispatch
+"""
+
+import argparse
+import logging
+import timeit
+
+from services.bot import Bot
+from services.bot.actuator import Actuator
+from services.bot.sensingPoint import SensingPoint
+from services.server import Server
+from simulation.plantosStub import PlantosStub
+
+
+class _NoGroduino:
+    def getStatusList(self):
+        return []
+
+
+def makeFrame(bot, unknown_count):
+    """A parsed frame: (key, value) pairs for every element, unknown_count keys with no element, then GEND"""
+    item_list = [('%s %d' % (s.code, s.index), 22.5) for s in bot.getElementByCodeIndex('sensing_point')]
+    item_list += [('%s %d' % (a.code, a.index), 0.0) for a in bot.getElementByCodeIndex('actuator')]
+    item_list += [('SXXX %d' % i, 1.0) for i in range(unknown_count)]
+    item_list.append(('GEND', 0))
+    return item_list
+
+
+def dispatchWithoutRoutes(bot, item_list):
+    handlers_dictby_code = {'S': SensingPoint.mainMessageHandler, 'A': Actuator.mainMessageHandler,
+                            'G': Bot.generalMessageHandler}
+    for key, data in item_list:
+        handlers_dictby_code[key[0]](bot, key, data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Message dispatch benchmark')
+    parser.add_argument('-s', '--scales', type=int, nargs='+', default=[1, 10, 50],
+                        help='multiples of 6 sensing points and 3 actuators')
+    parser.add_argument('-u', '--unknown', type=int, default=5, help='keys in the frame with no element')
+    parser.add_argument('-n', '--number', type=int, default=2000, help='frames to time')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    Server._outbox_file_name = None
+    for scale in args.scales:
+        stub = PlantosStub()
+        stub.start()
+        stub.addTopology(6 * scale, 3 * scale)
+        server = Server(stub.base_url)
+        bot = Bot(_NoGroduino(), server)
+        item_list = makeFrame(bot, args.unknown)
+        bot.dispatchMessageItems(item_list)     # same values from here on, so control never runs
+
+        number = max(1, args.number // scale)
+        without_time = min(timeit.repeat(lambda: dispatchWithoutRoutes(bot, item_list),
+                                         number=number, repeat=3)) / number
+        with_time = min(timeit.repeat(lambda: bot.dispatchMessageItems(item_list), number=number, repeat=3)) / number
+        print('%4d keys per frame: without routes %8.1f us/frame, with routes %8.1f us/frame (%.1fx)' %
+              (len(item_list), without_time * 1e6, with_time * 1e6, without_time / with_time))
+        server.close()
+        stub.stop()
+
+
+if __name__ == '__main__':
+    main()
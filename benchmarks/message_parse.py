@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""Measure the cost of parsing one groduino message, json.loads vs decodeMessage (orjson if installed)
+
+Makes flat messages like the groduino sends ({"SATM 1": 22.8, ..., "GEND": 0}) with a few sizes and times getting
+the (key, value) pairs out of them. The numbers are for the machine this runs on: run it on the bot's own board
+(ex a Raspberry Pi) to see what it costs there, it is usually 5-10x slower than a desktop.
+That both give the same pairs is checked in tests/test_messageDecoder.py.
+Run from the repo root: python3 -m benchmarks.message_parse
+"""
+
+import argparse
+import json
+import platform
+import random
+import timeit
+
+from services.bot import messageDecoder
+
+
+def makeMessage(key_count, rng):
+    value_dictby_key = {}
+    for i in range(key_count):
+        value_dictby_key['S%s %d' % (rng.choice(['AIRTM', 'AIRHU', 'AIRCO', 'WATPH', 'WATEC', 'LIGIN']), i + 1)] = \
+            round(rng.uniform(0, 1000), 2)
+    value_dictby_key['GEND'] = 0
+    return json.dumps(value_dictby_key, separators=(',', ':'))
+
+
+def parseWithJson(message):
+    return list(json.loads(message).items())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Message parse benchmark')
+    parser.add_argument('-k', '--keys', type=int, nargs='+', default=[10, 40, 200], help='values per message')
+    parser.add_argument('-n', '--number', type=int, default=20000, help='messages to time')
+    args = parser.parse_args()
+
+    print('%s, python %s, decodeMessage uses %s' % (platform.machine(), platform.python_version(),
+                                                     'orjson' if messageDecoder.orjson is not None else 'json'))
+    rng = random.Random(1)
+    for key_count in args.keys:
+        message = makeMessage(key_count, rng)
+        number = max(1, args.number * 10 // key_count)
+        json_time = min(timeit.repeat(lambda: parseWithJson(message), number=number, repeat=3)) / number
+        decode_time = min(timeit.repeat(lambda: messageDecoder.decodeMessage(message), number=number,
+                                        repeat=3)) / number
+        print('%4d keys (%5d bytes): json.loads %7.2f us, decodeMessage %7.2f us (%.1fx)' %
+              (key_count + 1, len(message), json_time * 1e6, decode_time * 1e6, json_time / decode_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""Measure how long an override takes to get from the server to an actuator, with the change feed and with polling
+
+Runs a real Bot (Bot.run, in a thread) against the local plantOS stub, with a real Groduino on a VirtualGroduino
+sending frames at --frame-rate. A slow groduino must not slow overrides down. Overrides an actuator on the stub every so often and times how long until the actuator has it. Also counts
+the requests for overrides/set points (actuator list, set points, change feed) per minute, while overriding and while
+nothing changes.
+Run from the repo root: python3 -m benchmarks.override_latency
+"""
+
+import argparse
+import logging
+import random
+import threading
+import time
+
+from services.arduino.communication import Groduino
+from services.bot import Bot
+from services.configuration import SerialParameters
+from services.server import Server
+from simulation.plantosStub import PlantosStub
+from simulation.virtualGroduino import VirtualGroduino, makeKeyList
+
+
+class _StopBot(Exception):
+    pass
+
+
+class _StoppableGroduino(Groduino):
+    """Raises _StopBot from receive once stop is set"""
+    stop = False
+
+    def receiveWithTimestamp(self, blocking=False, timeout=None):
+        if self.stop:
+            raise _StopBot
+        return super().receiveWithTimestamp(blocking, timeout)
+
+
+def measure(use_change_feed, poll_period, sample_count, max_gap, idle_time, frame_rate):
+    """Run a bot on a new stub and time sample_count overrides, then idle for idle_time
+    :return: (list of latencies, requests per minute for overrides/set points while overriding, and while idle)
+    """
+    stub = PlantosStub()
+    stub.start()
+    stub.addTopology(6, 3)
+    stub.setSetPoints({'ATM': 22.0})
+    Bot.use_change_feed = use_change_feed
+    server = Server(stub.base_url)
+    device = VirtualGroduino(makeKeyList(6, 3), baud_rate=115200, frame_rate=frame_rate)
+    device.start()
+    serial_parameters = SerialParameters()
+    serial_parameters.baud_rate = 115200
+    groduino = _StoppableGroduino(device.port_name, serial_parameters)
+    bot = Bot(groduino, server)
+    bot.server_update_period = poll_period
+    bot.status_period = 3600
+
+    def runBot():
+        try:
+            bot.run()
+        except _StopBot:
+            pass
+    thread = threading.Thread(target=runBot, name='bot', daemon=True)
+    thread.start()
+    time.sleep(1)       # let it do its first poll and connect the feed
+
+    actuator_url_list = [a['url'] for a in stub.resources_dictby_endpoint['actuator']]
+    endpoint_list = ('actuator', 'tray', 'changes')
+
+    def countRequests():
+        return sum(stub.request_count_dictby_endpoint.get(e, 0) for e in endpoint_list)
+    start_count = countRequests()
+    start_time = time.time()
+    latency_list = []
+    for sample in range(sample_count):
+        actuator = bot.getElementByUrl(random.choice(actuator_url_list))
+        value = float(sample % 2)
+        override_time = time.time()
+        stub.setOverride(actuator.url, value)
+        while not (actuator._override and actuator.state == value):
+            time.sleep(0.001)
+        latency_list.append(time.time() - override_time)
+        stub.setOverride(actuator.url, None)
+        time.sleep(random.uniform(0, max_gap))
+    requests_per_minute = (countRequests() - start_count) / (time.time() - start_time) * 60
+
+    start_count = countRequests()
+    time.sleep(idle_time)
+    idle_requests_per_minute = (countRequests() - start_count) / idle_time * 60
+
+    groduino.stop = True
+    thread.join()
+    groduino.close()
+    device.stop()
+    server.close()
+    stub.stop()
+    return latency_list, requests_per_minute, idle_requests_per_minute
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Override latency benchmark')
+    parser.add_argument('-n', '--samples', type=int, default=10)
+    parser.add_argument('-p', '--poll-period', type=float, default=5, help='Bot.server_update_period for polling')
+    parser.add_argument('-g', '--gap', type=float, default=2, help='max random wait between overrides')
+    parser.add_argument('-i', '--idle', type=float, default=30, help='secs to count requests with no changes')
+    parser.add_argument('-f', '--frame-rate', type=float, default=0.33, help='frames per second the groduino sends')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    Server._outbox_file_name = None
+    try:
+        for name, use_change_feed in (('change feed', True), ('polling', False)):
+            latency_list, requests_per_minute, idle_requests_per_minute = \
+                measure(use_change_feed, args.poll_period, args.samples, args.gap, args.idle, args.frame_rate)
+            latency_list.sort()
+            print('%-12s override latency avg %.3f, median %.3f, max %.3f secs. Requests/minute %.1f overriding, '
+                  '%.1f idle (poll period %.0f)' % (name, sum(latency_list) / len(latency_list),
+                                                   latency_list[len(latency_list) // 2], latency_list[-1],
+                                                   requests_per_minute, idle_requests_per_minute, args.poll_period))
+    finally:
+        Bot.use_change_feed = True
+
+
+if __name__ == '__main__':
+    main()
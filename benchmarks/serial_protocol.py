@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""Measure how many samples per second get through the serial link with ASCII frames vs binary frames
+
+Runs a Groduino against a VirtualGroduino on a pty, which paces its bytes to the baud rate like a real link, and
+sends frames as fast as the link allows. Counts the frames and samples (values) that come out of Groduino.receive,
+and checks the last one has every key the device sent.
+The last run starts at the lowest baud rate and lets Groduino climb --ladder, with a device that corrupts bytes above
+--reliable baud, to show where it settles.
+Run from the repo root: python3 -m benchmarks.serial_protocol
+"""
+
+import argparse
+import json
+import logging
+import time
+
+from services.arduino.communication import Groduino
+from services.configuration import SerialParameters
+from simulation.virtualGroduino import VirtualGroduino, makeKeyList
+
+
+def runLink(key_list, baud_rate, binary, duration, ladder=(), reliable_baud_rate=115200):
+    """Receive from a new virtual groduino for duration secs
+    :param ladder: baud rates for Groduino to try after connecting, see Groduino._negotiateBaudRate
+    :return: dict of results
+    """
+    device = VirtualGroduino(key_list, baud_rate=baud_rate, frame_rate=0, supports_binary=binary,
+                             reliable_baud_rate=reliable_baud_rate)
+    device.start()
+    serial_parameters = SerialParameters()
+    serial_parameters.baud_rate = baud_rate
+    serial_parameters.use_binary_protocol = binary
+    serial_parameters.baud_rate_ladder = ladder
+    groduino = Groduino(device.port_name, serial_parameters)
+    try:
+        frame_count = 0
+        sample_count = 0
+        message = None
+        start_time = time.time()
+        while time.time() - start_time < duration:
+            timestamped_message = groduino.receiveWithTimestamp(blocking=True, timeout=1)
+            if timestamped_message is None:
+                continue
+            message = timestamped_message[1]
+            frame_count += 1
+            sample_count += len(message) - 1 if isinstance(message, list) else message.count(':') - 1   # not GEND
+        elapsed = time.time() - start_time
+        item_list = message if isinstance(message, list) else list(json.loads(message).items())
+        assert [key for key, _ in item_list] == key_list + ['GEND'], 'Got %r' % message
+        return {'protocol': groduino.protocol, 'frames': frame_count / elapsed, 'samples': sample_count / elapsed,
+                'frame_bytes': len(device.makeFrame()), 'baud_rate': groduino.ser.baudrate}
+    finally:
+        groduino.close()
+        device.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serial protocol benchmark')
+    parser.add_argument('-b', '--baud', type=int, nargs='+', default=[9600, 115200])
+    parser.add_argument('-s', '--sensing-points', type=int, default=20)
+    parser.add_argument('-a', '--actuators', type=int, default=5)
+    parser.add_argument('-d', '--duration', type=float, default=3, help='seconds to receive for, per run')
+    parser.add_argument('-l', '--ladder', type=int, nargs='+', default=[19200, 38400, 57600, 115200],
+                        help='baud rates for the ladder run, see SerialParameters.baud_rate_ladder')
+    parser.add_argument('-r', '--reliable', type=int, default=57600,
+                        help='for the ladder run, the device corrupts bytes above this baud rate')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    key_list = makeKeyList(args.sensing_points, args.actuators)
+    for baud_rate in args.baud:
+        for binary in (False, True):
+            result = runLink(key_list, baud_rate, binary, args.duration)
+            print('%6d baud, %-6s frames: %5.0f bytes/frame, %7.1f frames/s, %8.0f samples/s' %
+                  (baud_rate, result['protocol'], result['frame_bytes'], result['frames'], result['samples']))
+
+    result = runLink(key_list, min(args.baud), True, args.duration, tuple(args.ladder), args.reliable)
+    print('%6d baud, climbing %s (reliable up to %d): settled at %d baud, %7.1f frames/s, %8.0f samples/s' %
+          (min(args.baud), tuple(args.ladder), args.reliable, result['baud_rate'], result['frames'],
+           result['samples']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""Check and measure compressed data point uploads against the local plantOS stub
+
+Posts the same batches through Server._postDataPoints with no compression, gzip and deflate, checks that the stub
+decoded exactly what was sent, and prints the bytes on the wire for each.
+Run from the repo root: python3 -m benchmarks.upload_compression
+"""
+
+import argparse
+import time
+
+from services.server import Server
+from simulation.plantosStub import PlantosStub
+
+
+def makeBatch(base_url, sensing_point_count, samples_per_point, start_time):
+    """Data points like Bot.collectDataPoints makes them, one every 5 seconds per sensing point"""
+    return [{'timestamp': int(start_time + sample * 5),
+             'value': round(20 + point * 0.5 + sample * 0.01, 2),
+             'sensing_point': '%ssensing_point/%d/' % (base_url, point + 1)}
+            for sample in range(samples_per_point) for point in range(sensing_point_count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compressed upload check/benchmark')
+    parser.add_argument('-s', '--sensing-points', type=int, default=20)
+    parser.add_argument('-n', '--samples', type=int, default=10, help='samples per sensing point per batch')
+    parser.add_argument('-b', '--batches', type=int, default=20)
+    args = parser.parse_args()
+
+    Server._outbox_file_name = None         # post straight through, we are calling _postDataPoints ourselves
+    stub = PlantosStub()
+    stub.start()
+    try:
+        for encoding in Server.compress_encodings:
+            server = Server(stub.base_url, compress_encoding=encoding)
+            del stub.datapoint_list[:]
+            sent_list = []
+            start_time = time.time()
+            for batch in range(args.batches):
+                values_list = makeBatch(stub.base_url, args.sensing_points, args.samples, start_time + batch * 100)
+                assert server._postDataPoints(values_list), 'post failed'
+                sent_list += values_list
+            elapsed = time.time() - start_time
+            server.close()
+
+            assert stub.datapoint_list == sent_list, 'stub decoded something different than we sent!'
+            print('%-8s %6d points in %d posts: %8d bytes raw, %8d bytes sent (%5.1f%%), %.1f ms/post' %
+                  (encoding or 'none', len(sent_list), args.batches, server._upload_raw_byte_count,
+                   server._upload_sent_byte_count,
+                   100.0 * server._upload_sent_byte_count / server._upload_raw_byte_count,
+                   elapsed / args.batches * 1000))
+        print('stub rejected %d posts, saw encodings %s' % (stub.rejected_post_count, stub.encoding_count_dictby_name))
+    finally:
+        stub.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -34,6 +34,17 @@ def commandLineInit():
     # Flags
     parser.add_argument('-p', '--port', help='serial port to connect to, default /dev/ttyACM0', default='/dev/ttyACM0')
     parser.add_argument('-s', '--server', help='Url of server to connect to. Should have trailing slash', default=None)
+    parser.add_argument('-z', '--compress', choices=['gzip', 'deflate'], default=None,
+                        help='Compress data point uploads. The server has to accept that Content-Encoding')
+    parser.add_argument('-t', '--snapshot', default='topology_snapshot.json',
+                        help="Topology snapshot file, so the bot can start without waiting on the server. '' for none")
+    parser.add_argument('-a', '--asyncio', action='store_true',
+                        help='Run the bot on asyncio (separate serial/control/server tasks) instead of the main loop')
+    parser.add_argument('-b', '--binary', action='store_true',
+                        help='Ask the groduino for binary frames. Its firmware has to support GBIN')
+    parser.add_argument('-l', '--baud-ladder', type=int, nargs='+', default=[],
+                        help='Baud rates to try after connecting, ex 19200 38400 57600 115200. '
+                             'Its firmware has to support GBAU')
 
     parser.add_argument('-v', '--verbose', action='store_true', help='Print verbose output')   # default False
     parser.add_argument('-i', '--info', action='store_true', help="Output info messages to show what's going on")
@@ -102,9 +113,19 @@ if __name__ == "__main__":
     cmdargs_dict = commandLineInit()
 
     serial_params = SerialParameters()
+    serial_params.use_binary_protocol = cmdargs_dict['binary']
+    serial_params.baud_rate_ladder = tuple(cmdargs_dict['baud_ladder'])
     groduino = hwInit(port=cmdargs_dict['port'], serial_parameters=serial_params)
     # TODO just init the server inside bot. Bot should take ip of server to connect to
-    server = Server(cmdargs_dict['server'])
+    server = Server(cmdargs_dict['server'], compress_encoding=cmdargs_dict['compress'],
+                    snapshot_file_name=cmdargs_dict['snapshot'] or None)
     bot = Bot(groduino, server)
 
-    bot.run()
+    try:
+        if cmdargs_dict['asyncio']:
+            bot.runAsync()
+        else:
+            bot.run()
+    finally:
+        bot.close()
+        server.close()      # commit any data points that are still waiting in the outbox
@@ -1,14 +1,29 @@
+import binascii
+import json
+import os
 import time
 import logging
+import select
 import serial
-import re
+import struct
 
 import sys
 if sys.version_info < (3, 3, 0):
     from requests import ConnectionError
 
+try:                    # Optional, only used to check big batches of frames. See Crc8.crcMany
+    import numpy
+except ImportError:
+    numpy = None
+
 
 class Crc8(object):
+    """CRC8 (Dallas/Maxim, reflected 0x8C) as computed by the groduino
+
+    Use Crc8.crc(data) for one message and Crc8.crcMany/checkMany to handle a batch of frames in one call.
+    All of them take bytes, bytearray or memoryview directly (str still works, it gets encoded as ASCII).
+    digest/_update are the original byte-at-a-time interface, kept so existing callers still work.
+    """
     TABLE = [
         0, 94, 188, 226, 97, 63, 221, 131, 194, 156, 126, 32, 163, 253, 31, 65,
         157, 195, 33, 127, 252, 162, 64, 30, 95, 1, 227, 189, 62, 96, 130, 220,
@@ -28,6 +43,11 @@ class Crc8(object):
         116, 42, 200, 150, 21, 75, 169, 247, 182, 232, 10, 84, 215, 137, 107, 53
     ]
 
+    _TABLE_BYTES = bytes(TABLE)
+    _table16 = None             # 64k table that handles two bytes per lookup. Built on first use, see _getTable16
+    _min_table16_length = 16    # shorter messages aren't worth the memoryview setup, just use TABLE
+    numpy_min_frames = 32       # crcMany will use numpy (if installed) for at least this many frames
+
     def __init__(self, sum_=0x00):
         self.sum = sum_
 
@@ -35,11 +55,337 @@ class Crc8(object):
             self.sum = self.TABLE[self.sum ^ b]
 
     def digest(self, st):
-        self.sum = 0
-        for ch in st:
-            self._update(ord(ch))
+        """Get the crc of a message
+        :param st: str or bytes. Frames come off the decoder as bytes
+        """
+        self.sum = self.crc(st)
         return self.sum
 
+    @classmethod
+    def crc(cls, data) -> int:
+        """Get the crc of a single message
+        :param data: bytes, bytearray, memoryview (or str)
+        :return: crc as int
+        """
+        if isinstance(data, str):
+            data = data.encode('ASCII')
+        crc = 0
+        length = len(data)
+        table16 = cls._getTable16() if length >= cls._min_table16_length else None
+        if table16 is None:
+            table = cls._TABLE_BYTES
+            for b in data:
+                crc = table[crc ^ b]
+            return crc
+
+        # Each native 16 bit word holds two bytes, the first in the low byte (little endian only, see _getTable16)
+        even_length = length & ~1
+        for word in memoryview(data)[:even_length].cast('B').cast('H'):
+            crc = table16[word ^ crc]
+        if even_length != length:
+            crc = cls._TABLE_BYTES[crc ^ data[-1]]
+        return crc
+
+    @classmethod
+    def crcMany(cls, frames) -> list:
+        """Get the crc of many messages at once
+        :param frames: list of bytes-like messages
+        :return: list of crc ints, same order as frames
+        """
+        frames = [f.encode('ASCII') if isinstance(f, str) else f for f in frames]
+        if numpy is None or len(frames) < cls.numpy_min_frames:
+            return [cls.crc(f) for f in frames]
+
+        # Since the crc starts at 0 and TABLE[0] == 0, leading zeros don't change it. So we can left pad every frame
+        # to the same length and run all of them through the table together, one column at a time
+        max_length = max(len(f) for f in frames)
+        padded = numpy.zeros((len(frames), max_length), dtype=numpy.uint8)
+        for row, f in enumerate(frames):
+            if len(f):
+                padded[row, max_length - len(f):] = numpy.frombuffer(f, dtype=numpy.uint8)
+        table = numpy.array(cls.TABLE, dtype=numpy.uint8)
+        crcs = numpy.zeros(len(frames), dtype=numpy.uint8)
+        for column in padded.T:
+            crcs = table[crcs ^ column]
+        return crcs.tolist()
+
+    @classmethod
+    def checkMany(cls, frames) -> list:
+        """Check the crc of many frames at once
+        :param frames: list of (text, crc) as returned by FrameDecoder
+        :return: list of bools, True if the crc matches. Same order as frames
+        """
+        computed_list = cls.crcMany([text for text, _ in frames])
+        return [computed == crc for computed, (_, crc) in zip(computed_list, frames)]
+
+    @classmethod
+    def _getTable16(cls):
+        """Get the 16 bit table: _table16[b1 << 8 | x] is the crc after feeding bytes b0, b1 to crc c, x = c ^ b0
+        :return: the table as bytes, None if this isn't a little endian machine (crc will fall back to TABLE)
+        """
+        if cls._table16 is None and sys.byteorder == 'little':
+            table = cls._TABLE_BYTES
+            cls._table16 = bytes(table[table[x] ^ b1] for b1 in range(256) for x in range(256))
+        return cls._table16
+
+
+class FrameDecoder:
+    """Incremental decoder for groduino frames: \\x01<length>\\x02<text>\\x03<crc>\\x04
+
+    Feed it raw bytes with feed() as they come off the serial port, then call nextFrame() (or iterate frames())
+    to get every complete frame as (text, crc). The header/length/text/crc/footer are handled by a small state
+    machine that works on a bytearray with a read position, so nothing is decoded or re-scanned from the start.
+    Consumed bytes are only cut off the front of the buffer once they make up most of it.
+
+    Anything that doesn't fit the frame structure (line noise, non-ASCII garbage, bad digits, wrong length) is
+    counted in invalid_frame_count/discarded_byte_count and skipped until the next startOfHeader. It never raises.
+    A corrupted length can't stall it: a startOfHeader can't be in the text, so if one turns up while waiting for
+    the text, the frame is dropped and the decoder resyncs on it.
+    The checksum is NOT checked here, that is up to the caller (see Groduino.receive)
+    """
+    _kStartOfHeaderByte = 1
+    _kStartOfTextByte = 2
+    _kEndOfTextByte = 3
+    _kEndOfTransmissionByte = 4
+    start_byte = _kStartOfHeaderByte    # every frame starts with this, for finding frames in raw bytes
+
+    _STATE_HEADER = 0       # looking for startOfHeader
+    _STATE_LENGTH = 1       # reading decimal length until startOfText
+    _STATE_TEXT = 2         # waiting for length bytes of text followed by endOfText
+    _STATE_CRC = 3          # reading decimal crc until endOfTransmission
+
+    _max_digits = 5         # length and crc are decimal. If we get more digits than this, the frame is garbage
+    _compact_size = 1024    # only cut consumed bytes off the front of the buffer when there are at least this many
+
+    def __init__(self, max_buffer_size=8192, cut_buffer_size=4096):
+        """
+        :param max_buffer_size: if more than this many unconsumed bytes are waiting, the buffer is cut down
+        :param cut_buffer_size: size to cut the buffer down to (keeps the newest bytes)
+        """
+        self.max_buffer_size = max_buffer_size
+        self.cut_buffer_size = cut_buffer_size
+        self.invalid_frame_count = 0
+        self.discarded_byte_count = 0
+        self._buffer = bytearray()
+        self.reset()
+
+    def reset(self):
+        """Throw away everything buffered and start looking for a new frame"""
+        del self._buffer[:]
+        self._pos = 0               # everything before _pos has been consumed
+        self._state = self._STATE_HEADER
+        self._frame_start = 0       # index of the startOfHeader of the frame being parsed
+        self._text_start = 0        # index of the first text byte
+        self._text_length = 0       # length from the header
+        self._text_scan_pos = 0     # text before this has been checked for a startOfHeader
+
+    def __len__(self):
+        """Number of buffered bytes that haven't been consumed yet"""
+        return len(self._buffer) - self._pos
+
+    def feed(self, data):
+        """Append raw bytes from the serial port
+        :param data: bytes, bytearray or memoryview
+        """
+        if self._pos >= self._compact_size and self._pos * 2 >= len(self._buffer):
+            self._compact()
+        self._buffer += data
+
+        if len(self) > self.max_buffer_size:
+            logging.critical('BUFFER IS TOO BIG! Cutting down to %d', self.cut_buffer_size)
+            self.discarded_byte_count += len(self) - self.cut_buffer_size
+            del self._buffer[:len(self._buffer) - self.cut_buffer_size]
+            self._pos = 0
+            self._state = self._STATE_HEADER
+
+    def frames(self):
+        """Generator yielding every complete frame currently in the buffer as (text, crc). See nextFrame"""
+        frame = self.nextFrame()
+        while frame is not None:
+            yield frame
+            frame = self.nextFrame()
+
+    def nextFrame(self):
+        """Get the next complete frame from the buffer
+        :return: (text, crc) where text is the bytes between startOfText and endOfText and crc is the int from the
+        footer, or None if there is no complete frame yet
+        """
+        buf = self._buffer
+        while True:
+            if self._state == self._STATE_HEADER:
+                start = buf.find(self._kStartOfHeaderByte, self._pos)
+                if start == -1:
+                    self._discard(len(buf) - self._pos)
+                    self._pos = len(buf)
+                    return None
+                self._discard(start - self._pos)
+                self._frame_start = start
+                self._pos = start + 1
+                self._state = self._STATE_LENGTH
+
+            elif self._state == self._STATE_LENGTH:
+                length = self._readNumber(self._kStartOfTextByte)
+                if length is None:
+                    return None
+                if length < 0 or length > self.max_buffer_size:
+                    self._invalidFrame()
+                    continue
+                self._text_length = length
+                self._text_start = self._text_scan_pos = self._pos
+                self._state = self._STATE_TEXT
+
+            elif self._state == self._STATE_TEXT:
+                text_end = self._text_start + self._text_length
+                scan_end = min(len(buf), text_end)
+                if buf.find(self._kStartOfHeaderByte, self._text_scan_pos, scan_end) != -1:    # bad length
+                    self._invalidFrame()
+                    continue
+                self._text_scan_pos = scan_end
+                if len(buf) <= text_end:        # need the text and the endOfText after it
+                    return None
+                if buf[text_end] != self._kEndOfTextByte:
+                    self._invalidFrame()
+                    continue
+                self._pos = text_end + 1
+                self._state = self._STATE_CRC
+
+            else:   # self._STATE_CRC
+                crc = self._readNumber(self._kEndOfTransmissionByte)
+                if crc is None:
+                    return None
+                if crc < 0:
+                    self._invalidFrame()
+                    continue
+                self._state = self._STATE_HEADER
+                text = bytes(buf[self._text_start:self._text_start + self._text_length])
+                return text, crc
+
+    def _readNumber(self, end_byte):
+        """Read a decimal number from _pos up to end_byte. On success, moves _pos past end_byte.
+        :return: the number, None if we need more data, -1 if the data can't be a number
+        """
+        buf = self._buffer
+        end = buf.find(end_byte, self._pos, self._pos + self._max_digits + 1)
+        if end == -1:
+            if len(buf) - self._pos > self._max_digits:
+                return -1
+            for b in buf[self._pos:]:       # at most _max_digits bytes, fail early on garbage
+                if not 48 <= b <= 57:
+                    return -1
+            return None
+        digits = buf[self._pos:end]
+        if not digits.isdigit():
+            return -1
+        self._pos = end + 1
+        return int(digits)
+
+    def _invalidFrame(self):
+        """Drop the frame being parsed and resync on the next startOfHeader after its start"""
+        self.invalid_frame_count += 1
+        logging.error('Received invalid frame, discarding: %r', bytes(self._buffer[self._frame_start:self._pos]))
+        self._pos = self._frame_start + 1
+        self.discarded_byte_count += 1
+        self._state = self._STATE_HEADER
+
+    def _discard(self, count):
+        if count > 0:
+            self.discarded_byte_count += count
+            logging.debug('Discarding %d bytes outside of a frame', count)
+
+    def takeUnconsumed(self):
+        """Get the bytes after the last frame returned, and reset. Used to hand them to another decoder
+        :return: bytes
+        """
+        start = self._pos if self._state == self._STATE_HEADER else self._frame_start
+        data = bytes(self._buffer[start:])
+        self.reset()
+        return data
+
+    def _compact(self):
+        """Cut the consumed bytes off the front of the buffer, shifting the parse indexes"""
+        # If we are in the middle of a frame, keep it all so we can still resync from its start
+        shift = self._pos if self._state == self._STATE_HEADER else self._frame_start
+        del self._buffer[:shift]
+        self._pos -= shift
+        self._frame_start -= shift
+        self._text_start -= shift
+        self._text_scan_pos -= shift
+
+
+class BinaryFrameDecoder(FrameDecoder):
+    """Incremental decoder for the groduino's binary frames: \\x0e<length><payload><crc>\\x0f
+
+    length is the payload length as a little endian uint16, crc is one byte (Crc8 of the payload). The payload is a
+    5 byte sample per element: id (uint8, index in the key list the groduino sent when we agreed on binary frames, see
+    Groduino._negotiateProtocol) and value (little endian float32). A sample takes 5 bytes instead of ~15 for
+    '"SATM 1":22.80,', and there is no decimal length/crc to read.
+    Works like FrameDecoder: feed() bytes, nextFrame()/frames() give (payload, crc), anything that doesn't fit the
+    structure is counted and skipped until the next startByte, checking the crc is up to the caller
+    """
+    _kStartByte = 0x0e          # shift out
+    _kEndByte = 0x0f            # shift in
+    start_byte = _kStartByte
+    sample_struct = struct.Struct('<Bf')
+    max_key_count = 256                 # ids are a uint8. More elements than this have to use ASCII frames
+    max_payload_length = max_key_count * 5      # every id once
+
+    @classmethod
+    def packFrame(cls, sample_list) -> bytes:
+        """Make a frame, like the groduino does
+        :param sample_list: list of (element id, value)
+        :return: the frame bytes, ready to write to the port
+        """
+        payload = b''.join([cls.sample_struct.pack(element_id, value) for element_id, value in sample_list])
+        return (bytes([cls._kStartByte]) + struct.pack('<H', len(payload)) + payload +
+                bytes([Crc8.crc(payload), cls._kEndByte]))
+
+    @classmethod
+    def unpackSamples(cls, payload) -> list:
+        """Get the samples from the payload of a frame
+        :return: list of (element id, value)
+        """
+        return list(cls.sample_struct.iter_unpack(payload))
+
+    def nextFrame(self):
+        """Get the next complete frame from the buffer
+        :return: (payload, crc) where payload is the bytes between length and crc, or None if there is no complete
+        frame yet
+        """
+        buf = self._buffer
+        sample_size = self.sample_struct.size
+        while True:
+            start = buf.find(self._kStartByte, self._pos)
+            if start == -1:
+                self._discard(len(buf) - self._pos)
+                self._pos = len(buf)
+                return None
+            self._discard(start - self._pos)
+            self._pos = start           # stays on the startByte until the frame is complete
+            if len(buf) < start + 3:
+                return None
+            length = buf[start + 1] | buf[start + 2] << 8
+            if length > self.max_payload_length or length % sample_size != 0:
+                self._invalidBinaryFrame(start)
+                continue
+            crc_index = start + 3 + length
+            if len(buf) < crc_index + 2:        # need the crc and the endByte
+                return None
+            if buf[crc_index + 1] != self._kEndByte:
+                self._invalidBinaryFrame(start)
+                continue
+            self._pos = crc_index + 2
+            return bytes(buf[start + 3:crc_index]), buf[crc_index]
+
+    def _invalidBinaryFrame(self, start):
+        self._frame_start = start
+        self._pos = start + 3
+        self._invalidFrame()
+
+    def _compact(self):
+        """Cut the consumed bytes off the front of the buffer. _pos is always at the start of a frame (or the end)"""
+        del self._buffer[:self._pos]
+        self._pos = 0
+
 
 class Groduino:
     # ASCII Controls
@@ -50,8 +396,15 @@ class Groduino:
     _kEnquireByte = b'\x05'
     _kAcknowledgeByte = b'\x06'
 
-    _MESSAGEBUFFER_SIZE = 8192
+    _MESSAGEBUFFER_SIZE = 8192      # smallest the limits get, see _scaleBufferLimits
     _MESSAGEBUFFER_CUT_SIZE = 4096
+    _kBinaryCommand = 'GBIN 1'      # asks the groduino for binary frames, see _negotiateProtocol
+    _kBaudRateCommand = 'GBAU'      # asks the groduino to switch baud rate, see _negotiateBaudRate
+    _kProbeCommand = 'GPRB'         # the groduino echoes it back
+    _kBaudRateConfirmCommand = 'GBOK'   # keeps the new baud rate. If this doesn't come, the groduino goes back
+    _probe_payload_size = 32        # random bytes per probe frame (sent as hex)
+    _confirm_attempts = 3           # GBOK is sent up to this many times until the groduino echoes it
+    _confirm_reply_timeout = 0.2    # seconds to wait for the echo of each GBOK
 
     def __init__(self, port, serial_parameters):
         """
@@ -59,7 +412,24 @@ class Groduino:
         :param serial_parameters: instance of configuration.SerialParameters
         :return: groduino instance that can Send/Receive, etc
         """
-        self._message_buffer = ''
+        self._message_buffer_size = self._MESSAGEBUFFER_SIZE
+        self._message_buffer_cut_size = self._MESSAGEBUFFER_CUT_SIZE
+        self._overflow_size = 3500  # rpi serial buffer is 4k. see _scaleBufferLimits
+        self._decoder = FrameDecoder(self._message_buffer_size, self._message_buffer_cut_size)
+        self._reader = None         # SerialReader, if running all reads go through it. see startReader
+        self._received_byte_count = 0   # read from the port without the reader, see _acquireNewTransmission
+        self.protocol = 'ascii'     # 'binary' once the groduino agreed to send binary frames, see _negotiateProtocol
+        self._binary_key_list = []  # message key by element id, for binary frames. ex ['SATM 1', 'SAHU 1']
+        self.use_binary_protocol = serial_parameters.use_binary_protocol
+        self.negotiation_timeout = serial_parameters.protocol_negotiation_timeout
+        self.baud_rate_ladder = serial_parameters.baud_rate_ladder
+        self.probe_frame_count = serial_parameters.baud_probe_frame_count
+        self.probe_max_error_rate = serial_parameters.baud_probe_max_error_rate
+        self.baud_confirm_timeout = serial_parameters.baud_confirm_timeout
+        self.serial_buffer_size = serial_parameters.serial_buffer_size
+        self.overflow_margin_time = serial_parameters.overflow_margin_time
+        self.message_buffer_time = serial_parameters.message_buffer_time
+        self.link_bytes_per_second = serial_parameters.baud_rate / 10      # measured by _negotiateBaudRate
 
         self.ser = serial.Serial(port, baudrate=serial_parameters.baud_rate,
                                  timeout=serial_parameters.serial_read_timeout)
@@ -67,11 +437,43 @@ class Groduino:
         self.timeout = serial_parameters.receive_message_timeout
         self._reciprocateNewConnection()
 
+        if serial_parameters.use_reader_thread:
+            self.startReader(serial_parameters.frame_ring_size)
+
     def close(self):
         """End the serial connection
         """
+        self.stopReader()
         self.ser.close()
 
+    def startReader(self, ring_size=256):
+        """Start a SerialReader thread that drains the port continuously. After this, receive reads from its ring
+        :param ring_size: max frames the reader holds before dropping the oldest
+        """
+        from .serialReader import SerialReader      # here to avoid a circular import, serialReader uses Crc8, etc
+        if self._reader is None:     # takes over our decoder, it may have bytes in it already
+            self._reader = SerialReader(self.ser, ring_size, decoder=self._decoder)
+        self._reader.start()
+
+    def stopReader(self):
+        """Stop the SerialReader thread, if there is one. receive goes back to reading the port directly"""
+        if self._reader is not None:
+            self._reader.stop()
+            self._reader = None
+
+    def getStatusList(self):
+        if self.protocol == 'binary':
+            status_list = ['Serial protocol: binary frames, %d keys' % len(self._binary_key_list)]
+        else:
+            status_list = ['Serial protocol: ASCII frames']
+        status_list.append('Serial link: %d baud, %.0f bytes/s, overflow at %d, buffer %d' %
+                           (self.ser.baudrate, self.link_bytes_per_second, self._overflow_size,
+                            self._message_buffer_size))
+        if self._reader is None:
+            return status_list + ['Serial reader: not running, %d invalid frames, %d bytes discarded' %
+                                  (self._decoder.invalid_frame_count, self._decoder.discarded_byte_count)]
+        return status_list + self._reader.getStatusList()
+
     def send(self, message):
         """Send a message to the groduino. Will wrap it in proper start/end symbols
         :param message: message to send, no start or end symbols. ex message='ALP 1 1'
@@ -79,49 +481,75 @@ class Groduino:
         """
 
         logging.info("Sending: " + message)
-        packed_message = chr(1)     # start of header
-        packed_message += str(len(message))
-        packed_message += chr(2)    # start of text
-        packed_message += message
-        packed_message += chr(3)    # end of text
-        crc8 = Crc8()
-        packed_message += str(crc8.digest(message))
-        packed_message += chr(4)    # end of transmission
-        self.ser.write(bytes(packed_message, 'UTF-8'))
-
-    def receive(self, blocking=False):
+        message_bytes = message.encode('UTF-8')
+        packed_message = b'\x01'   # start of header
+        packed_message += str(len(message_bytes)).encode('ASCII')
+        packed_message += b'\x02'  # start of text
+        packed_message += message_bytes
+        packed_message += b'\x03'  # end of text
+        packed_message += str(Crc8.crc(message_bytes)).encode('ASCII')
+        packed_message += b'\x04'  # end of transmission
+        self.ser.write(packed_message)
+
+    def receive(self, blocking=False, timeout=None):
         """ Gets a message from the groduino and returns it if available, else None.
+        :param blocking: if True and there is no message yet, sleep until one comes in (or timeout passes)
+        :param timeout: max seconds to block for. If None, uses receive_message_timeout from SerialParameters
         :return: single json string with all current sensor values (clean, no begin/end symbols). No trailing comma
-        None if no message available
+        With binary frames, a list of (key, value) instead (see _decodeMessage). None if no message available
+        """
+        timestamped_message = self.receiveWithTimestamp(blocking=blocking, timeout=timeout)
+        if timestamped_message is None:
+            return None
+        return timestamped_message[1]
+
+    def receiveWithTimestamp(self, blocking=False, timeout=None):
+        """Same as receive, but also returns when the message arrived.
+        With the reader thread running, this is when the frame came off the port, not when we got to it
+        Blocking never spins: it waits on the reader's condition, or select()s on the port without the reader
+        :return: (timestamp, message) or None if no message available
         """
+        if timeout is None:
+            timeout = self.timeout
+        if not blocking:
+            timeout = 0
+
+        if self._reader is not None:
+            incoming = self._reader.get(timeout)
+            if incoming is None:
+                return None
+            timestamp, message = incoming               # crc was already checked by the reader
+            try:
+                return timestamp, self._decodeMessage(message)
+            except ValueError:
+                logging.error("Received invalid message, discarding: %r:", message)
+                return None
+
         # Acquire New Messages
-        incoming_message = self._acquireNewTransmission()
-        while blocking and incoming_message is None:        # Block until we get a message, valid or not
-            incoming_message = self._acquireNewTransmission()
+        deadline = time.time() + timeout
+        incoming_frame = self._acquireNewTransmission()
+        while incoming_frame is None:          # Block until we get a message, valid or not (or deadline passes)
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            self._waitForData(remaining)
+            incoming_frame = self._acquireNewTransmission()
 
-        if incoming_message is None:
+        if incoming_frame is None:
             logging.debug('No new message!')                # TODO too much spam
             return None
-        # logging.debug('Received: %s', incoming_message)   # Should be logged higher up anyways
 
+        # Structure (header, length, footer) was already checked by the decoder
+        message, crc_received = incoming_frame
         try:
-            # get:     header between \x01 and \x02     message    footer between \x03 and \x04
-            # header and footer should be decimal only
-            reggie = re.search(r"^\x01([0-9]*)\x02(.*)\x03([0-9]*)\x04$", incoming_message)
-            message_length, clean_message, crc_received = reggie.groups()
-            message_length = int(message_length)
-            crc_received = int(crc_received)
-            assert len(clean_message) == message_length
             if crc_received == 256:
                 raise ConnectionError
-            self._compareChecksums(crc_received, clean_message)
-            clean_message = clean_message.strip(',')
-            return clean_message
-
-        # AttributeError->failed search, ValueError->not enough groups or int('string')
-        # AssertionError->(obvious), ConnectionError->checksum
-        except (AttributeError, ValueError, AssertionError, ConnectionError):
-            logging.error("Received invalid message, discarding: %s:", incoming_message)
+            self._compareChecksums(crc_received, message)
+            return time.time(), self._decodeMessage(message)
+
+        # ValueError->line noise that made it into the text (or unknown element id), ConnectionError->checksum
+        except (ValueError, ConnectionError):
+            logging.error("Received invalid message, discarding: %r:", message)
             logging.debug('', exc_info=True)
             return None
 
@@ -154,73 +582,268 @@ class Groduino:
                             if incoming_char == self._kAcknowledgeByte:
                                 logging.info("Received acknowledgement")
                                 logging.info("Success in %f sec", time.time() - start_time)
+                                self._negotiateBaudRate()
+                                if self.use_binary_protocol:
+                                    self._negotiateProtocol()
                                 return
 
+    def _negotiateBaudRate(self):
+        """Climb baud_rate_ladder, right after the handshake, and stay at the fastest rate that works
+
+        For each rate (faster than the one we are at): send GBAU <rate>. A groduino that can answers {"GBAU": rate}
+        and switches, and we switch too. Then we check the link with probe frames it echoes back (see _probeLink).
+        If few enough are lost or corrupted we send GBOK, it keeps the rate and echoes {"GBOK": rate}, and we try the
+        next one. We only keep the rate once we have the echo (see _confirmBaudRate).
+        If not, we go back to the previous rate, and so does the groduino, since it didn't get GBOK within
+        baud_confirm_timeout. Firmware that doesn't know GBAU doesn't answer, so we stay at the rate we are at.
+        Then the buffer limits are scaled to the throughput measured on the last good probe, see _scaleBufferLimits
+        :return: the baud rate we ended up at
+        """
+        for baud_rate in sorted(self.baud_rate_ladder):
+            previous_baud_rate = self.ser.baudrate
+            if baud_rate <= previous_baud_rate:
+                continue
+            self.send('%s %d' % (self._kBaudRateCommand, baud_rate))
+            reply = self._waitForReply(b'{"GBAU"', time.time() + self.negotiation_timeout)
+            if reply is None or reply.get('GBAU') != baud_rate:
+                logging.info('Groduino did not agree to %d baud, staying at %d', baud_rate, previous_baud_rate)
+                break
+            self.ser.baudrate = baud_rate
+
+            error_rate, bytes_per_second = self._probeLink()
+            if error_rate > self.probe_max_error_rate:
+                logging.warning('%d baud lost %.0f%% of the probe frames, going back to %d',
+                                baud_rate, error_rate * 100, previous_baud_rate)
+                self._revertBaudRate(previous_baud_rate)
+                break
+            if not self._confirmBaudRate(baud_rate):
+                logging.warning('Groduino did not echo GBOK at %d baud, going back to %d', baud_rate,
+                                previous_baud_rate)
+                if not self._revertBaudRate(previous_baud_rate, baud_rate):
+                    self.link_bytes_per_second = bytes_per_second or baud_rate / 10
+                break
+            self.link_bytes_per_second = bytes_per_second or baud_rate / 10
+            logging.info('Switched to %d baud, %.0f bytes/s', baud_rate, self.link_bytes_per_second)
+
+        self._scaleBufferLimits()
+        return self.ser.baudrate
+
+    def _confirmBaudRate(self, baud_rate):
+        """Send GBOK until the groduino echoes {"GBOK": baud_rate}, _confirm_attempts times at most
+        :return: True if it did
+        """
+        for i in range(self._confirm_attempts):
+            self.send('%s %d' % (self._kBaudRateConfirmCommand, baud_rate))
+            reply = self._waitForReply(b'{"GBOK"', time.time() + self._confirm_reply_timeout)
+            if reply is not None and reply.get('GBOK') == baud_rate:
+                return True
+        return False
+
+    def _revertBaudRate(self, previous_baud_rate, new_baud_rate=None):
+        """Go back to previous_baud_rate, after the groduino has given up on the new one too
+        If a GBOK might have got through (only its echo got lost), the groduino may have kept new_baud_rate. If the
+        link doesn't work at previous_baud_rate, we go to new_baud_rate then
+        :param new_baud_rate: the rate we sent GBOK for, None if we never did
+        :return: False if we ended up at new_baud_rate after all
+        """
+        self.ser.baudrate = previous_baud_rate
+        time.sleep(self.baud_confirm_timeout)       # wait for the groduino to give up on it too
+        self.ser.reset_input_buffer()
+        self._decoder.reset()
+        if new_baud_rate is None or self._probeLink()[0] <= self.probe_max_error_rate:
+            return True
+        logging.warning('Nothing comes through at %d baud, the groduino kept %d', previous_baud_rate, new_baud_rate)
+        self.ser.baudrate = new_baud_rate
+        self.ser.reset_input_buffer()
+        self._decoder.reset()
+        return False
+
+    def _probeLink(self):
+        """Send probe_frame_count probe frames with random payloads and see how many come back intact
+        :return: (error rate 0-1, bytes/s read while they came back, None if it couldn't tell)
+        """
+        payload_set = set()
+        for i in range(self.probe_frame_count):
+            payload = binascii.hexlify(os.urandom(self._probe_payload_size)).decode('ASCII')
+            payload_set.add(payload)
+            self.send('%s %s' % (self._kProbeCommand, payload))
+
+        # echoes are ~2x the payload on the wire. give them 3x the time they take at the rate we asked for
+        expected_time = self.probe_frame_count * self._probe_payload_size * 2 * 10 / self.ser.baudrate
+        deadline = time.time() + self.negotiation_timeout + 3 * expected_time
+        good_count = 0
+        first_time = first_byte_count = None
+        while payload_set:
+            reply = self._waitForReply(b'{"GPRB"', deadline)
+            if reply is None:
+                break
+            if reply.get('GPRB') in payload_set:
+                payload_set.discard(reply['GPRB'])
+                good_count += 1
+                if first_time is None:
+                    first_time, first_byte_count = time.time(), self._received_byte_count
+                last_time, last_byte_count = time.time(), self._received_byte_count
+
+        bytes_per_second = None
+        if good_count > 1 and last_time > first_time:
+            bytes_per_second = (last_byte_count - first_byte_count) / (last_time - first_time)
+        return 1 - good_count / self.probe_frame_count, bytes_per_second
+
+    def _scaleBufferLimits(self):
+        """Scale the buffer limits to link_bytes_per_second. At 9600 baud they come out about the same as they were:
+        purge when the serial buffer has 3.5k (less than overflow_margin_time from full), and let the decoder hold
+        ~8k (message_buffer_time). Faster links fill them faster, so the overflow point comes down and the decoder
+        gets bigger
+        """
+        bytes_per_second = self.link_bytes_per_second
+        self._overflow_size = max(self.serial_buffer_size // 2,
+                                  int(self.serial_buffer_size - bytes_per_second * self.overflow_margin_time))
+        self._message_buffer_size = max(self._MESSAGEBUFFER_SIZE, int(bytes_per_second * self.message_buffer_time))
+        self._message_buffer_cut_size = self._message_buffer_size // 2
+        self._decoder.max_buffer_size = self._message_buffer_size
+        self._decoder.cut_buffer_size = self._message_buffer_cut_size
+        logging.info('Serial overflow at %d bytes, decoder buffer %d', self._overflow_size, self._message_buffer_size)
+
+    def _waitForReply(self, prefix, deadline):
+        """Wait for an ASCII frame from the groduino starting with prefix, dropping any other frames. Only used while
+        connecting, before the reader thread is started
+        :param prefix: start of the frame text, ex b'{"GBIN"'
+        :param deadline: time.time() to give up at
+        :return: the frame parsed as json (dict), None if there wasn't one in time
+        """
+        while time.time() < deadline:
+            frame = self._acquireNewTransmission()
+            if frame is None:
+                self._waitForData(deadline - time.time())
+                continue
+            text, crc = frame
+            if crc != Crc8.crc(text):
+                continue
+            text = text.strip(b',')         # like _decodeMessage, the firmware can add a trailing comma
+            if not text.startswith(prefix):
+                continue
+            try:
+                reply = json.loads(text.decode('ASCII'))
+            except ValueError:
+                logging.error('Bad reply from the groduino: %r', text)
+                continue
+            if isinstance(reply, dict):
+                return reply
+        return None
+
+    def _negotiateProtocol(self):
+        """Ask the groduino for binary frames, right after the handshake. See BinaryFrameDecoder
+
+        If it can, it answers with an ASCII frame {"GBIN": 1, "keys": ["SATM 1", ...]}, the message key for each
+        element id, and sends binary frames from then on. Firmware that doesn't know GBIN ignores it and keeps sending
+        ASCII frames, so if there is no answer within negotiation_timeout we stay on ASCII. So does firmware with more
+        elements than BinaryFrameDecoder.max_key_count, there are no ids for them.
+        ASCII frames that come in while waiting are dropped
+        :return: True if we switched to binary frames
+        """
+        self.send(self._kBinaryCommand)
+        reply = self._waitForReply(b'{"GBIN"', time.time() + self.negotiation_timeout)
+        if reply is None:
+            logging.info('Groduino did not answer %s, using ASCII frames', self._kBinaryCommand)
+            return False
+        key_list = reply.get('keys')
+        if not isinstance(key_list, list):
+            logging.error("Couldn't read the binary frame keys from the groduino, using ASCII: %r", reply)
+            return False
+
+        leftover = self._decoder.takeUnconsumed()       # the first binary frames may be in there already
+        self._decoder = BinaryFrameDecoder(self._message_buffer_size, self._message_buffer_cut_size)
+        self._decoder.feed(leftover)
+        self._binary_key_list = list(key_list)
+        self.protocol = 'binary'
+        logging.info('Groduino sends binary frames, %d keys', len(key_list))
+        return True
+
+    def _decodeMessage(self, message):
+        """Turn the text of a checked frame into what receive returns. Raises ValueError if it can't
+        :param message: frame text (ASCII) or payload (binary) bytes
+        :return: str for ASCII frames. For binary, list of (key, value) ending with ('GEND', 0) like the ASCII ones.
+        Values are rounded to 4 decimals, float32 would turn 22.8 into 22.799999237060547
+        """
+        if self.protocol == 'binary':
+            key_list = self._binary_key_list
+            try:
+                item_list = [(key_list[element_id], round(value, 4))
+                             for element_id, value in BinaryFrameDecoder.unpackSamples(message)]
+            except (IndexError, struct.error):
+                raise ValueError('Bad binary frame')
+            item_list.append(('GEND', 0))
+            return item_list
+        return message.decode('ASCII').strip(',')
+
     def _acquireNewTransmission(self):
-        """Get a new (unchecked) message from the groduino (low-level).
-
-        This function does a little bit of magic by using self._message_buffer.
-        First it checks how many bytes are available in the buffer. If > 3.5k, it (neatly) flushes and logs overflow.
-        We also check if _message_buffer is too big and flush
-            So when we flush we may or may not get a complete message
-        Then it appends all available bytes to the buffer
-        Then it checks if there is a complete message in the buffer. If so, it sends it.
-            It looks for a complete message ONLY by the endOfTransmission char. So if we have a bunch of crap,
-            it will just get all of it until the next endOfTransmission. It will be filtered by the next level up,
-            which verifies structure and checksum. This prevents hanging - it will just wait until the next end
-
-        Note: this now blocks after flushing the buffer until we can get a complete message
+        """Get a new (unchecked) frame from the groduino (low-level).
+
+        Reads all available bytes into self._decoder, then returns the next complete frame from it, if any.
+        First it checks how many bytes are available on the port. If > 3.5k, it (neatly) flushes and logs overflow.
+        The decoder cuts itself down if it gets too big, so when we flush we may or may not get a complete message.
+        Frames are only checked for structure here (see FrameDecoder), the checksum is checked by receive
+
+        Note: this now blocks after flushing the buffer until we can get a complete message (or self.timeout passes)
         This is better since we don't want to post right after flushing the buffer, serial is more important
-        :return: on success: a string that ends with endOfTransmission. on failure: None
+        :return: on success: (text bytes, crc int). on failure: None
         """
 
         # TODO Should store the last time we got a message so we can reset connection if it dies
         bytes_available_int = self.ser.inWaiting()
         # logging.debug('bytes: %d', bytes_available_int)
-        # even if bytes_available is 0, we should check if we have any messages from before
-
-        # First check if _message_buffer is too big. If so, chop it
-        if len(self._message_buffer) > self._MESSAGEBUFFER_SIZE:
-            logging.critical('BUFFER IS TOO BIG! Cutting down to %d', self._MESSAGEBUFFER_CUT_SIZE)
-            self._message_buffer = self._message_buffer[-self._MESSAGEBUFFER_CUT_SIZE:]  # note negative index
+        # even if bytes_available is 0, we should check if we have any frames from before
 
-        if bytes_available_int > 3500:   # rpi serial buffer is 4k. If we are starting to get close, we need to flush
-            # dump _message_buffer and try to get the last complete message
-            # if there isn't one, get everything in the serial buffer from last startOfHeader onwards!
+        if bytes_available_int > self._overflow_size:   # serial buffer is getting close to full, we need to flush
+            # dump the decoder and try to get the last complete message
+            # if there isn't one, get everything in the serial buffer from last start of a frame onwards!
             logging.error('Buffer overflow! Serial available %d. Purging', bytes_available_int)
-            new_bytes = self.ser.read(bytes_available_int).decode('ASCII')
-            last_start_index = new_bytes.rfind(chr(self._kStartOfHeaderByte))
+            new_bytes = self.ser.read(bytes_available_int)
+            self._received_byte_count += len(new_bytes)
+            self._decoder.reset()
+            # the start byte of whichever frames we get now (ASCII or binary). A binary payload can hold it too, then
+            # the decoder skips the bad frame and finds the next start
+            start_byte = self._decoder.start_byte
+            last_start_index = new_bytes.rfind(start_byte)
             if last_start_index == -1:  # if we can't find a start, this is an error.
-                logging.error("Can't find startOfHeader in data after overflow. Is message size too big (>2k)?")
-                logging.debug('new data: %s', new_bytes)
-                self._message_buffer = ''  # No point in storing new_bytes, it doesn't have a start - can't be parsed
+                logging.error("Can't find a frame start in data after overflow. Is message size too big (>2k)?")
+                logging.debug('new data: %r', new_bytes)
+                return None             # No point in storing new_bytes, it doesn't have a start - can't be parsed
+
+            # If we can find start, try to find another start before it and hope its a good message
+            prior_start_index = new_bytes.rfind(start_byte, 0, last_start_index)
+            if prior_start_index == -1:     # If there is only one start, wait for a full message
+                self._decoder.feed(new_bytes[last_start_index:])
+                deadline = time.time() + self.timeout
+                while time.time() < deadline:      # block here until we get a full message
+                    self._waitForData(deadline - time.time())
+                    single_frame = self._acquireNewTransmission()
+                    if single_frame is not None:
+                        return single_frame
                 return None
-            else:           # If we can find start, try to find another start before it and hope its a good message
-                prior_start_index = new_bytes[:last_start_index].rfind(chr(self._kStartOfHeaderByte))
-                if prior_start_index == -1:     # If there is only one start, wait for a full message
-                    self._message_buffer = new_bytes[last_start_index:]
-                    while True:                 # block here until we get a full message
-                        single_message = self._acquireNewTransmission()
-                        if single_message is not None:
-                            return single_message
-                else:           # If we can find another start before the last, keep it and everything after
-                    self._message_buffer = new_bytes[prior_start_index:]
-        else:  # everything ok, just append all the new data
-            self._message_buffer += self.ser.read(bytes_available_int).decode('ASCII')
-
-        # try to get everything up to the endOfTransmission
-        end_index = self._message_buffer.find(chr(self._kEndOfTransmissionByte))
-        if end_index == -1:  # no endOfTransmission, just return None
-            return None
+            else:           # If we can find another start before the last, keep it and everything after
+                self._decoder.feed(new_bytes[prior_start_index:])
+        elif bytes_available_int > 0:  # everything ok, just feed all the new data
+            new_bytes = self.ser.read(bytes_available_int)
+            self._received_byte_count += len(new_bytes)
+            self._decoder.feed(new_bytes)
+
+        return self._decoder.nextFrame()
 
-        single_message = self._message_buffer[:end_index+1]   # python slices up to, but not including, the end index
-        self._message_buffer = self._message_buffer[end_index+1:]
-        return single_message
+    def _waitForData(self, timeout):
+        """Sleep until the port has data to read or timeout seconds pass. Uses select on the port's fd"""
+        if timeout <= 0:
+            return
+        try:
+            fd = self.ser.fileno()
+        except (AttributeError, NotImplementedError, ValueError):    # not a real port (ex loop://), can't select
+            time.sleep(min(timeout, self.ser.timeout or timeout))
+            return
+        select.select([fd], [], [], timeout)
 
     @staticmethod
     def _compareChecksums(crc_received, message):
-        crc8 = Crc8()
-        if crc_received != crc8.digest(message):
+        if crc_received != Crc8.crc(message):
             logging.error("Checksums do not match")
             raise ConnectionError
         return 1
@@ -0,0 +1,142 @@
+import collections
+import logging
+import select
+import threading
+import time
+
+import serial
+
+from .communication import Crc8, FrameDecoder
+
+
+class SerialReader:
+    """Background thread that drains the serial port into a bounded ring buffer of checked frames
+
+    The thread reads whatever the port has (blocking up to the serial read timeout), feeds it through a FrameDecoder,
+    checks the crc of all the frames that completed in one go (Crc8.checkMany) and appends the good ones to the ring
+    as (timestamp, text). timestamp is when the chunk that completed the frame came off the port, so readings can be
+    stamped with when they arrived, not when the control loop got around to them.
+
+    The ring is a deque with maxlen. There is a single producer (this thread) and a single consumer (see get), and
+    append/popleft on a deque are atomic, so no lock is needed. If the consumer falls behind, the oldest frames are
+    dropped and counted in dropped_frame_count.
+    The condition _frame_available is only used for wakeups, so a consumer can sleep until a frame comes in (see get)
+    """
+    _error_sleep_time = 1       # if reading the port fails, wait this long before trying again
+    _idle_wait_time = 0.25      # when the port is quiet, select on it this long at a time (also how fast stop works)
+
+    def __init__(self, ser: serial.Serial, ring_size=256, max_buffer_size=8192, cut_buffer_size=4096, decoder=None):
+        """
+        :param ser: open serial.Serial instance. Only this thread should read from it while running (writing is ok)
+        :param ring_size: max number of frames to hold before dropping the oldest
+        :param max_buffer_size: see FrameDecoder
+        :param cut_buffer_size: see FrameDecoder
+        :param decoder: FrameDecoder (or BinaryFrameDecoder) to use. If None, makes a FrameDecoder
+        """
+        self.ser = ser
+        self.ring_size = ring_size
+        self.frame_count = 0            # good frames appended to the ring
+        self.dropped_frame_count = 0    # good frames that got pushed out of the ring before being read
+        self.bad_crc_count = 0          # frames that failed the crc
+        self.bytes_read_count = 0
+
+        self._decoder = decoder if decoder is not None else FrameDecoder(max_buffer_size, cut_buffer_size)
+        self._ring = collections.deque(maxlen=ring_size)
+        self._frame_available = threading.Condition()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the reader thread. Does nothing if it is already running"""
+        if self.is_running:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='serial reader', daemon=True)
+        self._thread.start()
+        logging.info('Serial reader started')
+
+    def stop(self, timeout=2):
+        """Stop the reader thread and wait for it (up to timeout seconds)"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        logging.info('Serial reader stopped')
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def __len__(self):
+        """Number of frames waiting in the ring"""
+        return len(self._ring)
+
+    def get(self, timeout=0):
+        """Get the oldest frame from the ring
+        :param timeout: if the ring is empty, sleep until a frame comes in, for at most this many seconds
+        :return: (timestamp, text bytes) or None if the ring is (still) empty
+        """
+        try:
+            return self._ring.popleft()
+        except IndexError:
+            if timeout <= 0:
+                return None
+
+        deadline = time.time() + timeout
+        with self._frame_available:
+            while not self._ring:
+                remaining = deadline - time.time()
+                if remaining <= 0 or not self.is_running:
+                    return None
+                self._frame_available.wait(remaining)
+        return self._ring.popleft()
+
+    def getStatusList(self):
+        return ['Serial reader: %d frames, %d waiting, %d dropped, %d bad crc, %d invalid, %d bytes discarded' %
+                (self.frame_count, len(self._ring), self.dropped_frame_count, self.bad_crc_count,
+                 self._decoder.invalid_frame_count, self._decoder.discarded_byte_count)]
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                if not self.ser.in_waiting:
+                    self._waitForData()
+                # read blocks until at least one byte is there (or the serial timeout), then grab the rest
+                data = self.ser.read(max(1, self.ser.in_waiting))
+            except (serial.SerialException, OSError):
+                logging.exception('Serial reader failed to read, retrying in %d', self._error_sleep_time)
+                self._stop_event.wait(self._error_sleep_time)
+                continue
+            if not data:
+                continue
+
+            timestamp = time.time()
+            self.bytes_read_count += len(data)
+            self._decoder.feed(data)
+            frames = list(self._decoder.frames())
+            if not frames:
+                continue
+
+            appended = False
+            for (text, crc), is_valid in zip(frames, Crc8.checkMany(frames)):
+                if not is_valid:        # 256 is the groduino reporting an error, it will never match either
+                    self.bad_crc_count += 1
+                    logging.error('Checksums do not match, discarding: %r', text)
+                    continue
+                if len(self._ring) == self.ring_size:
+                    self.dropped_frame_count += 1
+                self._ring.append((timestamp, text))
+                self.frame_count += 1
+                appended = True
+
+            if appended:
+                with self._frame_available:
+                    self._frame_available.notify_all()
+
+    def _waitForData(self):
+        """Sleep until the port has data (or _idle_wait_time), so we aren't waking up every serial read timeout"""
+        try:
+            fd = self.ser.fileno()
+        except (AttributeError, NotImplementedError, ValueError):    # not a real port (ex loop://), read will wait
+            return
+        select.select([fd], [], [], self._idle_wait_time)
@@ -149,6 +149,7 @@ class Actuator(Element):
                 logging.error('actuator %s %d failed to change to state %s from %s',
                               self.code, self.index, self._state, self.current_state)
                 self._state = None              # Unable to set actuator state, set state to None.
+                self.bot.markActuatorDirty(self)    # so control sets it again
                 # Note: state will get overwritten during control, so this won't stop it from sending...
                 # if repeated sending after failure is a problem, we can set _last_updated time into the future
 
@@ -0,0 +1,140 @@
+# asyncio version of Bot.run. See AsyncBotRunner
+
+import asyncio
+import concurrent.futures
+import logging
+import time
+
+
+class AsyncBotRunner:
+    """Runs a Bot on asyncio, with a separate task for each part of Bot.run
+
+    Tasks:
+        serial:   waits for groduino messages (in its own thread, so it is never stuck behind a server call), handles
+                  them on the loop and wakes up the control task
+        control:  updateActuators whenever a message was handled, or every control_period
+        server:   every server_update_period, fetches overrides and set points concurrently, applies them on the loop.
+                  Skipped while the change feed is up (see Bot.isServerPollNeeded), control applies its changes
+        upload:   posts data once there are unposted messages, at most every upload_period. Server batches them
+        status:   writes the status file every status_period
+
+    Anything that touches elements (handling messages, control, applying server data, collecting data points) runs on
+    the loop thread, so it never races. Only the blocking parts (serial wait, http requests, file writes) go to
+    executors. So a slow server can't delay serial handling or actuator updates.
+    :type bot: Bot
+    """
+    control_period = 0.5        # run control at least this often, even without new messages
+    upload_period = 1           # don't post more often than this
+    serial_wait = 0.5           # max time the serial thread blocks waiting for a message, see Groduino.receive
+    server_workers = 4          # threads for http requests. overrides and set points are fetched at the same time
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._loop = None
+        self._serial_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._server_executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.server_workers)
+        self._message_handled = None    # asyncio.Event, set when a message was handled. created on the loop
+        self._data_available = None    # asyncio.Event, set when there are unposted messages
+
+    def run(self):
+        """Run the bot (forever) on a new event loop"""
+        self._loop = asyncio.new_event_loop()
+        self.bot.startChangeFeed()
+        try:
+            self._loop.run_until_complete(self._runTasks())
+        finally:
+            self._serial_executor.shutdown(wait=False)
+            self._server_executor.shutdown(wait=False)
+            self._loop.close()
+
+    async def _runTasks(self):
+        self._message_handled = asyncio.Event()
+        self._data_available = asyncio.Event()
+        logging.info('Starting asyncio bot runtime')
+        await asyncio.gather(self._serialTask(), self._controlTask(), self._serverTask(),
+                             self._uploadTask(), self._statusTask())
+
+    def _runInExecutor(self, executor, fn, *args):
+        return self._loop.run_in_executor(executor, fn, *args)
+
+    # ----- Tasks -----
+
+    async def _serialTask(self):
+        groduino = self.bot.groduino
+        while True:
+            timestamped_message = await self._runInExecutor(self._serial_executor, groduino.receiveWithTimestamp,
+                                                            True, self.serial_wait)
+            if timestamped_message is None:
+                continue
+            if self.bot.handleMessage(*timestamped_message):
+                self._message_handled.set()
+                self._data_available.set()
+
+    async def _controlTask(self):
+        profiler = self.bot._run_profiler
+        while True:
+            try:
+                await asyncio.wait_for(self._message_handled.wait(), self.control_period)
+            except asyncio.TimeoutError:
+                pass
+            self._message_handled.clear()
+
+            profiler.startLoop()
+            self.bot.applyFeedChanges()
+            self.bot.updateActuators()
+            profiler.addPoint('updateActuators done')
+            profiler.endLoop()
+
+    async def _serverTask(self):
+        while True:
+            start_time = time.time()
+            if not self.bot.takeServerPoll():
+                await asyncio.sleep(self.bot.server_update_period)
+                continue
+            try:
+                actuator_list, setpoint_list = await asyncio.gather(
+                    self._runInExecutor(self._server_executor, self.bot.fetchOverrides),
+                    self._runInExecutor(self._server_executor, self.bot.fetchSetPoints))
+            except Exception:       # like ServerSync, keep polling whatever went wrong
+                logging.exception('Failed to get overrides/set points, will retry in %d', self.bot.server_update_period)
+                self.bot.requestServerPoll()
+            else:
+                # same guard as Bot.run, a slow poll mustn't undo a newer change from the feed
+                if self.bot.applyPolledData(start_time, actuator_list, setpoint_list):
+                    logging.debug('Server sync took %f', time.time() - start_time)
+                else:
+                    continue        # poll again right away
+            await asyncio.sleep(max(0, start_time + self.bot.server_update_period - time.time()))
+
+    async def _uploadTask(self):
+        while True:
+            start_time = time.time()
+            try:
+                await asyncio.wait_for(self._data_available.wait(), self.upload_period)
+            except asyncio.TimeoutError:
+                pass
+            if self._data_available.is_set():
+                self._data_available.clear()
+                self.bot._unposted_message_count = 0
+                self.bot.server.postDataPoints(self.bot.collectDataPoints())     # only batches/queues, never blocks
+            self.bot.server.flushDataPoints()       # posts the current batch if it is old enough
+            await asyncio.sleep(max(0, start_time + self.upload_period - time.time()))
+
+    async def _statusTask(self):
+        clear_count = 0
+        while True:
+            await asyncio.sleep(self.bot.status_period)
+            status_str = '\n'.join(self.bot.getStatusList())
+            self.bot._status_last_logged = time.time()
+            logging.info(status_str)
+            await self._runInExecutor(self._server_executor, self._writeStatus, status_str)
+
+            clear_count += 1
+            if clear_count > 10:        # aggregate the profiling for 10 batches, like Bot.run
+                clear_count = 0
+                self.bot._run_profiler.clear()
+
+    def _writeStatus(self, status_str):
+        # This will overwrite status each time, just watch the file
+        with open(self.bot.status_file_name, 'w') as f:
+            f.write(status_str)
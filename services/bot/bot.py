@@ -1,17 +1,22 @@
 # This file holds all of the code related to the physical bot, including sensors, actuators, etc.
 # It uses Server to get updates
 
+import functools
 import logging
 import requests  # TODO all server stuff should be through server
-import json      # TODO shouldn't need this
 import time
-import os
+import threading
+from collections import deque
 
 from ..server import Server, ServerResourceLazyDict
+from ..server.changeFeed import ChangeFeed
 from ..configuration import ManualProfiler
 
 from .actuator import Actuator
+from .controlEngine import ControlEngine
+from .messageDecoder import decodeMessage
 from .sensingPoint import SensingPoint
+from .serverSync import ServerSync
 
 #SERVER = ''         # TODO
 
@@ -19,6 +24,14 @@ from .sensingPoint import SensingPoint
 # TODO be consistent with suffixes (ex groduino_inst)
 class Bot:
     status_file_name = 'grostatus.log'
+    prefetch_server_info = True     # get everything the elements need at the same time before creating them
+    use_change_feed = True          # get overrides/set points from the server's change feed, only poll without it
+    set_points_path = 'tray/1/set_points/'      # TODO should be getting enclosure (only one)
+    use_control_engine = True       # run control for all actuators at once with numpy (if installed). see ControlEngine
+    control_engine_min_effects = 100    # with fewer effects simpleControl is faster (see benchmarks/control.py)
+    use_dirty_control = True        # only run control for actuators whose inputs changed, see runControl
+    server_info_endpoints = ['resource_type', 'resource_property', 'actuator', 'actuator_type', 'sensing_point',
+                             'control_profile']
 
     # TODO document
     def __init__(self, groduino_inst, server_inst: Server):
@@ -29,43 +42,111 @@ class Bot:
         self.server = server_inst
         self.groduino = groduino_inst
         self.server_update_period = 15       # Update from/to the server this often
-        self.invalid_message_codeindex_list = []        # TODO document
+        self.status_period = 10              # Write the status file this often
+        self.max_idle_wait = 0.5             # When idle, run sleeps at most this long waiting for serial
+        self.invalid_message_codeindex_set = set()      # keys with no element for them, ignored (logged once)
+        self.last_message_timestamp = None      # when the message being handled arrived. see updateFromGroduino
         self.inactive_sensing_points_dictby_codeindexstr = {}  # Used to store dict of inactive sensors instances
-
-        # TODO do we want even more dynamic? Can parse the API ROOT, get all available properties, get if referenced
-        # TODO having server info by url would make things a lot easier... should we just store it in server?
-        self.server_info = {}  # NOTE the values in this array usually aren't updated! Call updateFromServer if needed!
-        for endpoint_name in ['resource_type', 'resource_property', 'actuator', 'actuator_type', 'sensing_point',
-                              'control_profile']:
-            self.server_info[endpoint_name] = ServerResourceLazyDict(endpoint_name, self.server)
+        self.topology_changed_url_list = []     # urls that changed on the server since the snapshot we started from
 
         # INTERNAL
         self._run_profiler = ManualProfiler()
         self._last_server_update_time = 0       # For run, only want to update server every self.server_update_period
         self._status_last_logged = time.time()  # We don't want to log on the first run, so set to current time
         self._unposted_message_count = 0
+        self._change_feed = ChangeFeed(self.server) if self.use_change_feed else None
+        self._feed_resync_count = 0             # ChangeFeed.resync_count we last polled for. see applyFeedChanges
+        self._server_poll_needed = True         # poll overrides/set points next server update even if feed is up
+        self._last_feed_change_time = 0         # when we last applied a change from the feed
+        self._server_sync = ServerSync(self)    # fetches overrides/set points for run, in a thread
+        self._closed = threading.Event()        # set by close, ends the threads the bot started
+        self._control_engine = None             # compiled on first use, see _getControlEngine
+        self._actuators_dictby_sensing_point_url = None     # what each sensing point affects. see _getDependentActuators
+        self._dirty_actuator_set = set()        # actuators control has to run for, see markSensingPointChanged
+        self._control_pass_count = 0            # runControl calls that ran control for something
+        self._controlled_actuator_count = 0     # actuators control ran for, over all those passes
+        self._message_latency_list = deque(maxlen=200)   # arrival -> handled, seconds. see handleMessage
         self._element_dictby_url = {}           # ex _element_dictby_url['http.../actuator/1/']
         self._element_dictby_code_index = {'sensing_point': {},
                                            'actuator': {},
                                            }        # ex _element_dictby_code_index['sensing_point']['SAHU'][1]
+        self._element_list_dictby_type = {}     # flat list of each type, see getElementByCodeIndex. Reset on add
 
         # TODO this is pretty sloppy below, maybe a separate class
         self._run_stats_dict = {'run_times': {}, }           # For profiling the bot.run loop. look there for more info
         self._run_enum_dict = {'status': 1, 'server': 2}
 
         # TODO document better. Prolly rename too.
-        self._message_handlers_dictby_code = {'S': SensingPoint.mainMessageHandler,
-                                              'A': Actuator.mainMessageHandler,
-                                              'G': Bot.generalMessageHandler,
-                                              }      # These will handle the messages from the groduino based on msg[0]
+        self._message_routers_dictby_code = {'S': SensingPoint.getMessageRoute,
+                                             'A': Actuator.getMessageRoute,
+                                             'G': Bot.getGeneralMessageRoute,
+                                             }      # These find what handles a message from the groduino by msg[0]
+        self._message_route_dictby_key = {}     # ex ['SATM 1'] -> function taking the value. see dispatchMessageItems
 
         # INIT
         # Set up sensing points, actuators, and all that good stuff
-        self._populateSensingPoints()
-        self._populateActuators()
+        # If the server loaded a topology snapshot, set up from it without waiting on the server, check it later
+        if self.server.snapshot_loaded:
+            with self.server.preferCache():
+                self._populateServerInfo()
+                self._populateSensingPoints()
+                self._populateActuators()
+            threading.Thread(target=self._reconcileTopology, name='topology reconcile', daemon=True).start()
+        else:
+            if self.prefetch_server_info:
+                self._prefetchServerInfo()
+            self._populateServerInfo()
+            self._populateSensingPoints()
+            self._populateActuators()
+            if self.server.snapshot_file_name is not None:
+                try:
+                    self.server.saveSnapshot()
+                except OSError:
+                    logging.exception("Couldn't save the topology snapshot, next start will need the server")
 
     # ----- INIT and creation -----
 
+    def _populateServerInfo(self):
+        # TODO do we want even more dynamic? Can parse the API ROOT, get all available properties, get if referenced
+        # TODO having server info by url would make things a lot easier... should we just store it in server?
+        self.server_info = {}  # NOTE the values in this array usually aren't updated! Call updateFromServer if needed!
+        for endpoint_name in self.server_info_endpoints:
+            self.server_info[endpoint_name] = ServerResourceLazyDict(endpoint_name, self.server)
+
+    def _prefetchServerInfo(self):
+        """Get the endpoint lists and everything they reference into the server cache, concurrently (see
+        Server.prefetch). The element constructors walk the same urls one at a time, this way they are all cached
+        """
+        self.server.prefetch([self.server.getUrlByName(endpoint_name) for endpoint_name in self.server_info_endpoints])
+
+    def _reconcileTopology(self):
+        """Check the snapshot we started from against the server, in a thread. Retries until the server is reached
+        (or close is called)
+        Elements can't be changed while running yet, so if the topology changed this only warns (and the status says
+        so). The snapshot is saved again either way, so the next start is up to date
+        """
+        while True:
+            try:
+                changed_url_list = self.server.refreshSnapshot()
+                break
+            except (ConnectionError, requests.exceptions.RequestException, ValueError, OSError) as e:
+                logging.warning('Failed to check the topology snapshot (%s), will retry in %d', e,
+                                self.server_update_period)
+            except Exception:
+                logging.exception('Failed to check the topology snapshot %s (%d elements from it), will retry in %d',
+                                  self.server.snapshot_file_name, len(self._element_dictby_url),
+                                  self.server_update_period)
+            if self._closed.wait(self.server_update_period):
+                return
+
+        if changed_url_list:
+            self.topology_changed_url_list += [url for url in changed_url_list
+                                               if url not in self.topology_changed_url_list]
+            logging.warning('Topology changed on the server since the snapshot, restart to pick it up: %s',
+                            changed_url_list)
+        else:
+            logging.info('Topology snapshot is up to date with the server')
+
     def _populateSensingPoints(self):
         """Populate the sensing points from server_info['sensing_point']
 
@@ -92,6 +173,11 @@ class Bot:
         :param actuator_inst: an instance of Actuator
         """
         a = actuator_inst
+        self._control_engine = None     # has to be compiled again with this one
+        self._actuators_dictby_sensing_point_url = None
+        self._dirty_actuator_set.add(a)     # no state yet
+        self.clearMessageRoutes()
+        self._element_list_dictby_type.pop('actuator', None)
         self._element_dictby_url[a.url] = a
         if a.code not in self._element_dictby_code_index['actuator']:
             self._element_dictby_code_index['actuator'][a.code] = {}
@@ -104,9 +190,12 @@ class Bot:
         :param sensing_point_inst: an instance of Sensor
         """
         s = sensing_point_inst
+        self._actuators_dictby_sensing_point_url = None
+        self.clearMessageRoutes()
         if not s.is_active:     # If inactive, add to inactive list but don't add to the element_dictby dicts
             self.inactive_sensing_points_dictby_codeindexstr[s.code + ' ' + str(s.index)] = s
             return
+        self._element_list_dictby_type.pop('sensing_point', None)
         self._element_dictby_url[s.url] = s
         if s.code not in self._element_dictby_code_index['sensing_point']:
             self._element_dictby_code_index['sensing_point'][s.code] = {}
@@ -115,13 +204,12 @@ class Bot:
     # ----- Getting elements and the like -----
 
     # TODO should None be ellipsis? see https://docs.python.org/dev/library/typing.html and PEP 484
-    # TODO should we have a faster way to return all elements for a certain type? maybe concat the dicts?
-    # OR A GENERATOR! just return one element at a time
     def getElementByCodeIndex(self, element_type: str, code: str=None, index: int=None):
         """Utility method so that we don't have to write the same code for getActuator/Sensor ByCodeIndex
 
         Gets the element for a specified code and index.
-        If code=None, return all elements of this type as flat list of instances (not [code][index])
+        If code=None, return all elements of this type as flat list of instances (not [code][index]). The list is kept
+        until an element of the type is added (run calls this every loop), so don't modify it
         If index=None and code!=None, returns dict of all elements for this code
         raises KeyError if the element isn't found
         :param element_type: 'actuator' or 'sensing_point'
@@ -131,11 +219,12 @@ class Bot:
         """
         # We are returning this as a list. If you wanted them as a dict you could just the internal dict...
         if code is None:        # Don't care what index is, return all
-            l = []
-            for index_dict in self._element_dictby_code_index[element_type].values():
-                for inst in index_dict.values():
-                    l.append(inst)
-            return l
+            element_list = self._element_list_dictby_type.get(element_type)
+            if element_list is None:
+                element_list = [inst for index_dict in self._element_dictby_code_index[element_type].values()
+                                for inst in index_dict.values()]
+                self._element_list_dictby_type[element_type] = element_list
+            return element_list
 
         if index is None:
             return self._element_dictby_code_index[element_type][code]
@@ -156,24 +245,37 @@ class Bot:
     # TODO this could be moved to a state machine implementation to make things cleaner/better
     def run(self):
         """Run the bot (forever)! Get data from the server, update the bot, run controls, post data!
+        Nothing here waits on the server: overrides/set points are fetched by ServerSync (and the change feed) in
+        threads and applied at the start of a loop, data points are posted by the Server's upload threads
         """
 
         # Want to add profiling to this function. It will look pretty ugly...
         clear_run_stats_flag = 0
+        self.startChangeFeed()
+        self._server_sync.start()
         while 1:
             # Set up for profiling
             self._run_profiler.startLoop()
 
-            # Try to get a message from the groduino
-            buffer_cleared = self.updateFromGroduino()
+            # overrides/set points that changed on the server, applied all at once before anything uses them
+            self.applyFeedChanges()
+            self.applyServerSnapshot()
+            self._run_profiler.addPoint('applied server changes')
+
+            # Try to get a message from the groduino. If there is nothing to post, sleep until one comes in
+            # (or something else is due) instead of spinning. If there is, just check so we can post right away
+            idle_wait_time = 0 if self._unposted_message_count > 0 else self._getIdleWaitTime()
+            buffer_cleared = self.updateFromGroduino(blocking=idle_wait_time > 0, timeout=idle_wait_time)
             self._run_profiler.addPoint('updateFromGroduino done')
 
             self.updateActuators()
             self._run_profiler.addPoint('updateActuators done')
 
+            self.server.flushDataPoints()       # posts the current batch of data points if it is old enough
+
             # Update the status file
             # TODO this shouldn't happen same run we are posting to server. Or the one right after.
-            if time.time() - self._status_last_logged > 10:
+            if time.time() - self._status_last_logged > self.status_period:
                 self._run_profiler.addPoint('starting status routine')
 
                 status_str = '\n'.join(self.getStatusList())
@@ -202,47 +304,94 @@ class Bot:
 
                 self._unposted_message_count = 0
                 self._last_server_update_time = time.time()
-                self.getOverrides()
-                self._run_profiler.addPoint('got overrides')
-
-                self.getSetPointsFromServer()
-                self._run_profiler.addPoint('got setpoints, posting data')
-
-                self.postData()
+                self.postData()     # only batches/queues, never blocks
                 self._run_profiler.addPoint('done posting data')
 
-                self.updateFromGroduino(blocking=True)      # Since we just posted, try to wait for a message
+                # Since we just posted, wait for a message. Not longer than idle, so feed changes still get applied
+                idle_wait_time = self._getIdleWaitTime()
+                self.updateFromGroduino(blocking=idle_wait_time > 0, timeout=idle_wait_time)
 
             if clear_run_stats_flag > 10:       # so we will still update, but it will aggregate for 10 batches
                 clear_run_stats_flag = 0
                 self._run_profiler.clear()
             self._run_profiler.endLoop()
 
+    def close(self):
+        """Stop the threads the bot started (server sync, change feed, topology check). Doesn't close the server"""
+        self._closed.set()
+        self._server_sync.stop()
+        if self._change_feed is not None:
+            self._change_feed.stop()
+
+    def runAsync(self):
+        """Run the bot (forever) on asyncio instead, with separate tasks for serial, control, server, upload and status.
+        See AsyncBotRunner
+        """
+        from .asyncRunner import AsyncBotRunner     # here so that asyncio isn't loaded for the normal run
+        AsyncBotRunner(self).run()
+
+    def _getIdleWaitTime(self):
+        """How long run can sleep waiting for serial before something else (status, server update, posting) is due
+        :return: seconds, at most self.max_idle_wait
+        """
+        curtime = time.time()
+        status_due = self._status_last_logged + self.status_period - curtime
+        server_due = self._last_server_update_time + self.server_update_period - curtime
+        flush_time = self.server.getDataPointFlushTime()
+        flush_due = self.max_idle_wait if flush_time is None else flush_time - curtime
+        return max(0, min(self.max_idle_wait, status_due, server_due, flush_due))
+
     # TODO have a test message here, possibly through another variable
-    def updateFromGroduino(self, blocking=False):
+    def updateFromGroduino(self, blocking=False, timeout=None):
         """Get a message from the groduino (if available), parse the values to update the relevant info
+        :param blocking: wait for a message if there isn't one yet. See Groduino.receive
+        :param timeout: max time to wait if blocking. None for the Groduino default
         :return: bool indicating whether the buffer was clear
         """
-        # TODO move the json parsing to groduino
         # TODO add a debug variable, if debugging get rid of all groduino operations
-        message = self.groduino.receive(blocking=blocking)
-        if not message:     # return True to indicate the buffer is clear
+        timestamped_message = self.groduino.receiveWithTimestamp(blocking=blocking, timeout=timeout)
+        if not timestamped_message:     # return True to indicate the buffer is clear
             return True     # TODO should we do something here?
+        self.handleMessage(*timestamped_message)
+        return False
+
+    def handleMessage(self, timestamp, message):
+        """Parse a message from the groduino and update the relevant elements. See updateFromGroduino
+        :param timestamp: when the message arrived
+        :param message: clean json string from Groduino.receive, or list of (key, value) with binary frames
+        :return: True if the message was parsed
+        """
+        # TODO move the json parsing to groduino
+        self.last_message_timestamp = timestamp     # handlers use this to timestamp values
         logging.debug('Handling: %s', message)      # TODO worry about timezones and stuff..
 
         try:        # Try to parse the message as json.
-            message_dict = json.loads(message)
+            item_list = message if isinstance(message, list) else decodeMessage(message)
         except ValueError:
-            logging.error('Unable to parse message, json.loads failed')
+            logging.error('Unable to parse message, not a json object')
             logging.debug('', exc_info=True)
             return False
 
         self._unposted_message_count += 1           # If we got here, everything is ok, increment message count
-        # Split the message_dict into key/value pairs.
-        # key is code with index (ex SAHU 2). value is usually single float, can be list/dict (see groduino docs)
-        for key, data in message_dict.items():
+        self.dispatchMessageItems(item_list)
+        self._message_latency_list.append(time.time() - timestamp)
+        return True
+
+    def dispatchMessageItems(self, item_iter):
+        """Give each part of a message to what handles it. The first time a key comes in, its route is found (see
+        Element.getMessageRoute) and kept by the key, after that it is a dict lookup. Keys with nothing to handle them
+        are routed to ignoreMessage
+        :param item_iter: (key, data) pairs. key is code with index (ex SAHU 2). data is usually single float,
+            can be list/dict (see groduino docs)
+        """
+        route_dictby_key = self._message_route_dictby_key
+        for key, data in item_iter:
             try:
-                self._message_handlers_dictby_code[key[0]](self, key, data)
+                route = route_dictby_key.get(key)
+                if route is None:
+                    route = self._message_routers_dictby_code[key[0]](self, key)
+                    route_dictby_key[key] = route
+                route(data)
 
             # NotImplemented - handler not written. ValueError - bad value. KeyError - no handler
             except (NotImplementedError, ValueError, KeyError):
@@ -254,26 +403,189 @@ class Bot:
                 logging.exception("Couldn't handle %s %s", key, data)
                 raise
 
+    def clearMessageRoutes(self):
+        """Forget the message routes and ignored keys, so they are found again. Call when elements change"""
+        self._message_route_dictby_key.clear()
+        self.invalid_message_codeindex_set.clear()
+
     def updateActuators(self):
-        """Updates any actuators that have not yet succeeded. Also does controls stuff
+        """Updates any actuators that have not yet succeeded. Also does controls stuff (see runControl)
+        Control normally already ran at the end of the frame (GEND), this catches set point/override changes
         """
+        self.runControl()
         for actuator_inst in self.getElementByCodeIndex('actuator'):
             assert isinstance(actuator_inst, Actuator)
-            actuator_inst.simpleControl()
-            actuator_inst.update()
+            actuator_inst.update()      # cheap unless the groduino hasn't got the state yet, has to retry
+
+    def runControl(self):
+        """Run control for the actuators that need it: the ones with a sensing point whose value or set point changed
+        since the last pass (see markSensingPointChanged), and ones whose state was reset. So with nothing changing,
+        this does nothing. Bot calls it when a frame from the groduino is complete (GEND) and from updateActuators.
+        Control is done by the ControlEngine for all of them at once if it's worth it, else simpleControl on each
+        If use_dirty_control is False, always runs control for every actuator
+        :return: number of actuators control ran for
+        """
+        if self.use_dirty_control:
+            if not self._dirty_actuator_set:
+                return 0
+            actuator_list = list(self._dirty_actuator_set)
+            self._dirty_actuator_set.clear()
+        else:
+            actuator_list = self.getElementByCodeIndex('actuator')
+
+        control_engine = self._getControlEngine()
+        if control_engine is not None:      # does all of them, picking out the dirty ones would cost more than it saves
+            control_engine.evaluate()
+            actuator_count = len(control_engine.actuator_list)
+        else:
+            for actuator_inst in actuator_list:
+                actuator_inst.simpleControl()
+            actuator_count = len(actuator_list)
+        self._control_pass_count += 1
+        self._controlled_actuator_count += actuator_count
+        return actuator_count
+
+    def markSensingPointChanged(self, sensing_point_url):
+        """Mark the actuators a sensing point affects as needing control. SensingPoint calls this when its value or set
+        point changes. Control runs for them at the next runControl
+        :param sensing_point_url: url of the sensing point that changed
+        """
+        self._dirty_actuator_set.update(self._getDependentActuators().get(sensing_point_url, ()))
+
+    def markActuatorDirty(self, actuator_inst: Actuator):
+        """Run control for this actuator at the next runControl, even if none of its sensing points changed.
+        ex its state was reset after failing to set it, or an override ended
+        """
+        self._dirty_actuator_set.add(actuator_inst)
+
+    def _getDependentActuators(self):
+        """Index of the actuators each sensing point affects, from their effects_dictby_sensing_point_url. Built on
+        first use, again after elements are added. Effects that never turn the actuator on don't count (like in
+        simpleControl)
+        :return: dict of actuator list by sensing point url
+        """
+        if self._actuators_dictby_sensing_point_url is None:
+            actuators_dictby_sensing_point_url = {}
+            for actuator_inst in self.getElementByCodeIndex('actuator'):
+                for sensing_point_url, effects_dict in actuator_inst.effects_dictby_sensing_point_url.items():
+                    if effects_dict['effect_on_active'] != 0:
+                        actuators_dictby_sensing_point_url.setdefault(sensing_point_url, []).append(actuator_inst)
+            self._actuators_dictby_sensing_point_url = actuators_dictby_sensing_point_url
+        return self._actuators_dictby_sensing_point_url
+
+    def _getControlEngine(self):
+        """The compiled ControlEngine, or None if we shouldn't use it (off, no numpy, or too few effects)"""
+        if not self.use_control_engine or not ControlEngine.isAvailable():
+            return None
+        if self._control_engine is None:
+            self._control_engine = ControlEngine(self)
+            self._control_engine.compile()
+        if self._control_engine.row_count < self.control_engine_min_effects:
+            return None
+        return self._control_engine
+
+    # ----- Server -----
+
+    def startChangeFeed(self):
+        """Start listening to the server's change feed, if we use it. See ChangeFeed"""
+        if self._change_feed is not None:
+            self._change_feed.start()
+
+    def isServerPollNeeded(self):
+        """Whether overrides/set points have to be polled: the change feed is down (or off), or it just (re)connected
+        and we have to catch up on what it missed
+        """
+        return self._server_poll_needed or self._change_feed is None or not self._change_feed.is_connected
+
+    def requestServerPoll(self):
+        """Have overrides/set points polled at the next server update, even if the change feed is up. Thread safe"""
+        self._server_poll_needed = True
+
+    def takeServerPoll(self):
+        """Call right before polling overrides/set points. If the poll fails, call requestServerPoll. Thread safe
+        :return: True if a poll is needed (see isServerPollNeeded)
+        """
+        if not self.isServerPollNeeded():
+            return False
+        self._server_poll_needed = False        # before fetching, so a poll asked for meanwhile isn't lost
+        return True
+
+    def applyFeedChanges(self):
+        """Apply the overrides/set points that came in on the change feed since the last call
+        :return: number of changes applied
+        """
+        feed = self._change_feed
+        if feed is None:
+            return 0
+        if feed.resync_count != self._feed_resync_count:    # feed (re)connected, may have missed changes
+            self._feed_resync_count = feed.resync_count
+            self.requestServerPoll()
+            self._server_sync.requestSync()
+        change_list = feed.popChanges()
+        for change_dict in change_list:
+            self.applyChange(change_dict['url'], change_dict['data'])
+        if change_list:
+            self._last_feed_change_time = time.time()
+        return len(change_list)
+
+    def applyServerSnapshot(self):
+        """Apply the overrides/set points from ServerSync, if it has new ones. See ServerSync and applyPolledData
+        :return: True if a snapshot was applied
+        """
+        snapshot = self._server_sync.takeSnapshot()
+        if snapshot is None:
+            return False
+        if not self.applyPolledData(snapshot.fetch_time, snapshot.actuator_list, snapshot.set_point_dict):
+            self._server_sync.requestSync()
+            return False
+        return True
+
+    def applyPolledData(self, fetch_time, actuator_list, set_point_dict):
+        """Apply polled overrides/set points. Data fetched before the latest change from the feed may be older than
+        it, so it is dropped (and another poll asked for) instead of undoing the change
+        :param fetch_time: time.time() the fetch started at
+        :param actuator_list: from fetchOverrides
+        :param set_point_dict: from fetchSetPoints
+        :return: True if it was applied
+        """
+        if fetch_time < self._last_feed_change_time:
+            logging.debug('Polled overrides/set points are older than the last feed change, getting them again')
+            self.requestServerPoll()
+            return False
+        self.applyOverrides(actuator_list)
+        self.applySetPoints(set_point_dict)
+        return True
+
+    def applyChange(self, url, data):
+        """Apply one change from the change feed
+        :param url: url of what changed, an actuator (overrides) or the set points
+        :param data: the new data at url
+        """
+        if url == self.getSetPointsUrl():
+            self.applySetPoints(data)
+        elif isinstance(self._element_dictby_url.get(url), Actuator):
+            self.applyOverrides([data])
+        else:
+            logging.debug('Ignoring change to %s', url)
+
+    def getSetPointsUrl(self):
+        return self.server.base_url + self.set_points_path
 
     def getSetPointsFromServer(self):       # seems like it works, can't test because of new format
         """Get all the setpoints and set them on the correct sensing points
         """
-        # Get Server IP - this is horrible, omg...
-        f = open(os.path.join('/home/pi/', 'server_ip.txt'), 'r')
-        server_ip = f.readline();
-        f.close()
-        SERVER = "http://" + server_ip.strip() + "/"
-        
-        SERVER_SET_POINT = SERVER + 'tray/1/set_points/'            # TODO should be getting enclosure (only one)
-        setpoint_list = self.server.getJson(SERVER_SET_POINT)     # NOTE Set point list is formatted differently! See db
+        self.applySetPoints(self.fetchSetPoints())
+
+    def fetchSetPoints(self):
+        """Get the set points from the server without applying them (network only, safe to call from another thread)
+        :return: dict of set point value by code (without the sensing point prefix), ex {'ATM': 22.0}
+        """
+        return self.server.getJson(self.getSetPointsUrl())     # NOTE Set point list is formatted differently! See db
 
+    def applySetPoints(self, setpoint_list):
+        """Set the set points from fetchSetPoints on the correct sensing points
+        :param setpoint_list: dict from fetchSetPoints
+        """
         for code, value in setpoint_list.items():
             try:
                 sensing_point_dict = self.getElementByCodeIndex('sensing_point', code='S' + code)
@@ -288,38 +600,54 @@ class Bot:
     def getOverrides(self):
         """Get all the overrides and set them on the correct actuator
         """
-        cur_time = time.time()
-        
-        # Get Server IP - this is horrible, omg...
-        f = open(os.path.join('/home/pi/', 'server_ip.txt'), 'r')
-        server_ip = f.readline();
-        f.close()
-        SERVER = "http://" + server_ip.strip() + "/"
+        self.applyOverrides(self.fetchOverrides())
 
-        SERVER_ACTUATOR = SERVER + 'actuator/'          # TODO no hardcode!
-        actuator_list = self.server.getJson(SERVER_ACTUATOR)
+    def fetchOverrides(self):
+        """Get the actuator list (with overrides) from the server without applying it (safe to call from another thread)
+        :return: list of actuator dicts
+        """
+        return self.server.getJson(self.server.getUrlByName('actuator'))
 
+    def applyOverrides(self, actuator_list):
+        """Set the overrides from fetchOverrides on the correct actuators
+        Actuators we don't have (added on the server since the topology snapshot) are skipped until a restart, and
+        kept in topology_changed_url_list
+        :param actuator_list: list from fetchOverrides
+        """
         for actuator_dict in actuator_list:
-            actuator_inst = self.getElementByUrl(actuator_dict['url'])
-            assert isinstance(actuator_inst, Actuator)
+            actuator_inst = self._element_dictby_url.get(actuator_dict['url'])
+            if not isinstance(actuator_inst, Actuator):
+                if actuator_dict['url'] not in self.topology_changed_url_list:
+                    logging.warning('Got overrides for actuator %s, which the bot does not have. Restart to pick it up',
+                                    actuator_dict['url'])
+                    self.topology_changed_url_list.append(actuator_dict['url'])
+                continue
             if actuator_dict['override_value'] is not None: #and actuator_dict['override_timeout'] > cur_time:
                 logging.debug('%s overriden to state %f', str(actuator_inst), actuator_dict['override_value'])
                 # actuator_inst.override(actuator_dict['override_value'], actuator_dict['override_timeout'])
                 actuator_inst.override(actuator_dict['override_value'])
-            else:
+            elif actuator_inst._override:
                 actuator_inst._override = False      # TODO shouldn't be accessing private method. see override notes
+                self.markActuatorDirty(actuator_inst)       # back to control
 
     def postData(self):
         """Post data to the server. Uses the post method on each of the sens. pts. Raise ConnectionError on failure
         """
-        # Get the formatted list from every sensor, combine, send
+        self.server.postDataPoints(self.collectDataPoints())
+
+    def collectDataPoints(self):
+        """Get the formatted values from every sensing point and clear their buffers. See postData
+        :return: list of data point dicts, ready for Server.postDataPoints
+        """
+        # Get the formatted list from every sensor, combine
         formatted_values_list = []
         for sensing_point in self.getElementByCodeIndex('sensing_point'):
             assert isinstance(sensing_point, SensingPoint)
+            if not sensing_point.buffered_value_count:      # run posts after most frames, few have new values
+                continue
             formatted_values_list += sensing_point.formatted_values_list
             sensing_point.formatted_values_list = None      # To clear the sensing_point buffer
-
-        self.server.postDataPoints(formatted_values_list)
+        return formatted_values_list
 
     # ----- Status -----
 
@@ -327,6 +655,17 @@ class Bot:
         status_list = ['-----STATUS-----']
         status_list += self.getActuatorStatusList()
         status_list += self.getSensingStatusList()
+        status_list += self.groduino.getStatusList()
+        status_list += self.server.getStatusList()
+        if self._change_feed is not None:
+            status_list += self._change_feed.getStatusList()
+        status_list += self._server_sync.getStatusList()
+        status_list += self.getMessageLatencyStatusList()
+        status_list.append('Control: %d passes for %d actuators, %d waiting' %
+                           (self._control_pass_count, self._controlled_actuator_count, len(self._dirty_actuator_set)))
+        if self.topology_changed_url_list:
+            status_list.append('Topology changed on the server (%d urls), restart to pick it up' %
+                               len(self.topology_changed_url_list))
         status_list += self._run_profiler.getStatusList()
         status_list.append('-----END-----')
         return status_list
@@ -346,13 +685,29 @@ class Bot:
                                     ['\t'+str(x) for x in self.getElementByCodeIndex('sensing_point')]
         return sensing_point_status_list
 
+    def getMessageLatencyStatusList(self):
+        """Time from a message arriving to it being handled, over the last few messages. Used to compare run/runAsync
+        """
+        if not self._message_latency_list:
+            return ['Message latency: no messages']
+        latency_list = sorted(self._message_latency_list)
+        return ['Message latency (%d msgs): avg %.4f  median %.4f  max %.4f' %
+                (len(latency_list), sum(latency_list) / len(latency_list),
+                 latency_list[len(latency_list) // 2], latency_list[-1])]
+
     # ----- Misc -----
 
     # TODO should this be a separate class? or where should this be? prolly not inside the Bot class, maybe outside
     # TODO finish the handlers
     # this is for 'G' messages
+    def getGeneralMessageRoute(self, code_index_str):
+        """Message route for 'G' keys, see dispatchMessageItems"""
+        return functools.partial(self.generalMessageHandler, code_index_str)
+
     def generalMessageHandler(self, code_index_str, value):
-        if code_index_str == 'GEND':
+        if code_index_str == 'GEND':        # end of the frame, all its values are in. run control once for them
+            if self.use_dirty_control:
+                self.runControl()
             return
         else:
             # raise NotImplementedError
@@ -0,0 +1,109 @@
+import logging
+
+try:                    # Optional. Without it, Bot just runs Actuator.simpleControl on each actuator
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class ControlEngine:
+    """Actuator.simpleControl for all the actuators at once, with numpy
+
+    compile turns every effect of every actuator into a row of arrays (actuator, sensing point, threshold,
+    effect_on_active, operating range, is_binary). evaluate then gathers the current values/set points/states into
+    vectors and does the band logic for all the rows in one pass, and takes the max desired state per actuator.
+    It gives the same states (and _controlled_sensing_point) as calling simpleControl on each actuator.
+    Only worth it for many effects, see Bot.updateActuators. Has to be compiled again if actuators/effects change.
+    :type bot: Bot
+    """
+    def __init__(self, bot):
+        if numpy is None:
+            raise ImportError('ControlEngine needs numpy')
+        self.bot = bot
+        self.actuator_list = []
+        self.sensing_point_list = []
+        self.row_count = 0
+
+    @staticmethod
+    def isAvailable():
+        return numpy is not None
+
+    def compile(self):
+        """Build the arrays from the actuators' effects_dictby_sensing_point_url. Rows are in the same order
+        simpleControl goes through them, so ties are broken the same way
+        """
+        self.actuator_list = list(self.bot.getElementByCodeIndex('actuator'))
+        self.sensing_point_list = []
+        sensing_point_index_dictby_url = {}
+        actuator_index_list = []
+        sensing_point_index_list = []
+        threshold_list = []
+        effect_list = []
+        range_list = []
+        binary_list = []
+        for actuator_index, actuator in enumerate(self.actuator_list):
+            is_binary = bool(actuator.actuator_type_dict['is_binary'])
+            for sensing_point_url, effects_dict in actuator.effects_dictby_sensing_point_url.items():
+                if effects_dict['effect_on_active'] == 0:       # never turned on for this one, like simpleControl
+                    continue
+                if sensing_point_url not in sensing_point_index_dictby_url:
+                    sensing_point_index_dictby_url[sensing_point_url] = len(self.sensing_point_list)
+                    self.sensing_point_list.append(self.bot.getElementByUrl(sensing_point_url))
+                actuator_index_list.append(actuator_index)
+                sensing_point_index_list.append(sensing_point_index_dictby_url[sensing_point_url])
+                threshold_list.append(effects_dict['threshold'])
+                effect_list.append(effects_dict['effect_on_active'])
+                range_list.append(is_binary or effects_dict['operating_range_max'] - effects_dict['operating_range_min'])
+                binary_list.append(is_binary)
+
+        self._row_actuator = numpy.array(actuator_index_list, dtype=numpy.intp)
+        self._row_sensing_point = numpy.array(sensing_point_index_list, dtype=numpy.intp)
+        self._row_threshold = numpy.array(threshold_list, dtype=float)
+        self._row_quarter_threshold = self._row_threshold / 4
+        self._row_effect = numpy.array(effect_list, dtype=float)
+        self._row_range = numpy.array(range_list, dtype=float)
+        self._row_binary = numpy.array(binary_list, dtype=bool)
+        self._row_index = numpy.arange(len(actuator_index_list))
+        self.row_count = len(actuator_index_list)
+        logging.debug('Control engine compiled %d effects for %d actuators, %d sensing points',
+                      self.row_count, len(self.actuator_list), len(self.sensing_point_list))
+
+    def evaluate(self):
+        """Work out the desired state of every actuator and set it, like simpleControl does"""
+        nan = float('nan')
+        actuator_count = len(self.actuator_list)
+        values = numpy.array([nan if s.value is None else s.value for s in self.sensing_point_list], dtype=float)
+        desired = numpy.array([nan if s.desired_value is None else s.desired_value for s in self.sensing_point_list],
+                              dtype=float)
+        states = numpy.array([nan if a.state is None else a.state for a in self.actuator_list], dtype=float)
+
+        row_value = values[self._row_sensing_point]
+        row_desired = desired[self._row_sensing_point]
+        row_state = states[self._row_actuator]
+        with numpy.errstate(invalid='ignore', divide='ignore'):     # nan compares are False, which is what we want
+            delta = row_desired - row_value
+            abs_delta = numpy.abs(delta)
+            state_is_zero = row_state == 0         # None (nan) isn't 0, same as in simpleControl
+            in_band = numpy.where(state_is_zero, abs_delta < self._row_threshold,
+                                  abs_delta < self._row_quarter_threshold)
+            active = ~numpy.isnan(delta) & ~in_band & ~(delta * self._row_effect < 0)
+            candidate = numpy.where(self._row_binary, 1.0, delta / self._row_range)
+
+        # max candidate per actuator, and the last row that has it (simpleControl's dict keeps the last one)
+        active_actuator = self._row_actuator[active]
+        active_candidate = candidate[active]
+        best = numpy.full(actuator_count, -numpy.inf)
+        numpy.maximum.at(best, active_actuator, active_candidate)
+        has_candidate = numpy.bincount(active_actuator, minlength=actuator_count) > 0
+        winner = numpy.full(actuator_count, -1, dtype=numpy.intp)
+        is_best = active_candidate == best[active_actuator]
+        numpy.maximum.at(winner, active_actuator[is_best], self._row_index[active][is_best])
+
+        for actuator, has, state, row in zip(self.actuator_list, has_candidate.tolist(), best.tolist(),
+                                             winner.tolist()):
+            if has:
+                actuator.state = state
+                actuator._controlled_sensing_point = self.sensing_point_list[self._row_sensing_point[row]]
+            else:
+                actuator.state = 0
+                actuator._controlled_sensing_point = None
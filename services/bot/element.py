@@ -1,6 +1,11 @@
 import logging
 import time
 
+
+def ignoreMessage(message):
+    """Message route for keys we ignore (see Element.getMessageRoute)"""
+    return
+
 class Element:
     """Base class for Actuator, SensingPoint, etc
 
@@ -22,30 +27,46 @@ class Element:
     @classmethod
     def mainMessageHandler(cls, bot, code_index_str, message):
         """Finds the appropriate element and calls individualMessageHandler on it
+        Bot doesn't use this for every message, it keeps the routes from getMessageRoute (see Bot.dispatchMessageItems)
         :param bot: Bot instance this request is coming from
         :param code_index_str: ex 'SATM 1'
         :param message: ex 22.8, but could also be 'ERROR' or something.
             Shouldn't have to worry about the message, just pass it to the individual element
         """
+        cls.getMessageRoute(bot, code_index_str)(message)
+
+    @classmethod
+    def getMessageRoute(cls, bot, code_index_str):
+        """Find what should handle the messages for a key: the element's handleMessage, or ignoreMessage if there is
+        no element for it (logged once, see bot.invalid_message_codeindex_set)
+        Raises ValueError if code_index_str isn't a code and an index
+        :param bot: Bot instance this request is coming from
+        :param code_index_str: ex 'SATM 1'
+        :return: function taking the message
+        """
         # If we know this is an invalid code_index_str, ignore it
-        if code_index_str in bot.invalid_message_codeindex_list:
-            return
+        if code_index_str in bot.invalid_message_codeindex_set:
+            return ignoreMessage
 
         # Get the code, index for this element
         code, index_str = code_index_str.split()
         index = int(index_str)
-        # logging.debug("code %s index %d, message %s", code, index, message)  # too much printing!
 
         # Try to find the element, else error
         try:
             element_inst = bot.getElementByCodeIndex(element_type=cls.type, code=code, index=index)
         except KeyError:
-            logging.error("Got %s %s, but can't find element for it! Ignoring from now on", code_index_str, message)
-            bot.invalid_message_codeindex_list.append(code_index_str)
-            return
-
+            logging.error("Got a message for %s, but can't find element for it! Ignoring from now on", code_index_str)
+            bot.invalid_message_codeindex_set.add(code_index_str)
+            return ignoreMessage
+        return element_inst.handleMessage
+
+    def handleMessage(self, message):
+        """Handle a message for this element, with retries. See getMessageRoute
+        :param message: ex 22.8
+        """
         # We don't have a need for the return value yet, but can use it to tell if handling succeeded
-        element_inst.callHandlerWithRetries(element_inst.individualMessageHandler, message)
+        self.callHandlerWithRetries(self.individualMessageHandler, message)
 
     def callHandlerWithRetries(self, message_handler_fn, *args, **kwargs):
         """Calls the supplied message_handler_fn with any supplied arguments if it doesn't raise too many exceptions
@@ -0,0 +1,30 @@
+import json
+
+try:                    # Optional, a faster json parser. Without it, messages are parsed with json.loads
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def decodeMessage(message):
+    """Parse a message from the groduino into (key, value) pairs, ready for Bot.dispatchMessageItems
+
+    Messages are a flat json object, ex {"SATM 1": 22.8, "SAHU 1": 40.1, "GEND": 0}. Values come out as they were sent,
+    usually a float (float() on them is then close to free), sometimes a string like "ERROR", or a list/dict.
+    Uses orjson if it is installed. It is stricter than json.loads (ex no NaN), so anything it rejects gets another
+    try with json.loads, and only fails if that fails too.
+    Raises ValueError if the message isn't json, or isn't an object
+    :param message: clean json string from Groduino.receive
+    :return: list of (key, value), in the order they were sent
+    """
+    message_dict = None
+    if orjson is not None:
+        try:
+            message_dict = orjson.loads(message)
+        except orjson.JSONDecodeError:
+            pass
+    if message_dict is None:
+        message_dict = json.loads(message)
+    if not isinstance(message_dict, dict):
+        raise ValueError('Message should be a json object, got %s' % type(message_dict).__name__)
+    return list(message_dict.items())
@@ -1,4 +1,3 @@
-from collections import deque
 import logging
 import time
 import requests         # TODO should just have everything go through server
@@ -7,7 +6,8 @@ import sys
 if sys.version_info < (3, 3, 0):
     from requests import ConnectionError
 
-from .element import Element
+from .element import Element, ignoreMessage
+from .timeSeriesBuffer import TimeSeriesBuffer
 
 
 # TODO should we be using resource property instead of sensing point for most of this stuff?
@@ -28,6 +28,8 @@ class SensingPoint(Element):
     code_prefix = 'S'       # TODO use this for message handling too or note that we have to write it elsewhere?
     post_suffix = '/value/'
     threshold = 5.0         # we will get a warning in sensor hasn't been updated in threshold seconds
+    values_buffer_size = 720    # values kept between posts (an hour at one per 5 secs). Over this, the oldest are dropped
+    values_buffer_warn_step = 180       # warn each time this many more values are waiting to be posted (15 mins)
 
     def __init__(self, bot, sensing_point_dict: dict):
         """Create a SensingPoint instance
@@ -44,9 +46,11 @@ class SensingPoint(Element):
         self.url = sensing_point_dict['url']
         self.post_url = self.url + self.post_suffix
         self.is_active = sensing_point_dict['is_active']
+        self.bot = bot
 
         # internal
         self._timestamp = None       # timestamp of last sample ex 1438646393.9064195
+        self._recorded_timestamp = None     # timestamp of the last sample put in _values_buffer, kept after posting
         self._last_value = None      # most recent reading
         self._posted = True          # indicates whether last_value has been written to the server so we don't repeat
         self._desired_value = None   # desired set point
@@ -54,7 +58,7 @@ class SensingPoint(Element):
 
         # buffer of (timestamp, value) to write if we want multiple values per post request
         # length limited so that we don't waste too much memory, old values will get thrown away on overflow
-        self._values_buffer = deque(maxlen=50)
+        self._values_buffer = TimeSeriesBuffer(self.values_buffer_size)
 
     def __str__(self):
         status = '(SensingPoint %s %d' % (self.code, self.index)
@@ -64,6 +68,16 @@ class SensingPoint(Element):
             status += '. Desired %.2f' % self.desired_value
         return status + ')'
 
+    @property
+    def dropped_value_count(self):
+        """values thrown away because the buffer was full"""
+        return self._values_buffer.overflow_count
+
+    @property
+    def buffered_value_count(self):
+        """values waiting to be posted, see formatted_values_list"""
+        return len(self._values_buffer)
+
     @property
     def value(self):
         """Get the latest sensor value. when writing values, will
@@ -72,19 +86,32 @@ class SensingPoint(Element):
 
     @value.setter
     def value(self, value):
-        current_time = time.time()
+        self.setValue(value)
+
+    def setValue(self, value, timestamp=None):
+        """Set the latest sensor value (same as writing to value), optionally with the time it was read
+        :param value: new value
+        :param timestamp: when the value was read, ex when the message arrived on serial. If None, uses time.time()
+        """
+        current_time = time.time() if timestamp is None else timestamp
         # Update if new value or hasn't been updated for a while
         if (self._last_value != value) or (current_time - self._timestamp > 60): # TODO shouldn't be hardcoded 
             self._last_value = value
             self._timestamp = current_time
             self._posted = False  # TODO is this only for _last_value? update docs/methods below!
-
-            # If the last timestamp was more than 5 seconds ago, record this value
-            if len(self._values_buffer) == 0 or current_time - self._values_buffer[-1][0] >= 5:
-                self._values_buffer.append((current_time, value))  # append adds to the right
-
-            if len(self._values_buffer) > 20:  # TODO shouldn't be hardcoded
-                logging.warn('Buffer is getting big (%d) for %s', len(self._values_buffer), str(self))
+            self.bot.markSensingPointChanged(self.url)
+
+            # If the last timestamp was more than 5 seconds ago, record this value. Not the buffer's last timestamp:
+            # it is cleared every post, and run posts after most frames, so that would record nearly every frame
+            if self._recorded_timestamp is None or current_time - self._recorded_timestamp >= 5:
+                self._recorded_timestamp = current_time
+                if self._values_buffer.append(current_time, value):     # True if it had to drop the oldest
+                    if (self.dropped_value_count - 1) % self.values_buffer_size == 0:  # first, then once a buffer
+                        logging.error('Buffer is full for %s, dropping the oldest values (%d dropped so far)',
+                                      str(self), self.dropped_value_count)
+                elif len(self._values_buffer) % self.values_buffer_warn_step == 0:
+                    logging.warning('Buffer is getting big (%d of %d) for %s', len(self._values_buffer),
+                                    self.values_buffer_size, str(self))
 
     @property
     def desired_value(self):
@@ -94,6 +121,8 @@ class SensingPoint(Element):
 
     @desired_value.setter
     def desired_value(self, value):
+        if value != self._desired_value:
+            self.bot.markSensingPointChanged(self.url)
         self._desired_value = value
         self._desired_value_updated = True
 
@@ -101,13 +130,7 @@ class SensingPoint(Element):
     def formatted_values_list(self):
         """list of values formatted for server (will have timestamp, value, origin). write None to here to clear buffer
         """
-        values_list = []
-        for timestamp, value in self._values_buffer:
-            value_dict = {"timestamp": int(timestamp),
-                          "value": value,
-                          "sensing_point": self.url}
-            values_list.append(value_dict)
-        return values_list
+        return self._values_buffer.formatDataPoints(self.url)
 
     @formatted_values_list.setter
     def formatted_values_list(self, value):
@@ -145,7 +168,6 @@ class SensingPoint(Element):
             logging.debug('No new values for %s %d', self.code, self.index)
             return
 
-        assert type(self._values_buffer[0]) == tuple
         for (timestamp, value) in self._values_buffer:
             post_data = {
                 "timestamp": timestamp,
@@ -158,21 +180,26 @@ class SensingPoint(Element):
                 raise ConnectionError
         self._values_buffer.clear()
 
+    def individualMessageHandler(self, message) -> bool:
+        """Handle a message for this sensing point. Timestamps the value with when the message arrived
+        :param message: ex 22.8
+        """
+        self.setValue(float(message), self.bot.last_message_timestamp)
+
     @classmethod
-    def mainMessageHandler(cls, bot, code_index_str, message):
-        """Finds the appropriate sensing point and calls individualMessageHandler on it
+    def getMessageRoute(cls, bot, code_index_str):
+        """Find what should handle the messages for a key, see Element.getMessageRoute
 
         Overwrites the base class version to add check inactive_sensing_points before handling message
         :param bot: Bot instance this request is coming from
         :param code_index_str: ex 'SATM 1'
-        :param message: ex 22.8, but could also be 'ERROR' or something.
-            Shouldn't have to worry about the message, just pass it to the individual sensing point
+        :return: function taking the message
         """
         # Check if this is an inactive sensor
         if code_index_str in bot.inactive_sensing_points_dictby_codeindexstr:     # If inactive, skip
-            if code_index_str not in bot.invalid_message_codeindex_list:          # Used to log once, see def in bot
+            if code_index_str not in bot.invalid_message_codeindex_set:           # Used to log once, see def in bot
                 logging.warning('Got message for %s, but it is inactive. Ignoring from now on', code_index_str)
-                bot.invalid_message_codeindex_list.append(code_index_str)
-            return
+                bot.invalid_message_codeindex_set.add(code_index_str)
+            return ignoreMessage
 
-        super().mainMessageHandler(bot, code_index_str, message)
+        return super().getMessageRoute(bot, code_index_str)
@@ -0,0 +1,111 @@
+import collections
+import concurrent.futures
+import logging
+import threading
+import time
+import types
+
+import requests.exceptions
+
+import sys
+if sys.version_info < (3, 3, 0):
+    from requests import ConnectionError
+
+
+# What ServerSync publishes. Never changed once published, a new one replaces it
+ServerSnapshot = collections.namedtuple('ServerSnapshot', ['number', 'fetch_time', 'actuator_list', 'set_point_dict'])
+
+
+class ServerSync:
+    """Fetches overrides and set points in a thread, so Bot.run never waits on the server
+
+    Every bot.server_update_period (or as soon as requestSync is called), if the bot needs a poll (see
+    Bot.isServerPollNeeded), the actuator list and set points are fetched at the same time. Once both are in, they are
+    published as a new ServerSnapshot, in one assignment. Only the control thread touches elements: it takes the
+    snapshot with takeSnapshot at the start of a tick and applies it all at once (see Bot.applyServerSnapshot).
+    If the server is slow or down, the control loop just keeps applying nothing new.
+    :type bot: Bot
+    """
+    def __init__(self, bot):
+        self.bot = bot
+        self.sync_count = 0
+        self.failed_count = 0
+        self.last_sync_duration = None
+
+        self._snapshot = None           # latest published ServerSnapshot
+        self._taken_number = 0          # number of the last snapshot takeSnapshot returned
+        self._sync_requested = threading.Event()
+        self._stop = threading.Event()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='server sync', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._sync_requested.set()
+
+    def requestSync(self):
+        """Sync now instead of at the next server_update_period"""
+        self._sync_requested.set()
+
+    def takeSnapshot(self):
+        """Get the latest snapshot if it is newer than the one we took last time. Call from the control thread
+        :return: ServerSnapshot or None
+        """
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.number == self._taken_number:
+            return None
+        self._taken_number = snapshot.number
+        return snapshot
+
+    def sync(self):
+        """Fetch overrides and set points concurrently and publish them
+        :return: True on success
+        """
+        start_time = time.time()
+        overrides_future = self._executor.submit(self.bot.fetchOverrides)
+        set_points_future = self._executor.submit(self.bot.fetchSetPoints)
+        try:
+            actuator_list = overrides_future.result()
+            set_point_dict = set_points_future.result()
+        except (ConnectionError, requests.exceptions.RequestException, ValueError) as e:
+            self.failed_count += 1
+            logging.warning('Failed to get overrides/set points (%s), will retry in %d', e,
+                            self.bot.server_update_period)
+            return False
+
+        number = self._snapshot.number + 1 if self._snapshot is not None else 1
+        self._snapshot = ServerSnapshot(number, start_time, tuple(actuator_list),
+                                        types.MappingProxyType(dict(set_point_dict)))
+        self.sync_count += 1
+        self.last_sync_duration = time.time() - start_time
+        logging.debug('Server sync %d took %f', number, self.last_sync_duration)
+        return True
+
+    def getStatusList(self):
+        if self._thread is None:
+            return []
+        if self._snapshot is None:
+            return ['Server sync: %d failed, nothing synced yet' % self.failed_count]
+        return ['Server sync: %d synced, %d failed, last took %.3f, latest is %.1f secs old' %
+                (self.sync_count, self.failed_count, self.last_sync_duration,
+                 time.time() - self._snapshot.fetch_time)]
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self.bot.takeServerPoll():
+                try:
+                    success = self.sync()
+                except Exception:       # ex an unexpected payload. keep syncing, the next one may be fine
+                    logging.exception('Failed to sync overrides/set points, will retry in %d',
+                                      self.bot.server_update_period)
+                    self.failed_count += 1
+                    success = False
+                if not success:
+                    self.bot.requestServerPoll()
+            self._sync_requested.wait(self.bot.server_update_period)
+            self._sync_requested.clear()
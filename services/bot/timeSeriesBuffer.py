@@ -0,0 +1,88 @@
+from array import array
+
+
+class TimeSeriesBuffer:
+    """Ring buffer of (timestamp, value) samples, stored as two array('d') instead of a tuple per sample
+
+    A sample takes 16 bytes, vs ~120 for a tuple of two floats in a deque. The arrays grow as samples come in, up to
+    capacity. After that, each new sample overwrites the oldest, and overflow_count goes up. clear keeps the memory.
+    """
+    def __init__(self, capacity):
+        """
+        :param capacity: max samples kept
+        """
+        if capacity < 1:
+            raise ValueError('capacity should be at least 1, got %d' % capacity)
+        self.capacity = capacity
+        self.overflow_count = 0         # samples thrown away because the buffer was full
+
+        self._timestamps = array('d')
+        self._values = array('d')
+        self._start = 0                 # index of the oldest sample
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        """(timestamp, value) tuples, oldest first"""
+        timestamps, values = self.getArrays()
+        return zip(timestamps, values)
+
+    @property
+    def last_timestamp(self):
+        """timestamp of the newest sample, None if empty"""
+        if self._count == 0:
+            return None
+        return self._timestamps[(self._start + self._count - 1) % len(self._timestamps)]
+
+    def append(self, timestamp, value):
+        """Add a sample. If the buffer is full, the oldest is overwritten
+        :return: True if a sample was thrown away to make room
+        """
+        size = len(self._timestamps)
+        if self._count < size:          # room in what we already have (after a clear)
+            i = (self._start + self._count) % size
+            self._timestamps[i] = timestamp
+            self._values[i] = value
+            self._count += 1
+        elif size < self.capacity:      # full, but can grow. only gets here with _start at 0
+            self._timestamps.append(timestamp)
+            self._values.append(value)
+            self._count += 1
+        else:                           # at capacity, overwrite the oldest
+            self._timestamps[self._start] = timestamp
+            self._values[self._start] = value
+            self._start = (self._start + 1) % size
+            self.overflow_count += 1
+            return True
+        return False
+
+    def clear(self):
+        self._start = 0
+        self._count = 0
+
+    def getArrays(self):
+        """The samples, oldest first
+        :return: (timestamps array, values array). Copies, changing them doesn't change the buffer
+        """
+        end = self._start + self._count
+        size = len(self._timestamps)
+        if end <= size:
+            return self._timestamps[self._start:end], self._values[self._start:end]
+        end -= size
+        return (self._timestamps[self._start:] + self._timestamps[:end],
+                self._values[self._start:] + self._values[:end])
+
+    def formatDataPoints(self, sensing_point_url):
+        """The samples as data points for the server, see Server.postDataPoints
+        :param sensing_point_url: url of the sensing point they are for
+        :return: list of dicts with timestamp (int), value and sensing_point
+        """
+        timestamps, values = self.getArrays()
+        return [{"timestamp": int(timestamp), "value": value, "sensing_point": sensing_point_url}
+                for timestamp, value in zip(timestamps, values)]
+
+    def getMemoryBytes(self):
+        """Bytes the arrays hold (16 per sample, not counting what array over-allocates)"""
+        return self._timestamps.buffer_info()[1] * self._timestamps.itemsize * 2
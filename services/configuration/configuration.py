@@ -6,6 +6,19 @@ class SerialParameters:
     serial_read_timeout = 0.01  # seconds
     establish_connection_timeout = 4  # seconds
     receive_message_timeout = 3  # seconds
+    use_reader_thread = True    # drain the port from a background thread, see SerialReader
+    frame_ring_size = 256       # frames the reader thread holds before dropping the oldest
+    use_binary_protocol = False     # ask the groduino for binary frames after the handshake. Only turn on for firmware
+                                    # that knows GBIN, older firmware just costs a protocol_negotiation_timeout
+    protocol_negotiation_timeout = 1    # seconds to wait for the groduino to answer GBIN/GBAU
+    baud_rate_ladder = ()       # after the handshake, try these in turn, ex (19200, 38400, 57600, 115200). Only for
+                                # firmware that knows GBAU, older firmware just costs a protocol_negotiation_timeout
+    baud_probe_frame_count = 20         # probe frames sent at each new baud rate
+    baud_probe_max_error_rate = 0.05    # if more of them are lost or corrupted than this, the rate isn't reliable
+    baud_confirm_timeout = 1            # the groduino goes back to the old rate if we don't confirm in this long
+    serial_buffer_size = 4096           # serial driver's receive buffer (rpi is 4k)
+    overflow_margin_time = 0.6          # flush when the serial buffer is less than this many secs of data from full
+    message_buffer_time = 8.5           # the frame decoder holds at most this many secs of data (at least 8k)
 
 
 class ManualProfiler:
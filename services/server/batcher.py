@@ -0,0 +1,109 @@
+import collections
+import logging
+import threading
+import time
+
+
+class DataPointBatcher:
+    """Collects data points and hands them on in batches, so we make a few big posts instead of one per message
+
+    A batch is flushed (passed to flush_fn) as soon as any of these is reached:
+        max_points:  number of points in the batch
+        max_bytes:   estimated size of the posted json (see _estimateBytes)
+        max_age:     seconds since the oldest point in the batch was added
+    max_age is only checked on add and flushIfDue, so whoever owns the batcher should call flushIfDue regularly.
+    Achieved batch sizes and latency (age of the oldest point at flush) are in getStatusList.
+    """
+    _point_overhead_bytes = 48      # json for a data point without the url, ex {"timestamp":1438646393,"value":22.8,...
+    _stats_sample_count = 100       # keep stats for the last x batches
+
+    def __init__(self, flush_fn, max_points=200, max_bytes=64 * 1024, max_age=15):
+        """
+        :param flush_fn: fn(values_list) called with each batch. Called with the batcher's lock held, shouldn't block
+        :param max_points: flush at this many points
+        :param max_bytes: flush at this many (estimated) bytes
+        :param max_age: flush when the oldest point has waited this many seconds
+        """
+        self.flush_fn = flush_fn
+        self.max_points = max_points
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+        self.flush_count_dictby_reason = {'points': 0, 'bytes': 0, 'age': 0, 'forced': 0}
+        self._batch_stats_list = collections.deque(maxlen=self._stats_sample_count)    # (points, bytes, age)
+
+        self._lock = threading.Lock()
+        self._values_list = []
+        self._byte_count = 0
+        self._oldest_time = None
+
+    def add(self, values_list):
+        """Add data points to the current batch, flushing it if it is full
+        :param values_list: list of data point dicts
+        """
+        if len(values_list) == 0:
+            return
+        with self._lock:
+            if self._oldest_time is None:
+                self._oldest_time = time.time()
+            self._values_list += values_list
+            self._byte_count += self._estimateBytes(values_list)
+
+            if len(self._values_list) >= self.max_points:
+                self._flush('points')
+            elif self._byte_count >= self.max_bytes:
+                self._flush('bytes')
+            elif time.time() - self._oldest_time >= self.max_age:
+                self._flush('age')
+
+    def flushIfDue(self):
+        """Flush the current batch if its oldest point is more than max_age old"""
+        with self._lock:
+            if self._oldest_time is not None and time.time() - self._oldest_time >= self.max_age:
+                self._flush('age')
+
+    def flush(self):
+        """Flush the current batch now, whatever its size"""
+        with self._lock:
+            self._flush('forced')
+
+    def getDueTime(self):
+        """When the current batch will be flushed because of max_age
+        :return: unix time, or None if the batch is empty
+        """
+        oldest_time = self._oldest_time
+        if oldest_time is None:
+            return None
+        return oldest_time + self.max_age
+
+    def getStatusList(self):
+        stats_list = list(self._batch_stats_list)
+        if not stats_list:
+            return ['Batcher: %d points waiting, no batches yet' % len(self._values_list)]
+        count = len(stats_list)
+        reasons_str = ', '.join('%s %d' % (reason, flush_count)
+                                for reason, flush_count in sorted(self.flush_count_dictby_reason.items()))
+        return ['Batcher: %d points waiting. Last %d batches: avg %.1f points, avg %.1f KB, '
+                'latency avg %.1f max %.1f. Flushed by %s' %
+                (len(self._values_list), count, sum(s[0] for s in stats_list) / count,
+                 sum(s[1] for s in stats_list) / count / 1024, sum(s[2] for s in stats_list) / count,
+                 max(s[2] for s in stats_list), reasons_str)]
+
+    def _flush(self, reason):
+        """Hand the current batch to flush_fn. Call with _lock held"""
+        if not self._values_list:
+            return
+        values_list = self._values_list
+        age = time.time() - self._oldest_time
+        self._batch_stats_list.append((len(values_list), self._byte_count, age))
+        self.flush_count_dictby_reason[reason] += 1
+        logging.debug('Flushing batch of %d points (%s), oldest %.1f secs', len(values_list), reason, age)
+
+        self._values_list = []
+        self._byte_count = 0
+        self._oldest_time = None
+        self.flush_fn(values_list)
+
+    def _estimateBytes(self, values_list):
+        """Rough size of values_list as json. Doesn't serialize, that would cost more than the batching saves"""
+        return sum(self._point_overhead_bytes + len(v.get('sensing_point', '')) for v in values_list)
@@ -0,0 +1,188 @@
+import collections
+import json
+import logging
+import threading
+import time
+
+
+class CacheEntry:
+    """One cached response. value is what getJson returns for the url (dict, or list of results)"""
+    __slots__ = ('value', 'size', 'fetched_time', 'ttl', 'etag', 'last_modified')
+
+    def __init__(self, value, size, ttl, etag=None, last_modified=None):
+        self.value = value
+        self.size = size
+        self.fetched_time = time.time()
+        self.ttl = ttl
+        self.etag = etag
+        self.last_modified = last_modified
+
+    @property
+    def is_fresh(self):
+        return time.time() - self.fetched_time < self.ttl
+
+    @property
+    def can_revalidate(self):
+        return self.etag is not None or self.last_modified is not None
+
+    def getConditionalHeaders(self):
+        """Headers to ask the server for the resource only if it changed. Empty if we have nothing to validate with"""
+        headers = {}
+        if self.etag is not None:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified is not None:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class ResourceCache:
+    """Cache of server responses by url, with a ttl per endpoint and a cap on the memory used
+
+    An entry younger than its ttl is fresh, and can be used without asking the server. An older entry is kept until it
+    is evicted, and if it has an ETag or Last-Modified it can be revalidated with a conditional get (see
+    CacheEntry.getConditionalHeaders). The server answering 304 makes it fresh again, and counts as a hit.
+    Once the (estimated) size of the entries is over max_bytes, the least recently used ones are evicted.
+    Hit/miss/revalidation counters are in getStatusList. All methods are thread safe.
+    """
+    def __init__(self, base_url, ttl_dictby_endpoint=None, default_ttl=300, max_bytes=2 * 1024 * 1024):
+        """
+        :param base_url: server url, to get the endpoint from a url. ex 'http://.../' + 'actuator/1/' -> 'actuator'
+        :param ttl_dictby_endpoint: seconds entries of each endpoint (lowerCamelCase, like the api root) stay fresh
+        :param default_ttl: ttl for endpoints not in ttl_dictby_endpoint
+        :param max_bytes: evict least recently used entries over this
+        """
+        self.base_url = base_url
+        self.ttl_dictby_endpoint = dict(ttl_dictby_endpoint or {})
+        self.default_ttl = default_ttl
+        self.max_bytes = max_bytes
+
+        self.hit_count = 0
+        self.miss_count = 0             # not cached at all
+        self.expired_count = 0          # cached but stale, and changed (or couldn't revalidate). got it again in full
+        self.revalidated_count = 0      # stale, server said 304. these are counted as hits too
+        self.eviction_count = 0
+
+        self._lock = threading.RLock()
+        self._entry_dictby_url = collections.OrderedDict()     # least recently used first
+        self._byte_count = 0
+
+    def __contains__(self, url):
+        return url in self._entry_dictby_url
+
+    def __len__(self):
+        return len(self._entry_dictby_url)
+
+    def getTtl(self, url):
+        """ttl for url, by its endpoint (the first part of the path after base_url)"""
+        if url.startswith(self.base_url):
+            endpoint = url[len(self.base_url):].split('/', 1)[0]
+            return self.ttl_dictby_endpoint.get(endpoint, self.default_ttl)
+        return self.default_ttl
+
+    def getEntry(self, url):
+        """Get the entry for url, fresh or not, and mark it as recently used. Doesn't count as a hit or miss
+        :return: CacheEntry, or None if url isn't cached
+        """
+        with self._lock:
+            entry = self._entry_dictby_url.get(url)
+            if entry is not None:
+                self._entry_dictby_url.move_to_end(url)
+            return entry
+
+    def lookup(self, url, allow_stale=False):
+        """Get the cached value for url if it is fresh (or at all, if allow_stale), counting the hit or miss.
+        A stale entry that can be revalidated isn't counted yet, see revalidated
+        :return: (value, entry). value is None if it has to be got from the server. entry is None if not cached
+        """
+        with self._lock:
+            entry = self.getEntry(url)
+            if entry is not None and (allow_stale or entry.is_fresh):
+                self.hit_count += 1
+                return entry.value, entry
+            if entry is None:
+                self.miss_count += 1
+            elif not entry.can_revalidate:
+                self.expired_count += 1
+            return None, entry
+
+    def revalidated(self, entry, not_modified):
+        """Count the result of a conditional get for a stale entry. If not modified (304), make it fresh again
+        :param entry: entry from lookup
+        :param not_modified: True if the server said 304
+        :return: the entry's value if not modified, else None (put the new one)
+        """
+        with self._lock:
+            if not not_modified:
+                self.expired_count += 1
+                return None
+            entry.fetched_time = time.time()
+            self.revalidated_count += 1
+            self.hit_count += 1
+            return entry.value
+
+    def put(self, url, value, size=None, etag=None, last_modified=None):
+        """Add or replace the entry for url
+        :param value: json data
+        :param size: size of the response in bytes. If None, estimated from the json
+        :param etag: ETag header of the response, if any
+        :param last_modified: Last-Modified header of the response, if any
+        """
+        if size is None:
+            size = self._estimateBytes(value)
+        entry = CacheEntry(value, size, self.getTtl(url), etag, last_modified)
+        with self._lock:
+            old_entry = self._entry_dictby_url.pop(url, None)
+            if old_entry is not None:
+                self._byte_count -= old_entry.size
+            self._entry_dictby_url[url] = entry
+            self._byte_count += size
+            self._evict()
+
+    def dump(self):
+        """All entries, least recently used first, as json-able dicts. See load
+        :return: list of dicts with url, value, etag and last_modified
+        """
+        with self._lock:
+            return [{'url': url, 'value': entry.value, 'etag': entry.etag, 'last_modified': entry.last_modified}
+                    for url, entry in self._entry_dictby_url.items()]
+
+    def load(self, entry_dict_list):
+        """Add entries from dump. They are added as stale, so they are only used without asking the server when
+        stale entries are allowed (see lookup), and are revalidated otherwise
+        :param entry_dict_list: list from dump
+        """
+        with self._lock:
+            for entry_dict in entry_dict_list:
+                self.put(entry_dict['url'], entry_dict['value'], etag=entry_dict.get('etag'),
+                         last_modified=entry_dict.get('last_modified'))
+                self._entry_dictby_url[entry_dict['url']].fetched_time = 0
+
+    def invalidate(self, url=None):
+        """Drop url from the cache, or everything if url is None"""
+        with self._lock:
+            if url is None:
+                self._entry_dictby_url.clear()
+                self._byte_count = 0
+                return
+            entry = self._entry_dictby_url.pop(url, None)
+            if entry is not None:
+                self._byte_count -= entry.size
+
+    def getStatusList(self):
+        lookup_count = self.hit_count + self.miss_count + self.expired_count
+        hit_rate = 100. * self.hit_count / lookup_count if lookup_count else 0
+        return ['Cache: %d entries, %d/%d KB, %d hits (%.1f%%, %d revalidated), %d misses, %d expired, %d evicted' %
+                (len(self._entry_dictby_url), self._byte_count // 1024, self.max_bytes // 1024, self.hit_count,
+                 hit_rate, self.revalidated_count, self.miss_count, self.expired_count, self.eviction_count)]
+
+    def _evict(self):
+        """Drop least recently used entries until we are under max_bytes. Call with _lock held"""
+        while self._byte_count > self.max_bytes and len(self._entry_dictby_url) > 1:
+            url, entry = self._entry_dictby_url.popitem(last=False)
+            self._byte_count -= entry.size
+            self.eviction_count += 1
+            logging.debug('Evicted %s from the cache', url)
+
+    @staticmethod
+    def _estimateBytes(value):
+        return len(json.dumps(value, separators=(',', ':')))
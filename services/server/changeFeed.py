@@ -0,0 +1,107 @@
+import collections
+import logging
+import threading
+
+import requests.exceptions
+
+import sys
+if sys.version_info < (3, 3, 0):
+    from requests import ConnectionError
+
+
+class ChangeFeed:
+    """Long-polls the server's change feed (see Server.getChanges) in a thread, and queues the changes for the owner
+
+    Each poll waits on the server until something changes (or wait seconds pass), so changes arrive within a round
+    trip, and an idle feed is one request every wait seconds. The owner takes the changes with popChanges, on its own
+    thread, and applies them.
+    While is_connected is False (the feed dropped, or the server has none), the owner should poll instead. The feed
+    keeps trying to reconnect, backing off from retry_delay up to max_retry_delay. Changes made while it was down
+    are missed, so resync_count goes up on every (re)connect: when it changes, the owner should poll once to catch up.
+    :type server: Server
+    """
+    wait = 25                   # seconds the server holds a poll open if nothing changes
+    retry_delay = 1             # after the feed drops, wait this long before reconnecting
+    max_retry_delay = 60        # retry_delay doubles on each failure up to this
+    max_queued_changes = 1000   # if the owner doesn't pop changes, only keep this many. (and resync)
+
+    def __init__(self, server):
+        self.server = server
+        self.is_connected = False
+        self.is_supported = True        # False once the server said it has no change feed
+        self.resync_count = 0
+        self.request_count = 0
+        self.change_count = 0
+        self.drop_count = 0
+
+        self._seq = None                # last change we have. None to start from now
+        self._change_queue = collections.deque()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='change feed', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop after the current poll returns (up to wait seconds). Doesn't wait for it"""
+        self._stop.set()
+
+    def popChanges(self):
+        """Get the changes that came in since the last call, oldest first
+        :return: list of dicts with url (of the resource that changed) and data (the resource now)
+        """
+        with self._lock:
+            change_list = list(self._change_queue)
+            self._change_queue.clear()
+        return change_list
+
+    def getStatusList(self):
+        if not self.is_supported:
+            return ['Change feed: not supported by the server, polling']
+        return ['Change feed: %s, %d changes in %d requests, dropped %d times, %d resyncs' %
+                ('connected' if self.is_connected else 'disconnected, polling', self.change_count,
+                 self.request_count, self.drop_count, self.resync_count)]
+
+    def _run(self):
+        current_retry_delay = self.retry_delay
+        while not self._stop.is_set():
+            try:
+                self.request_count += 1
+                data = self.server.getChanges(self._seq, self.wait)
+            except (ConnectionError, requests.exceptions.RequestException, ValueError) as e:
+                if self.is_connected:
+                    self.drop_count += 1
+                    logging.warning('Change feed dropped (%s), polling until it is back', e)
+                self.is_connected = False
+                self._stop.wait(current_retry_delay)
+                current_retry_delay = min(current_retry_delay * 2, self.max_retry_delay)
+                continue
+
+            if data is None:
+                logging.info('Server has no change feed, polling instead')
+                self.is_supported = False
+                self.is_connected = False
+                return
+
+            current_retry_delay = self.retry_delay
+            if not self.is_connected or data.get('resync'):     # may have missed changes, owner has to poll once
+                self.is_connected = True
+                self.resync_count += 1
+                logging.info('Change feed connected at %s', data['seq'])
+            self._seq = data['seq']
+            self._queueChanges(data.get('changes') or [])
+
+    def _queueChanges(self, change_list):
+        if not change_list:
+            return
+        with self._lock:
+            self._change_queue.extend(change_list)
+            if len(self._change_queue) > self.max_queued_changes:
+                self._change_queue.clear()
+                self.resync_count += 1
+                logging.warning('Over %d changes waiting, dropped them, will resync', self.max_queued_changes)
+        self.change_count += len(change_list)
+        logging.debug('Got %d changes from the feed, at %s', len(change_list), self._seq)
@@ -0,0 +1,218 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+
+class DataPointOutbox:
+    """Durable store-and-forward queue for data point batches, in an SQLite database (WAL mode)
+
+    Batches are appended before anything tries to send them, and only removed once the server has them (ack).
+    If the server is down they just stay here, and are replayed in big batches once it is back (see claim).
+
+    To keep SD card writes down, appends are group committed: they are held in memory until there are
+    commit_point_count points or the oldest is commit_interval seconds old, then written in one transaction.
+    append never touches the database, so the control loop never waits on the disk. The commit is done by whoever
+    calls claim (the upload workers), flush or close.
+    claim only ever hands out committed batches, so nothing is sent before it is on disk.
+    If a commit fails (disk full, worn SD card), it is rolled back and the batches stay pending in memory for the
+    next try.
+    If the stored batches get over max_bytes, the oldest ones (that aren't being sent) are dropped.
+    All methods are thread safe. After close, claim gives nothing and ack/release do nothing (unacked batches are
+    replayed next run).
+    """
+    commit_interval = 5             # seconds. max time an appended batch waits in memory before it's committed
+    commit_point_count = 500        # commit as soon as this many points are waiting
+    max_bytes = 50 * 1024 * 1024    # cap on the stored payloads. oldest batches are dropped over this
+    _max_sql_parameters = 500
+
+    def __init__(self, file_name):
+        """
+        :param file_name: database file, created if it doesn't exist. Batches left from the last run are kept
+        """
+        self.file_name = file_name
+        self.dropped_point_count = 0
+        self.commit_count = 0
+
+        self._lock = threading.Lock()         # for the database. held while committing
+        self._pending_lock = threading.Lock()     # for the pending batches only, so append never waits on a commit
+        self._pending_list = []         # batches appended but not committed yet
+        self._pending_point_count = 0
+        self._pending_since = None      # when the oldest pending batch was appended
+        self._claimed_id_set = set()    # ids handed out by claim and not acked/released yet
+
+        self._db = sqlite3.connect(file_name, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')     # WAL + NORMAL: durable across crashes, fewer fsyncs
+        self._db.execute('CREATE TABLE IF NOT EXISTS batch ('
+                         'id INTEGER PRIMARY KEY AUTOINCREMENT, created REAL, point_count INTEGER, '
+                         'size INTEGER, payload TEXT)')
+        self._stored_bytes, self._stored_point_count = self._db.execute(
+            'SELECT COALESCE(SUM(size), 0), COALESCE(SUM(point_count), 0) FROM batch').fetchone()
+        if self._stored_point_count:
+            logging.info('Outbox %s has %d points from before, will replay them', file_name, self._stored_point_count)
+
+    def append(self, values_list):
+        """Add a batch of data points. Only kept in memory, it gets committed with the next group commit (see class
+        docs)
+        :param values_list: list of data point dicts
+        :return: True if a commit is due, so the caller can wake a worker to claim
+        """
+        if len(values_list) == 0:
+            return False
+        with self._pending_lock:
+            if self._pending_since is None:
+                self._pending_since = time.time()
+            self._pending_list.append(values_list)
+            self._pending_point_count += len(values_list)
+            return self._pending_point_count >= self.commit_point_count
+
+    def flush(self):
+        """Commit everything pending now"""
+        with self._lock:
+            if self._db is not None:
+                self._commit()
+
+    def claim(self, max_point_count):
+        """Get the oldest committed batches (that nobody else has claimed), merged into one list. Commits pending
+        batches first if they are due. The batches stay stored until ack, or go back to being available on release
+        :param max_point_count: get at most this many points (but always at least one batch)
+        :return: (id list, values_list). Empty lists if there is nothing to send
+        """
+        with self._lock:
+            if self._db is None:
+                return [], []
+            if self._isCommitDue():
+                self._commit()
+
+            id_list = []
+            values_list = []
+            cursor = self._db.execute('SELECT id, point_count, payload FROM batch ORDER BY id')
+            for batch_id, point_count, payload in cursor:
+                if batch_id in self._claimed_id_set:
+                    continue
+                if id_list and len(values_list) + point_count > max_point_count:
+                    break
+                id_list.append(batch_id)
+                values_list += json.loads(payload)
+            cursor.close()
+            self._claimed_id_set.update(id_list)
+            return id_list, values_list
+
+    def ack(self, id_list):
+        """The server has these batches, delete them
+        :param id_list: ids from claim
+        """
+        with self._lock:
+            if self._db is None:        # closed while it was being posted. it is sent again next run
+                return
+            self._delete(id_list)
+            self._claimed_id_set.difference_update(id_list)
+
+    def release(self, id_list):
+        """Sending these batches failed, make them available to claim again
+        :param id_list: ids from claim
+        """
+        with self._lock:
+            self._claimed_id_set.difference_update(id_list)
+
+    def close(self):
+        """Commit anything pending and close the database"""
+        with self._lock:
+            if self._db is None:
+                return
+            self._commit()
+            self._db.close()
+            self._db = None
+
+    @property
+    def point_count(self):
+        """Points waiting to be sent (committed or not)"""
+        return self._stored_point_count + self._pending_point_count
+
+    def getStatusList(self):
+        return ['Outbox: %d points waiting (%d pending commit), %d KB stored, %d claimed batches, '
+                '%d commits, %d points dropped' %
+                (self.point_count, self._pending_point_count, self._stored_bytes // 1024,
+                 len(self._claimed_id_set), self.commit_count, self.dropped_point_count)]
+
+    # ----- Internal, call with _lock held -----
+
+    def _isCommitDue(self):
+        with self._pending_lock:
+            return self._pending_point_count >= self.commit_point_count or \
+                (self._pending_since is not None and time.time() - self._pending_since >= self.commit_interval)
+
+    def _commit(self):
+        with self._pending_lock:        # appends go on into a new list while these are written
+            pending_list, self._pending_list = self._pending_list, []
+            pending_since, self._pending_since = self._pending_since, None
+        if not pending_list:
+            return
+        now = time.time()
+        row_list = []
+        for values_list in pending_list:
+            payload = json.dumps(values_list, separators=(',', ':'))
+            row_list.append((now, len(values_list), len(payload), payload))
+        point_count = sum(row[1] for row in row_list)
+
+        try:
+            self._db.execute('BEGIN')
+            self._db.executemany('INSERT INTO batch (created, point_count, size, payload) VALUES (?, ?, ?, ?)',
+                                 row_list)
+            self._db.execute('COMMIT')
+        except sqlite3.Error:
+            logging.exception('Failed to commit %d points to the outbox %s, keeping them for the next commit',
+                              point_count, self.file_name)
+            self._rollback()
+            with self._pending_lock:        # back in front of anything appended meanwhile, so the order is kept
+                self._pending_list[:0] = pending_list
+                self._pending_since = pending_since
+            return
+        self.commit_count += 1
+        self._stored_bytes += sum(row[2] for row in row_list)
+        self._stored_point_count += point_count
+        with self._pending_lock:
+            self._pending_point_count -= point_count
+
+        if self._stored_bytes > self.max_bytes:
+            self._trim()
+
+    def _rollback(self):
+        if not self._db.in_transaction:
+            return
+        try:
+            self._db.execute('ROLLBACK')
+        except sqlite3.Error:
+            logging.exception('Failed to roll back the outbox %s', self.file_name)
+
+    def _trim(self):
+        """Drop the oldest unclaimed batches until we are under max_bytes"""
+        drop_id_list = []
+        drop_point_count = 0
+        bytes_left = self._stored_bytes
+        for batch_id, point_count, size in self._db.execute('SELECT id, point_count, size FROM batch ORDER BY id'):
+            if bytes_left <= self.max_bytes:
+                break
+            if batch_id in self._claimed_id_set:
+                continue
+            drop_id_list.append(batch_id)
+            drop_point_count += point_count
+            bytes_left -= size
+        if not drop_id_list:        # everything over the cap is being sent, it goes once acked
+            return
+        self._delete(drop_id_list)
+        self.dropped_point_count += drop_point_count
+        logging.error('Outbox is over %d bytes, dropped the oldest %d points', self.max_bytes, drop_point_count)
+
+    def _delete(self, id_list):
+        # chunked, older sqlite only allows 999 parameters per statement
+        for start in range(0, len(id_list), self._max_sql_parameters):
+            chunk = id_list[start:start + self._max_sql_parameters]
+            placeholders = ','.join('?' * len(chunk))
+            size, point_count = self._db.execute('SELECT COALESCE(SUM(size), 0), COALESCE(SUM(point_count), 0) '
+                                                 'FROM batch WHERE id IN (%s)' % placeholders, chunk).fetchone()
+            self._db.execute('DELETE FROM batch WHERE id IN (%s)' % placeholders, chunk)
+            self._stored_bytes -= size
+            self._stored_point_count -= point_count
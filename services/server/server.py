@@ -1,11 +1,24 @@
+import collections
+import concurrent.futures
+import contextlib
+import gzip
 import json
 import logging
 import requests
+import requests.adapters
 import requests.exceptions
-import threading
 import os
+import sqlite3
 import sys
+import threading
 import time
+import zlib
+from urllib.parse import parse_qs, urlencode, urlsplit, urlunsplit
+
+from .batcher import DataPointBatcher
+from .cache import ResourceCache
+from .outbox import DataPointOutbox
+from .uploader import DataPointUploader
 
 if sys.version_info < (3, 3, 0):
     from requests import ConnectionError
@@ -16,48 +29,265 @@ if sys.version_info < (3, 3, 0):
 # TODO add timeout to post!
 # Note: for convention, all urls will have trailing slash. So if you are appending to them, no beginning slash needed
 class Server:
+    """Everything that talks to the plantOS server goes through here
+
+    All requests go through one requests.Session, so connections to the server are kept alive and reused, and the
+    auth header is set once. The session's connection pool is thread safe, so the post threads share it too.
+    See getConnectionStats to check that connections actually get reused.
+
+    Nothing is requested until it is needed (logging in included), so a Server can be created while the server is
+    down. With a topology snapshot (see saveSnapshot), the cache starts with everything the last run got, and the bot
+    can be set up from it without the server (see preferCache), then checked against the server (refreshSnapshot).
+    """
     _max_retries = 5            # max retries for post
     _req_timeout = 5                # timeout for requests
+    _connect_timeout = 3.05     # timeout for opening a new connection (a bit over a multiple of 3, see requests docs)
+    _post_timeout = 15          # timeout for posting data points, these can be big
+    _pool_connections = 2       # number of hosts to keep pools for. We only really talk to one
+    _pool_maxsize = 12          # connections kept alive per host. Should be >= _upload_workers + the fetch/page workers
     _warn_results_count = 500   # when getting all results, will warn if there are >_warn_results_count results
     _max_results_count = 1000   # if # results > this, will throw error and return _max_results_count results
-
-    _max_threads = 5            # if there are too many threads, will kill some of them. see postDataPoints
-    _time_to_wait_for_threads = 0.1         # If we have too many threads, we will wait for this long and check again.
-    _min_time_to_wait_for_threads = 0.1     # When we are decreasing the wait time, don't go lower than this
-    _max_time_to_wait_for_threads = 2       # We don't want to wait for threads for longer than this
+    _max_fetch_workers = 6      # threads for getting urls concurrently. see refreshSnapshot
+    _max_page_workers = 4       # threads for getting the pages of a list concurrently. see getJson
+    _latency_sample_count = 100     # keep the latency of the last x pages for stats
+    _prefetch_max_depth = 6     # prefetch follows references at most this many levels down. see prefetch
+    # endpoints prefetch follows references to. Not dataPoint etc, there is no end to those
+    _prefetch_endpoints = ('actuator', 'actuatorType', 'controlProfile', 'resource', 'resourceEffect',
+                           'resourceProperty', 'resourceType', 'sensingPoint')
+    _cache_max_bytes = 2 * 1024 * 1024  # least recently used responses are dropped from the cache over this
+    _cache_default_ttl = 300    # seconds a cached response can be used without asking the server again
+    _cache_ttl_dictby_endpoint = {'actuator': 0,    # overrides, always check
+                                  'tray': 0,        # set points
+                                  'setPoint': 0,
+                                  'dataPoint': 0,
+                                  }
+
+    _upload_workers = 2         # threads posting data points. see postDataPoints and DataPointUploader
+    _upload_queue_size = 20     # batches waiting to be posted before the overflow policy kicks in
+    _upload_policy = DataPointUploader.POLICY_COALESCE
+    _outbox_file_name = 'datapoint_outbox.db'   # store-and-forward for data points. None to only queue in memory
+    _batch_max_points = 200     # data points are posted in batches of up to this many points. see DataPointBatcher
+    _batch_max_bytes = 64 * 1024    # or this many bytes
+    _batch_max_age = 15         # or when the oldest point has waited this long (seconds)
+    # 4xx codes a post is retried on (auth, timeouts, rate limits). Any other 4xx is the batch itself, it is dropped
+    _retry_post_codes = (401, 403, 408, 429)
+    _compress_min_bytes = 1024  # if compressing uploads, don't bother for bodies smaller than this
+    _compress_level = 6         # zlib level. 6 is the usual default, higher costs a lot more cpu for little gain
+    compress_encodings = (None, 'gzip', 'deflate')
+    _snapshot_version = 1       # snapshots with another version are ignored. bump if the format changes
 
     _base_url = ''
 
     _post_datapoint_url = ''
 
-    def __init__(self, base_url=None):
-        # Get Server IP
-        f = open(os.path.join('/home/pi/', 'server_ip.txt'), 'r')
-        server_ip = f.readline();
-        f.close()
-        self._base_url = "http://" + server_ip.strip() + "/"
-        self._post_datapoint_url = self._base_url + 'dataPoint/'        
-
-        if base_url is not None:
-            self._base_url = base_url
+    def __init__(self, base_url=None, compress_encoding=None, snapshot_file_name=None):
+        """
+        :param base_url: url of the server, with trailing slash. If None, uses the ip in /home/pi/server_ip.txt
+        :param compress_encoding: compress data point uploads, one of compress_encodings. The server has to accept
+        the Content-Encoding. See _postDataPoints
+        :param snapshot_file_name: topology snapshot to load, if it exists (see loadSnapshot). None for no snapshot
+        """
+        if compress_encoding not in self.compress_encodings:
+            raise ValueError('Unknown compression %s, should be one of %s' % (compress_encoding, self.compress_encodings))
+        self._compress_encoding = compress_encoding
+        self._upload_raw_byte_count = 0     # size of the data point uploads before compression
+        self._upload_sent_byte_count = 0    # and after
+
+        if base_url is None:
+            # Get Server IP
+            f = open(os.path.join('/home/pi/', 'server_ip.txt'), 'r')
+            server_ip = f.readline();
+            f.close()
+            base_url = "http://" + server_ip.strip() + "/"
+        self._base_url = base_url
+        self._post_datapoint_url = self._base_url + 'dataPoint/'
  
-        # Authorization
-        data = { 'username':'plantos', 'password':'plantos' }
-        data_string = json.dumps(data)
-        headers = {'Content-type': 'application/json'}
-        req = requests.post(self._base_url+"auth/login/", params={"many": True}, data=data_string, headers=headers)
-        if req.status_code != 200:
-            logging.error('Failed to post %s: Code %d', data_string, req.status_code) 
-        else:
+        # Persistent session with keep-alive. Retries are done by us, not by the adapter
+        self._session = requests.Session()
+        self._adapter = requests.adapters.HTTPAdapter(pool_connections=self._pool_connections,
+                                                      pool_maxsize=self._pool_maxsize)
+        self._session.mount('http://', self._adapter)
+        self._session.mount('https://', self._adapter)
+
+        # Authorization and urls are only gotten when needed, see _login and _getUrlsDict
+        self._token = None
+        self._login_lock = threading.Lock()
+        self._urls_dictby_name = None
+        self._prefer_cache = False      # see preferCache
+
+        self._resource_cache = ResourceCache(self._base_url, self._cache_ttl_dictby_endpoint, self._cache_default_ttl,
+                                             self._cache_max_bytes)
+        self._fetch_executor = concurrent.futures.ThreadPoolExecutor(max_workers=self._max_fetch_workers)
+        # separate, getJson on a fetch thread waits for its pages. On the same pool they could wait on each other
+        self._page_executor = concurrent.futures.ThreadPoolExecutor(max_workers=self._max_page_workers)
+        self._page_latency_list = collections.deque(maxlen=self._latency_sample_count)
+        self._outbox = None
+        if self._outbox_file_name is not None:
+            try:
+                self._outbox = DataPointOutbox(self._outbox_file_name)
+            except sqlite3.Error:
+                logging.exception("Couldn't open outbox %s, data points will only be queued in memory",
+                                  self._outbox_file_name)
+        self._uploader = DataPointUploader(self._postDataPoints, self._upload_workers, self._upload_queue_size,
+                                           self._upload_policy, self._outbox)
+        self._uploader.start()
+        self._batcher = DataPointBatcher(self._uploader.submit, self._batch_max_points, self._batch_max_bytes,
+                                         self._batch_max_age)
+
+        self.snapshot_file_name = snapshot_file_name
+        self.snapshot_loaded = False
+        if snapshot_file_name is not None:
+            self.snapshot_loaded = self.loadSnapshot(snapshot_file_name)
+
+        logging.debug('Server created')
+
+    def _login(self):
+        """Get the auth token if we don't have it yet. Thread safe
+        Raises ConnectionError if the server can't be reached
+        """
+        with self._login_lock:
+            if self._token is not None:
+                return
+            data = { 'username':'plantos', 'password':'plantos' }
+            data_string = json.dumps(data)
+            headers = {'Content-type': 'application/json'}
+            try:
+                req = self._session.post(self._base_url+"auth/login/", params={"many": True}, data=data_string,
+                                         headers=headers, timeout=(self._connect_timeout, self._req_timeout))
+            except requests.exceptions.RequestException as e:
+                logging.error('Failed to log in, RequestException: %s', e)
+                raise ConnectionError(e)
+            if req.status_code != 200:
+                logging.error('Failed to post %s: Code %d', data_string, req.status_code)
+                raise ConnectionError('Login failed with code %d' % req.status_code)
             logging.debug('Acquired authentication token!')
-        self._token = req.json()['key']
-        
-        # Get Urls       
-        self._urls_dictby_name = self._getJsonWithRetry(self._base_url)
-        self._cache_dictby_url = {}
-        self._thread_list = []
-
-        logging.debug('Server created, urls gotten!')
+            self._token = req.json()['key']
+            self._session.headers['Authorization'] = 'Token ' + self._token     # every request after this is authorized
+
+    def _getUrlsDict(self):
+        """The api root, endpoint urls by name. Gotten from the server the first time (unless from a snapshot)"""
+        if self._urls_dictby_name is None:
+            self._urls_dictby_name = self._getJsonWithRetry(self._base_url)
+            logging.debug('Urls gotten!')
+        return self._urls_dictby_name
+
+    # ----- Topology snapshot -----
+
+    def saveSnapshot(self, file_name=None):
+        """Save the api root and everything in the cache to a file, so the next run can start without the server.
+        Written to a temp file and renamed, so a crash can't leave half a snapshot
+        :param file_name: defaults to self.snapshot_file_name
+        """
+        file_name = file_name or self.snapshot_file_name
+        snapshot_dict = {'version': self._snapshot_version,
+                         'base_url': self._base_url,
+                         'saved': time.time(),
+                         'urls_dictby_name': self._getUrlsDict(),
+                         'entries': [entry_dict for entry_dict in self._resource_cache.dump()
+                                     if not entry_dict['url'].startswith(self._post_datapoint_url)],
+                         }
+        temp_file_name = file_name + '.tmp'
+        with open(temp_file_name, 'w') as f:
+            json.dump(snapshot_dict, f, separators=(',', ':'))
+        os.replace(temp_file_name, file_name)
+        logging.info('Saved topology snapshot of %d responses to %s', len(snapshot_dict['entries']), file_name)
+
+    def loadSnapshot(self, file_name):
+        """Load a snapshot from saveSnapshot into the cache. Ignored if it is for another server or can't be read
+        The entries are stale, see preferCache and refreshSnapshot
+        :return: True if it was loaded
+        """
+        try:
+            with open(file_name, 'r') as f:
+                snapshot_dict = json.load(f)
+        except FileNotFoundError:
+            logging.info('No topology snapshot %s, getting everything from the server', file_name)
+            return False
+        except (OSError, ValueError):
+            logging.exception('Failed to read topology snapshot %s, ignoring it', file_name)
+            return False
+        if snapshot_dict.get('version') != self._snapshot_version or snapshot_dict.get('base_url') != self._base_url:
+            logging.warning('Topology snapshot %s is for another server or version, ignoring it', file_name)
+            return False
+
+        self._urls_dictby_name = snapshot_dict['urls_dictby_name']
+        self._resource_cache.load(snapshot_dict['entries'])
+        logging.info('Loaded topology snapshot of %d responses from %s (saved %s)', len(snapshot_dict['entries']),
+                     file_name, time.ctime(snapshot_dict['saved']))
+        return True
+
+    def refreshSnapshot(self):
+        """Check everything in the cache against the server and save the snapshot again
+        Uses conditional gets, so unchanged responses are cheap. Lists are got first, that refreshes their items too
+        Raises ConnectionError (or RequestException) if the server can't be reached
+        :return: list of urls whose data changed. Endpoints with a ttl of 0 (overrides, set points) change all the
+        time, so they aren't included
+        """
+        old_dict_list = [entry_dict for entry_dict in self._resource_cache.dump()
+                         if not entry_dict['url'].startswith(self._post_datapoint_url)]
+        self._urls_dictby_name = self._getJsonWithRetry(self._base_url)     # keeps the snapshot's if this fails
+
+        list_url_list = [d['url'] for d in old_dict_list if type(d['value']) == list]
+        item_url_list = [d['url'] for d in old_dict_list if type(d['value']) != list]
+        value_dictby_url = dict(zip(list_url_list, self._fetch_executor.map(self.getJson, list_url_list)))
+        value_dictby_url.update(zip(item_url_list, self._fetch_executor.map(self.getJson, item_url_list)))
+
+        changed_url_list = [d['url'] for d in old_dict_list
+                            if value_dictby_url[d['url']] != d['value'] and self._resource_cache.getTtl(d['url']) > 0]
+        if self.snapshot_file_name is not None:
+            self.saveSnapshot()
+        return changed_url_list
+
+    def prefetch(self, url_list):
+        """Get url_list and everything they reference (recursively) into the cache, concurrently
+        Goes breadth first: gets a whole level at the same time on the fetch threads, collects the urls in the
+        responses that aren't cached yet, and gets those next. So the time it takes is about one round trip per
+        level instead of one per url. Only follows urls of _prefetch_endpoints, down to _prefetch_max_depth levels
+        :param url_list: urls to start from, ex the endpoint lists
+        :return: number of urls gotten
+        """
+        start_time = time.time()
+        seen_url_set = set()
+        level_url_list = list(url_list)
+        depth = 0
+        while level_url_list and depth <= self._prefetch_max_depth:
+            seen_url_set.update(level_url_list)
+            next_url_set = set()
+            for data in self._fetch_executor.map(self.getJson, level_url_list):
+                self._collectUrls(data, next_url_set)
+            level_url_list = [url for url in next_url_set
+                              if url not in seen_url_set and url not in self._resource_cache and self._canPrefetch(url)]
+            depth += 1
+        logging.info('Prefetched %d urls in %d levels, took %f', len(seen_url_set), depth, time.time() - start_time)
+        return len(seen_url_set)
+
+    def _canPrefetch(self, url):
+        if not url.startswith(self._base_url):
+            return False
+        return url[len(self._base_url):].split('/', 1)[0] in self._prefetch_endpoints
+
+    def _collectUrls(self, data, url_set):
+        """Add every url string in some json (any depth) to url_set"""
+        if isinstance(data, str):
+            if data.startswith(self._base_url):
+                url_set.add(data)
+        elif isinstance(data, dict):
+            for value in data.values():
+                self._collectUrls(value, url_set)
+        elif isinstance(data, list):
+            for value in data:
+                self._collectUrls(value, url_set)
+
+    @contextlib.contextmanager
+    def preferCache(self):
+        """While in this context, getJson uses cached data (even stale) whenever it has it, like update=False
+        Use it while setting up from a snapshot, so nothing goes to the server unless it isn't in the snapshot
+        """
+        self._prefer_cache = True
+        try:
+            yield
+        finally:
+            self._prefer_cache = False
 
     # NOTE: this method will retry according to self._max_retries, so failure will take a little while
     # On start (first req), we may want the failure sooner, but this is a daemon, so we aren't worried about it
@@ -66,14 +296,22 @@ class Server:
         :param url: url to get
         :return: json data returned from server
         """
+        return self._getWithRetry(url).json()
+
+    def _getWithRetry(self, url, headers=None):
+        """Get url with retries. See _getJsonWithRetry
+        :param url: url to get
+        :param headers: extra headers, ex If-None-Match. If given, 304 Not Modified is ok too
+        :return: the response
+        """
+        self._login()
         retry_count = 0
         req = None
         while retry_count < self._max_retries:
             try:
-                #val = 'Token ' + self._token
-                headers = {'Authorization': 'Token ' + self._token} 
-                req = requests.get(url, timeout=self._req_timeout, headers=headers)
-                if req.status_code == requests.codes.ok:
+                req = self._session.get(url, headers=headers, timeout=(self._connect_timeout, self._req_timeout))
+                if req.status_code == requests.codes.ok or \
+                        (headers and req.status_code == requests.codes.not_modified):
                     break
                 logging.warning('Failed to get %s, status %d, retry %d' % (url, req.status_code, retry_count))
             except requests.exceptions.RequestException as e:
@@ -91,21 +329,49 @@ class Server:
                 logging.error("No request, no reason!")
                 raise ConnectionError
 
-        return req.json()
+        return req
 
     # TODO check documentation
-    def _cache(self, url, results):
+    def _cache(self, url, results, size=None, etag=None, last_modified=None):
         """Add the results to the cache
         :param url: url that was queried. If its an endpoint, will extract entries and cache both. If entry, just cache
         :param results: what you want to cache. dict or list
+        :param size: size of the response, estimated if None
+        :param etag: ETag of the response, to revalidate with. Only pass it if results is everything the response
+        covers (not for lists put together from several pages)
+        :param last_modified: Last-Modified of the response, same as etag
         """
         # TODO think about how to do this best. see ServerResourceLazyDict comments below
-        self._cache_dictby_url[url] = results
+        self._resource_cache.put(url, results, size, etag, last_modified)
 
         if type(results) == list:
             for item in results:
                 if 'url' in item:
-                    self._cache_dictby_url[item['url']] = item
+                    self._resource_cache.put(item['url'], item)
+
+    @property
+    def base_url(self):
+        return self._base_url
+
+    def getChanges(self, since=None, wait=25):
+        """Long-poll the server's change feed, GET changes/?since=x&wait=y. The server answers as soon as something
+        changed after since, or after wait seconds with no changes. See ChangeFeed
+        One request, no retries. Raises ConnectionError (or RequestException) on failure
+        :param since: seq of the last change we have. None to just get the current seq
+        :param wait: seconds the server should wait for a change
+        :return: dict with seq, changes (list of dicts with seq, url and data) and resync (True if changes since
+        'since' are gone, poll everything). None if the server has no change feed
+        """
+        self._login()
+        params = {'wait': wait}
+        if since is not None:
+            params['since'] = since
+        req = self._session.get(self._base_url + 'changes/', params=params,
+                                timeout=(self._connect_timeout, wait + self._req_timeout))
+        if req.status_code == requests.codes.not_found:
+            return None
+        req.raise_for_status()
+        return req.json()
 
     def getUrlByName(self, name: str):
         """Get the url for an endpoint. Uses the info in self_base_url
@@ -114,12 +380,16 @@ class Server:
         """
         split_name = name.split('_')
         camel_name = split_name[0] + "".join(x.capitalize() for x in split_name[1:])
-        return self._urls_dictby_name[camel_name]
+        return self._getUrlsDict()[camel_name]
 
     def getJson(self, url, allpages=True, update=True):
         """Get a url and return json. If update is False, will try to get it from local cache first.
+        If update is True, the cache is still used while the response is fresh (see _cache_ttl_dictby_endpoint). Once
+        it is stale, it is revalidated with a conditional get if the server gave an ETag/Last-Modified (304 -> cache).
 
         Assumes data is paginated, uses next to get all the data if allpages=True
+        Once the first page tells us count and page size, the other pages are got at the same time (see _getPageUrls),
+        and put together in order. If the next url isn't one we know how to page through, follows next one at a time
         This method can get paginated lists or none paginated. Checks if 'results' is present to determine this
         :param url: url to get
         :param allpages: bool to specify whether to get all pages.
@@ -128,17 +398,25 @@ class Server:
         """
         #
 
-        # TODO test this
-        if not update and url in self._cache_dictby_url:
-            return self._cache_dictby_url[url]
+        value, entry = self._resource_cache.lookup(url, allow_stale=not update or self._prefer_cache)
+        if value is not None:
+            return value
 
-        data = self._getJsonWithRetry(url)
+        headers = entry.getConditionalHeaders() if entry is not None else None
+        req = self._getWithRetry(url, headers)
+        if headers:
+            value = self._resource_cache.revalidated(entry, req.status_code == requests.codes.not_modified)
+            if value is not None:
+                return value
+
+        data = req.json()
+        etag, last_modified = req.headers.get('ETag'), req.headers.get('Last-Modified')
         if 'results' not in data:                # If this is not paginated, it is a single result, return now
-            self._cache(url, data)
+            self._cache(url, data, len(req.content), etag, last_modified)
             return data
 
         if not allpages or not data['next']:     # if we want just the first page or there is only one page, return now!
-            self._cache(url, data['results'])
+            self._cache(url, data['results'], len(req.content), etag, last_modified)
             return data['results']
 
         if data['count'] > self._warn_results_count:
@@ -146,55 +424,172 @@ class Server:
 
         results_list = []
         results_list += data['results']
-        while data['next']:
-            data = self._getJsonWithRetry(url)
-            results_list += data['results']
-            if len(results_list) >= self._max_results_count:
-                logging.error('Got %d results for %s. Increase _max_results_count for more', len(results_list), url)
-                break
+        page_url_list = self._getPageUrls(data['next'], data['count'], len(data['results']))
+        if page_url_list is not None:   # we know all the pages, get them at the same time. map keeps them in order
+            for page_data in self._page_executor.map(self._getPage, page_url_list):
+                results_list += page_data['results']
+        else:                           # don't know how to make page urls, just follow next
+            while data['next'] and len(results_list) < self._max_results_count:
+                data = self._getPage(data['next'])
+                results_list += data['results']
+
+        if len(results_list) >= self._max_results_count and data['count'] > self._max_results_count:
+            logging.error('Got %d results for %s. Increase _max_results_count for more', len(results_list), url)
+            results_list = results_list[:self._max_results_count]
 
         self._cache(url, results_list)
         return results_list
 
+    def _getPage(self, url):
+        """_getJsonWithRetry, keeping track of the latency for stats"""
+        start_time = time.time()
+        data = self._getJsonWithRetry(url)
+        latency = time.time() - start_time
+        self._page_latency_list.append(latency)
+        logging.debug('Got page %s in %f', url, latency)
+        return data
+
+    def _getPageUrls(self, next_url, count, page_size):
+        """Work out the urls of all the pages after the first, from the first page's next url
+        Works with page=x (page number pagination) and offset=x (limit offset pagination)
+        :param next_url: 'next' of the first page, ex 'http://.../actuator/?page=2'
+        :param count: total number of results
+        :param page_size: number of results on the first page
+        :return: list of urls, in order. None if we can't tell what they are
+        """
+        if page_size <= 0:
+            return None
+        split_url = urlsplit(next_url)
+        query_dict = parse_qs(split_url.query, keep_blank_values=True)
+        total = min(count, self._max_results_count)
+        try:
+            if 'page' in query_dict:
+                first_page = int(query_dict['page'][0])
+                values_list = list(range(first_page, (total + page_size - 1) // page_size + 1))
+                key = 'page'
+            elif 'offset' in query_dict:
+                values_list = list(range(int(query_dict['offset'][0]), total, page_size))
+                key = 'offset'
+            else:
+                return None
+        except ValueError:
+            return None
+
+        url_list = []
+        for value in values_list:
+            query_dict[key] = [str(value)]
+            url_list.append(urlunsplit(split_url._replace(query=urlencode(query_dict, doseq=True))))
+        return url_list
+
+    def getConnectionStats(self):
+        """Get connection counters from the session's pools, to check that keep-alive works
+        :return: dict with 'requests', 'connections' (new connections opened) and 'reused' (requests - connections)
+        """
+        request_count = 0
+        connection_count = 0
+        pools = self._adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            try:
+                pool = pools[key]
+            except KeyError:        # pool got evicted while we were looking
+                continue
+            request_count += pool.num_requests
+            connection_count += pool.num_connections
+        return {'requests': request_count,
+                'connections': connection_count,
+                'reused': max(0, request_count - connection_count)}
+
+    def getCacheStats(self):
+        """Hit/miss counts of the response cache, see ResourceCache"""
+        cache = self._resource_cache
+        return {'hits': cache.hit_count, 'misses': cache.miss_count, 'expired': cache.expired_count,
+                'revalidated': cache.revalidated_count, 'evicted': cache.eviction_count}
+
+    def getStatusList(self):
+        stats = self.getConnectionStats()
+        latency_list = list(self._page_latency_list)
+        if latency_list:
+            page_latency_str = 'page latency avg %.3f max %.3f' % (sum(latency_list) / len(latency_list),
+                                                                   max(latency_list))
+        else:
+            page_latency_str = 'no pages yet'
+
+        return ['Server: %d requests, %d connections opened, %d reused, %s' %
+                (stats['requests'], stats['connections'], stats['reused'], page_latency_str),
+                'Uploaded %d KB (%d KB before %s compression)' %
+                (self._upload_sent_byte_count // 1024, self._upload_raw_byte_count // 1024,
+                 self._compress_encoding or 'no')] + \
+            self._resource_cache.getStatusList() + self._batcher.getStatusList() + self._uploader.getStatusList()
+
+    def close(self):
+        """Stop the upload threads and commit anything waiting in the outbox"""
+        self._batcher.flush()
+        self._uploader.stop(self._connect_timeout + self._post_timeout)     # let a post in progress finish
+        if self._outbox is not None:
+            self._outbox.close()
+        self._fetch_executor.shutdown(wait=False)
+        self._page_executor.shutdown(wait=False)
+        self._session.close()
+
     def postDataPoints(self, values_list):
         """ Post data points to the server. Expects a list with timestamp, value, origin
+        Doesn't block. The points are batched (see DataPointBatcher), and full batches go to the outbox
+        (or upload queue) for the upload threads (see DataPointUploader). Call flushDataPoints regularly
         :param values_list: List of data points dicts, each should have timestamp, value, origin
         """
-        # Check if any of the threads in the list are done and delete them
-        self._thread_list = [th for th in self._thread_list if th.is_alive()]
-
-        # Check if there are too many threads. If there are, sleep. Each time, increase the sleep time.
-        # This way, we will slow down the main loop. NOTE: we decrease the time when len(threads) is ok
-        # (so that we get more messages in between posting and don't post every new message)
-        # In the main loop, if the sleep slows things down too much, we will see buffer overflow warnings there
-        if len(self._thread_list) > self._max_threads:
-            logging.warning('Too many post threads still alive! Sleeping for %d', self._time_to_wait_for_threads)
-            if self._time_to_wait_for_threads < self._max_time_to_wait_for_threads:
-                self._time_to_wait_for_threads += 0.05
-            else:       # If we are already at the max sleep time, log warning
-                logging.warning('Reached max sleep time for threads! Posting is too slow!')
-            time.sleep(self._time_to_wait_for_threads)      # This should also give the threads some extra power
-            self.postDataPoints(values_list)                # Call this fn again to check len, etc
-            return
-        else:   # If num threads is ok, decrease wait time. This prevents it from getting to max from occasional lag
-            if self._time_to_wait_for_threads > self._min_time_to_wait_for_threads:
-                self._time_to_wait_for_threads -= 0.01
-
-        # we add the thread to the list
-        t = threading.Thread(target=self._postDataPoints, args=(values_list,), name='post thread')
-        t.start()
-        self._thread_list.append(t)
+        self._batcher.add(values_list)
+
+    def flushDataPoints(self, force=False):
+        """Post the current batch of data points if it is old enough (or now, if force)
+        :param force: post it no matter how old or small it is
+        """
+        if force:
+            self._batcher.flush()
+        else:
+            self._batcher.flushIfDue()
+
+    def getDataPointFlushTime(self):
+        """When the current batch of data points is due, so callers can wake up for it
+        :return: unix time, or None if there is nothing waiting
+        """
+        return self._batcher.getDueTime()
 
     def _postDataPoints(self, values_list):
+        """Actually post a batch of data points. Called from the upload threads
+        If self._compress_encoding is set, bodies of at least _compress_min_bytes are compressed with it
+        :return: True on success, DataPointUploader.REJECTED if the server won't ever take it, False to retry
+        """
         if len(values_list) == 0:
             logging.debug('No new datapoints!')
-        else:	
-            headers = {'Authorization': 'Token ' + self._token}
-            req = requests.post(self._post_datapoint_url, params={"many": True}, json=values_list, headers=headers)
-            if req.status_code != 201:
-                logging.error('Failed to post %s: Code %d', values_list, req.status_code)
-            else:
-                logging.debug('Posted %d datapoints, took %f secs. Datapoints: %s', len(values_list), req.elapsed.total_seconds(), values_list)
+            return True
+
+        body = json.dumps(values_list).encode('UTF-8')
+        headers = {'Content-Type': 'application/json'}
+        raw_byte_count = len(body)
+        if self._compress_encoding is not None and raw_byte_count >= self._compress_min_bytes:
+            if self._compress_encoding == 'gzip':
+                body = gzip.compress(body, self._compress_level)
+            else:       # deflate in http means the zlib format
+                body = zlib.compress(body, self._compress_level)
+            headers['Content-Encoding'] = self._compress_encoding
+        self._upload_raw_byte_count += raw_byte_count       # only for stats, don't care about races
+        self._upload_sent_byte_count += len(body)
+
+        try:
+            self._login()
+            req = self._session.post(self._post_datapoint_url, params={"many": True}, data=body, headers=headers,
+                                     timeout=(self._connect_timeout, self._post_timeout))
+        except (ConnectionError, requests.exceptions.RequestException) as e:
+            logging.error('Failed to post %d datapoints, RequestException: %s', len(values_list), e)
+            return False
+        if req.status_code != 201:
+            logging.error('Failed to post %d datapoints: Code %d %s', len(values_list), req.status_code,
+                          req.text[:200])
+            if 400 <= req.status_code < 500 and req.status_code not in self._retry_post_codes:
+                return DataPointUploader.REJECTED
+            return False
+        logging.debug('Posted %d datapoints, took %f secs. Datapoints: %s', len(values_list), req.elapsed.total_seconds(), values_list)
+        return True
 
 
 # TODO this implements caching, but we probably want it in the server... having it in both seems wasteful
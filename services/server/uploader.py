@@ -0,0 +1,295 @@
+import collections
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+
+class DataPointUploader:
+    """Fixed pool of upload threads fed by a bounded queue of data point batches
+
+    submit never blocks or sleeps, so a slow server can't stall the caller (the control loop). If the queue is full,
+    the overflow policy decides what happens to the new batch:
+        coalesce:     merge it into the newest queued batch (fewer, bigger posts). If that batch would get bigger than
+                      max_coalesced_points, drop the oldest batch instead
+        drop_oldest:  drop the oldest queued batch to make room
+        spill:        append it to spill_file_name. Spilled batches are put back in the queue once it is empty again.
+                      The file is written and read outside the queue's lock, so only the thread spilling waits on it
+    Queued points, in flight count and per batch latency are in getStatusList (and the attributes below).
+
+    If an outbox (DataPointOutbox) is given, the queue isn't used at all: submit appends to the outbox, and the workers
+    claim batches from it and only ack them once they are posted. Failed batches stay in the outbox and are retried
+    after retry_delay (doubling up to max_retry_delay while the server stays down).
+    If post_fn returns REJECTED the server refused the batch for good (ex a 400 for a deleted sensing point). Retrying
+    it would block everything behind it, so it is dropped. If it was merged from several outbox batches, they are
+    posted one at a time first, to only drop the bad one.
+    """
+    REJECTED = 'rejected'           # post_fn result: the server won't ever take this batch, don't retry it
+
+    POLICY_COALESCE = 'coalesce'
+    POLICY_DROP_OLDEST = 'drop_oldest'
+    POLICY_SPILL = 'spill'
+    policies = (POLICY_COALESCE, POLICY_DROP_OLDEST, POLICY_SPILL)
+
+    max_coalesced_points = 2000     # coalesce won't make a batch bigger than this
+    spill_file_name = 'datapoint_spill.log'
+    retry_delay = 2                 # outbox only. after a failed post, wait this long before trying again
+    max_retry_delay = 60            # outbox only. retry_delay doubles on each failure up to this
+    _latency_sample_count = 100     # keep latency of the last x batches for stats
+
+    def __init__(self, post_fn, worker_count=2, max_queue_size=20, policy=POLICY_COALESCE, outbox=None):
+        """
+        :param post_fn: fn(values_list) that posts a batch, returns True on success, False to retry, or REJECTED.
+            Called from the worker threads
+        :param worker_count: number of upload threads
+        :param max_queue_size: max batches waiting to be posted before the policy kicks in
+        :param policy: one of DataPointUploader.policies
+        :param outbox: DataPointOutbox to use instead of the queue, or None
+        """
+        if policy not in self.policies:
+            raise ValueError('Unknown upload policy %s, should be one of %s' % (policy, self.policies))
+        self.post_fn = post_fn
+        self.worker_count = worker_count
+        self.max_queue_size = max_queue_size
+        self.policy = policy
+        self.outbox = outbox
+
+        # stats
+        self.in_flight_count = 0
+        self.posted_batch_count = 0
+        self.posted_point_count = 0
+        self.failed_batch_count = 0
+        self.rejected_point_count = 0
+        self.dropped_point_count = 0
+        self.coalesced_batch_count = 0
+        self.spilled_batch_count = 0
+        self._latency_list = collections.deque(maxlen=self._latency_sample_count)
+
+        self._queue = collections.deque()
+        self._condition = threading.Condition()
+        self._spill_lock = threading.Lock()     # for the spill file only
+        self._has_spilled = os.path.exists(self.spill_file_name)   # leftovers from last run get replayed too
+        self._stop = False
+        self._stop_event = threading.Event()    # only set on stop, for backing off without submit waking us up
+        self._thread_list = []
+
+    def start(self):
+        """Start the worker threads"""
+        self._stop = False
+        self._stop_event.clear()
+        while len(self._thread_list) < self.worker_count:
+            t = threading.Thread(target=self._work, name='upload worker %d' % len(self._thread_list), daemon=True)
+            t.start()
+            self._thread_list.append(t)
+
+    def stop(self, timeout=5):
+        """Stop the worker threads once they finish their current batch. Queued batches are left in the queue"""
+        with self._condition:
+            self._stop = True
+            self._condition.notify_all()
+        self._stop_event.set()
+        for t in self._thread_list:
+            t.join(timeout)
+        self._thread_list = []
+
+    @property
+    def queued_point_count(self):
+        """Points waiting to be posted, in the outbox or the queue (not counting spilled ones)"""
+        if self.outbox is not None:
+            return self.outbox.point_count
+        with self._condition:
+            return sum(len(values_list) for values_list in self._queue)
+
+    def submit(self, values_list):
+        """Queue a batch of data points to be posted. Never blocks, see the overflow policies in the class docs
+        :param values_list: list of data point dicts, see Server.postDataPoints
+        """
+        if len(values_list) == 0:
+            logging.debug('No new datapoints!')
+            return
+
+        if self.outbox is not None:
+            if self.outbox.append(values_list):         # a worker commits it, else it goes with the interval commit
+                with self._condition:
+                    self._condition.notify()
+            return
+
+        with self._condition:
+            if len(self._queue) < self.max_queue_size:
+                self._queue.append(values_list)
+                self._condition.notify()
+                return
+            if self.policy != self.POLICY_SPILL:
+                self._handleOverflow(values_list)
+                self._condition.notify()
+                return
+        self._spill([values_list])
+
+    def _handleOverflow(self, values_list):
+        """Apply the coalesce or drop_oldest policy to values_list. Call with _condition held"""
+        if self.policy == self.POLICY_COALESCE and \
+                len(self._queue[-1]) + len(values_list) <= self.max_coalesced_points:
+            self._queue[-1] = self._queue[-1] + values_list     # new list, a worker may have a ref to the old one
+            self.coalesced_batch_count += 1
+            return
+
+        dropped = self._queue.popleft()
+        self.dropped_point_count += len(dropped)
+        logging.warning('Upload queue full (%d), dropped oldest batch of %d points', self.max_queue_size, len(dropped))
+        self._queue.append(values_list)
+
+    def _spill(self, batch_list):
+        """Append batches to the spill file. Call without _condition held"""
+        with self._spill_lock:
+            with open(self.spill_file_name, 'a') as f:
+                for values_list in batch_list:
+                    f.write(json.dumps(values_list) + '\n')
+        with self._condition:
+            self._has_spilled = True
+            self.spilled_batch_count += len(batch_list)
+            self._condition.notify()        # the queue may have emptied while we were writing
+        logging.warning('Upload queue full (%d), spilled %d batches of %d points to %s', self.max_queue_size,
+                        len(batch_list), sum(len(values_list) for values_list in batch_list), self.spill_file_name)
+
+    def _unspill(self):
+        """Put spilled batches back in the queue, if it is empty. Call without _condition held"""
+        with self._condition:
+            if self._queue or not self._has_spilled:
+                return
+            self._has_spilled = False
+        try:
+            with self._spill_lock:
+                with open(self.spill_file_name, 'r') as f:
+                    batch_list = [json.loads(line) for line in f if line.strip()]
+                os.remove(self.spill_file_name)
+        except FileNotFoundError:       # another worker got them first
+            return
+        except (OSError, ValueError):
+            logging.exception('Failed to read spilled data points from %s', self.spill_file_name)
+            return
+        logging.info('Replaying %d spilled batches', len(batch_list))
+        spill_list = []
+        with self._condition:
+            for values_list in batch_list:
+                if len(self._queue) >= self.max_queue_size:
+                    spill_list.append(values_list)      # will come back next time the queue is empty
+                else:
+                    self._queue.append(values_list)
+            self._condition.notify_all()
+        if spill_list:
+            self._spill(spill_list)
+
+    def _post(self, values_list):
+        """Post with post_fn, keeping the stats
+        :return: True on success, False on failure, REJECTED if the server refused it for good
+        """
+        start_time = time.time()
+        try:
+            result = self.post_fn(values_list)
+        except Exception:
+            logging.exception('Upload of %d points failed', len(values_list))
+            result = False
+        latency = time.time() - start_time
+
+        with self._condition:
+            self.in_flight_count -= 1
+            self._latency_list.append(latency)
+            if result is True:
+                self.posted_batch_count += 1
+                self.posted_point_count += len(values_list)
+            else:
+                self.failed_batch_count += 1
+        return result
+
+    def _work(self):
+        if self.outbox is not None:
+            self._workOutbox()
+            return
+
+        while True:
+            self._unspill()
+            with self._condition:
+                while not self._queue and not self._has_spilled and not self._stop:
+                    self._condition.wait()
+                if self._stop:
+                    return
+                if not self._queue:         # only spilled ones left, replay them
+                    continue
+                values_list = self._queue.popleft()
+                self.in_flight_count += 1
+            self._post(values_list)
+
+    def _workOutbox(self):
+        retry_delay = self.retry_delay      # per worker, see _backOff
+        single_batch_count = 0              # claim one batch at a time for this many, to find a rejected one
+        while True:
+            try:
+                id_list, values_list = self.outbox.claim(1 if single_batch_count else self.max_coalesced_points)
+            except sqlite3.Error:
+                logging.exception('Failed to claim data points from the outbox, retrying in %.1f', retry_delay)
+                retry_delay = self._backOff(retry_delay)
+                continue
+            with self._condition:
+                if self._stop:
+                    self.outbox.release(id_list)
+                    return
+                if not id_list:         # nothing committed yet. wake up for the next group commit (or a submit)
+                    self._condition.wait(self.outbox.commit_interval)
+                    continue
+                self.in_flight_count += 1
+            single_batch_count = max(0, single_batch_count - 1)
+
+            result = self._post(values_list)
+            if result == self.REJECTED and len(id_list) > 1:     # which batch is it? try them one by one
+                self.outbox.release(id_list)
+                single_batch_count = len(id_list)
+                continue
+            if result == self.REJECTED:
+                logging.error('Server rejected a batch of %d points for good, dropping it. First point: %s',
+                              len(values_list), values_list[0])
+                with self._condition:
+                    self.rejected_point_count += len(values_list)
+
+            if result:
+                try:
+                    self.outbox.ack(id_list)
+                except sqlite3.Error:       # still stored, so they get posted again
+                    logging.exception('Failed to ack %d posted batches in the outbox', len(id_list))
+                    self.outbox.release(id_list)
+                    retry_delay = self._backOff(retry_delay)
+                    continue
+                retry_delay = self.retry_delay
+                continue
+
+            self.outbox.release(id_list)
+            logging.warning('Failed to post %d points from the outbox, retrying in %.1f', len(values_list), retry_delay)
+            retry_delay = self._backOff(retry_delay)
+
+    def _backOff(self, retry_delay):
+        """Wait retry_delay, or until stop. A submit doesn't cut it short
+        :return: the next retry delay (doubled, up to max_retry_delay)
+        """
+        self._stop_event.wait(retry_delay)
+        return min(retry_delay * 2, self.max_retry_delay)
+
+    def getStatusList(self):
+        status_list = self.outbox.getStatusList() if self.outbox is not None else []
+        latency_list = list(self._latency_list)
+        if latency_list:
+            latency_str = 'latency avg %.3f max %.3f' % (sum(latency_list) / len(latency_list), max(latency_list))
+        else:
+            latency_str = 'no latency yet'
+        if self.outbox is not None:
+            policy = 'outbox'
+            queued_str = '%d points queued' % self.queued_point_count
+        else:
+            policy = self.policy
+            queued_str = '%d points queued in %d batches' % (self.queued_point_count, len(self._queue))
+        return status_list + ['Uploader (%s): %s, %d batches in flight, %d posted (%d points), %d failed, '
+                              '%d coalesced, %d points dropped, %d points rejected, %d spilled, %s' %
+                              (policy, queued_str, self.in_flight_count, self.posted_batch_count,
+                               self.posted_point_count, self.failed_batch_count, self.coalesced_batch_count,
+                               self.dropped_point_count, self.rejected_point_count, self.spilled_batch_count,
+                               latency_str)]
@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""Local stand-in for the plantOS REST API, for running Server/Bot without the real server.
+
+Only implements what the controller uses. Runs in a thread (see PlantosStub) or standalone:
+    python3 -m simulation.plantosStub --port 8000
+Then point grodaemon.py at it with --server http://127.0.0.1:8000/, and at a simulation.virtualGroduino with the same
+--sensing-points and --actuators for -p
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import sys
+import threading
+import time
+import zlib
+from collections import deque
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlsplit
+
+
+class PlantosStub:
+    """plantOS stand-in running on a local HTTP server thread
+
+    Endpoints:
+        GET  /                  api root, dict of endpoint urls by name
+        POST /auth/login/       returns the token. Everything else needs the 'Authorization: Token ...' header
+        POST /dataPoint/        takes a json list of data points. Decodes gzip/deflate bodies (Content-Encoding) and
+                                checks every point has timestamp, value and sensing_point. 201 if ok, 400 if not
+        GET  /<endpoint>/       paginated list (?page=x, page_size per page) of the resources added with addResources
+        GET  /<endpoint>/<id>/  one of those resources
+        GET  /tray/1/set_points/    set points by code, see setSetPoints
+        GET  /changes/          change feed, long-polled: ?since=seq&wait=secs. Answers as soon as there are changes
+                                after since (or after wait secs with none): {seq, changes: [{seq, url, data}], resync}.
+                                Changes are made with setOverride/setSetPoints. 404 if not use_change_feed
+    GET responses have an ETag (if use_etags), and a matching If-None-Match gets 304 Not Modified, like Django's
+    ConditionalGetMiddleware.
+    Received data points are in datapoint_list, when each arrived in datapoint_arrival_time_list. latency is added to every response, to simulate a slow link.
+    """
+    token = 'stubtoken'
+    datapoint_keys = ('timestamp', 'value', 'sensing_point')
+    page_size = 10      # results per page of the lists, like the real server's PAGE_SIZE
+
+    # made up topology for addTopology. codes like the groduino's, ex SATM is sensing point, air, temperature
+    topology_resource_types = (('A', 'Air'), ('W', 'Water'), ('L', 'Light'))
+    topology_properties = (('A', 'TM', 'Temperature'), ('A', 'HU', 'Humidity'), ('A', 'CO', 'CO2'),
+                           ('W', 'TM', 'Temperature'), ('W', 'PH', 'pH'), ('W', 'EC', 'Electrical conductivity'),
+                           ('L', 'IN', 'Intensity'))
+    topology_actuator_types = (('A', 'HE', 'TM', 1, True),      # resource type, effect, property, effect on active,
+                               ('A', 'CR', 'TM', -1, True),     # is binary
+                               ('A', 'HU', 'HU', 1, True),
+                               ('W', 'HE', 'TM', 1, True),
+                               ('L', 'PN', 'IN', 1, False))
+    use_etags = True
+    use_change_feed = True
+    max_wait = 60           # longest a change feed request is held
+    change_history_size = 1000      # changes kept for the feed. Older since gets resync
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0):
+        """
+        :param host: interface to listen on
+        :param port: port to listen on, 0 to pick a free one (see base_url)
+        :param latency: seconds to wait before every response
+        """
+        self.latency = latency
+        self.datapoint_list = []
+        self.datapoint_arrival_time_list = []   # time.time() each of datapoint_list was received, to time uploads
+        self.request_count = 0
+        self.not_modified_count = 0
+        self.datapoint_post_count = 0
+        self.rejected_post_count = 0
+        self.received_byte_count = 0        # data point bodies as sent (maybe compressed)
+        self.decoded_byte_count = 0         # data point bodies after decoding
+        self.encoding_count_dictby_name = {}
+        self.resources_dictby_endpoint = {}     # endpoint name -> list of resource dicts, see addResources
+        self.request_count_dictby_endpoint = {}     # first part of the path -> requests. ex 'changes'
+        self.set_point_dictby_code = {}
+        self.change_seq = 0
+        self._change_list = deque(maxlen=self.change_history_size)
+        self._change_condition = threading.Condition()
+
+        self._lock = threading.Lock()
+        self._httpd = _StubHTTPServer((host, port), _StubRequestHandler)
+        self._httpd.stub = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return 'http://%s:%d/' % (host, port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='plantos stub', daemon=True)
+        self._thread.start()
+        logging.info('plantOS stub running at %s', self.base_url)
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def getRoot(self):
+        root_dict = {'dataPoint': self.base_url + 'dataPoint/'}
+        for endpoint in self.resources_dictby_endpoint:
+            root_dict[endpoint] = self.base_url + endpoint + '/'
+        return root_dict
+
+    def addResources(self, endpoint, resource_list):
+        """Add resources to serve at /<endpoint>/. Each gets a 'url' (/<endpoint>/<index>/) unless it has one
+        :param endpoint: endpoint name, ex 'sensingPoint'
+        :param resource_list: list of dicts
+        :return: the resources, with urls
+        """
+        existing_list = self.resources_dictby_endpoint.setdefault(endpoint, [])
+        for resource in resource_list:
+            resource.setdefault('url', '%s%s/%d/' % (self.base_url, endpoint, len(existing_list) + 1))
+            existing_list.append(resource)
+        return resource_list
+
+    def addTopology(self, sensing_point_count=6, actuator_count=3):
+        """Add a made up bot: resource types, properties, sensing points, actuators and everything they reference
+        (api endpoints like the real server, so Bot can be set up from it)
+        :param sensing_point_count: sensing points, spread over the properties in topology_properties
+        :param actuator_count: actuators, spread over the types in topology_actuator_types
+        """
+        type_url_dictby_code = {}
+        for code, name in self.topology_resource_types:
+            type_url_dictby_code[code] = self.addResources('resourceType', [{'code': code, 'name': name}])[0]['url']
+
+        property_list = self.addResources('resourceProperty', [
+            {'code': code, 'name': name, 'resource_type': type_url_dictby_code[type_code], 'sensing_points': []}
+            for type_code, code, name in self.topology_properties])
+        sensing_point_list = []
+        for i in range(sensing_point_count):
+            property_dict = property_list[i % len(property_list)]
+            sensing_point_dict = self.addResources('sensingPoint', [
+                {'property': property_dict['url'], 'index': i // len(property_list) + 1, 'is_active': True}])[0]
+            property_dict['sensing_points'].append(sensing_point_dict['url'])
+            sensing_point_list.append(sensing_point_dict)
+
+        property_url_dictby_code = {type_code + p['code']: p['url']
+                                    for (type_code, _, _), p in zip(self.topology_properties, property_list)}
+        actuator_type_list = []
+        for type_code, effect_code, property_code, effect_on_active, is_binary in self.topology_actuator_types:
+            resource_effect_dict = self.addResources('resourceEffect', [{'code': effect_code}])[0]
+            resource_dict = self.addResources('resource', [{'resource_type': type_url_dictby_code[type_code]}])[0]
+            actuator_type_dict = self.addResources('actuatorType', [
+                {'resource_effect': resource_effect_dict['url'], 'is_binary': is_binary,
+                 'properties': [property_url_dictby_code[type_code + property_code]]}])[0]
+            control_profile_dict = self.addResources('controlProfile', [
+                {'effects': [{'property': property_url_dictby_code[type_code + property_code],
+                              'effect_on_active': effect_on_active,
+                              'threshold': 1, 'operating_range_min': 0, 'operating_range_max': 100}]}])[0]
+            actuator_type_list.append((actuator_type_dict, resource_dict, control_profile_dict))
+        for i in range(actuator_count):
+            actuator_type_dict, resource_dict, control_profile_dict = actuator_type_list[i % len(actuator_type_list)]
+            self.addResources('actuator', [
+                {'actuator_type': actuator_type_dict['url'], 'resource': resource_dict['url'],
+                 'control_profile': control_profile_dict['url'], 'index': i // len(actuator_type_list) + 1,
+                 'override_value': None}])
+        return sensing_point_list
+
+    def getResources(self, path, query):
+        """GET for the resource endpoints
+        :return: (status code, json-able response)
+        """
+        parts_list = [part for part in path.split('/') if part]
+        if not parts_list or parts_list[0] not in self.resources_dictby_endpoint or len(parts_list) > 2:
+            return 404, {'detail': 'Not found.'}
+        endpoint = parts_list[0]
+        resource_list = self.resources_dictby_endpoint[endpoint]
+
+        if len(parts_list) == 2:
+            for resource in resource_list:
+                if resource['url'].endswith(path):
+                    return 200, resource
+            return 404, {'detail': 'Not found.'}
+
+        try:
+            page = int(parse_qs(query).get('page', ['1'])[0])
+        except ValueError:
+            page = 0
+        page_count = max(1, (len(resource_list) + self.page_size - 1) // self.page_size)
+        if not 1 <= page <= page_count:
+            return 404, {'detail': 'Invalid page.'}
+        list_url = self.base_url + endpoint + '/'
+        return 200, {'count': len(resource_list),
+                     'next': '%s?page=%d' % (list_url, page + 1) if page < page_count else None,
+                     'previous': '%s?page=%d' % (list_url, page - 1) if page > 1 else None,
+                     'results': resource_list[(page - 1) * self.page_size:page * self.page_size]}
+
+    # ----- Request handling, called from the handler threads -----
+
+    def handle(self, method, path, headers, body, query=''):
+        """Handle one request
+        :return: (status code, json-able response or None)
+        """
+        endpoint = path.strip('/').split('/', 1)[0]
+        with self._lock:
+            self.request_count += 1
+            self.request_count_dictby_endpoint[endpoint] = self.request_count_dictby_endpoint.get(endpoint, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        if method == 'POST' and path == '/auth/login/':
+            return 200, {'key': self.token}
+        if headers.get('Authorization') != 'Token ' + self.token:
+            return 401, {'detail': 'Authentication credentials were not provided.'}
+
+        if method == 'GET' and path == '/':
+            return 200, self.getRoot()
+        if method == 'POST' and path == '/dataPoint/':
+            return self.postDataPoints(headers, body)
+        if method == 'GET' and path == '/tray/1/set_points/':
+            return 200, self.set_point_dictby_code
+        if method == 'GET' and path == '/changes/' and self.use_change_feed:
+            return self.getChanges(query)
+        if method == 'GET':
+            return self.getResources(path, query)
+        return 404, {'detail': 'Not found.'}
+
+    # ----- Changes (overrides, set points) and the change feed -----
+
+    def setOverride(self, actuator_url, value):
+        """Override an actuator, like from the UI
+        :param actuator_url: url of the actuator
+        :param value: state to override to, None to stop overriding
+        """
+        for actuator_dict in self.resources_dictby_endpoint.get('actuator', []):
+            if actuator_dict['url'] == actuator_url:
+                actuator_dict['override_value'] = value
+                self._addChange(actuator_url, actuator_dict)
+                return
+        raise KeyError(actuator_url)
+
+    def setSetPoints(self, set_point_dictby_code):
+        """Set (some of) the set points, ex {'ATM': 22.0}"""
+        self.set_point_dictby_code.update(set_point_dictby_code)
+        self._addChange(self.base_url + 'tray/1/set_points/', dict(self.set_point_dictby_code))
+
+    def _addChange(self, url, data):
+        with self._change_condition:
+            self.change_seq += 1
+            self._change_list.append({'seq': self.change_seq, 'url': url, 'data': json.loads(json.dumps(data))})
+            self._change_condition.notify_all()
+
+    def getChanges(self, query):
+        """GET for the change feed. Blocks the handler thread until there are changes or wait runs out"""
+        query_dict = parse_qs(query)
+        try:
+            wait = min(float(query_dict.get('wait', ['0'])[0]), self.max_wait)
+            since = int(query_dict['since'][0]) if 'since' in query_dict else None
+        except ValueError:
+            return 400, {'detail': 'since and wait should be numbers'}
+
+        with self._change_condition:
+            if since is None:       # just the current seq, to start from
+                return 200, {'seq': self.change_seq, 'changes': [], 'resync': False}
+            if since > self.change_seq:     # from before we restarted
+                return 200, {'seq': self.change_seq, 'changes': [], 'resync': True}
+            self._change_condition.wait_for(lambda: self.change_seq > since, wait)
+            oldest_seq = self._change_list[0]['seq'] if self._change_list else self.change_seq + 1
+            if since < oldest_seq - 1:      # some of what they are missing is gone
+                return 200, {'seq': self.change_seq, 'changes': [], 'resync': True}
+            return 200, {'seq': self.change_seq, 'changes': [c for c in self._change_list if c['seq'] > since],
+                         'resync': False}
+
+    def postDataPoints(self, headers, body):
+        encoding = headers.get('Content-Encoding', 'identity')
+        try:
+            if encoding == 'gzip':
+                decoded = gzip.decompress(body)
+            elif encoding == 'deflate':
+                decoded = zlib.decompress(body)
+            elif encoding == 'identity':
+                decoded = body
+            else:
+                return 415, {'detail': 'Unsupported Content-Encoding %s' % encoding}
+            values_list = json.loads(decoded.decode('UTF-8'))
+            if not isinstance(values_list, list) or \
+                    not all(isinstance(v, dict) and all(k in v for k in self.datapoint_keys) for v in values_list):
+                raise ValueError('expected a list of data points with %s' % (self.datapoint_keys,))
+        except (OSError, zlib.error, ValueError) as e:      # gzip raises OSError (BadGzipFile) on bad data
+            with self._lock:
+                self.rejected_post_count += 1
+            logging.error('plantOS stub rejected data points (%s): %s', encoding, e)
+            return 400, {'detail': str(e)}
+
+        with self._lock:
+            self.datapoint_post_count += 1
+            self.received_byte_count += len(body)
+            self.decoded_byte_count += len(decoded)
+            self.encoding_count_dictby_name[encoding] = self.encoding_count_dictby_name.get(encoding, 0) + 1
+            self.datapoint_list += values_list
+            self.datapoint_arrival_time_list += [time.time()] * len(values_list)
+        return 201, values_list
+
+
+class _StubHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    stub = None     # set by PlantosStub
+
+    def handle_error(self, request, client_address):
+        if isinstance(sys.exc_info()[1], ConnectionError):      # client went away, ex a bot stopped mid long poll
+            return
+        super().handle_error(request, client_address)
+
+
+class _StubRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'       # so that keep-alive works
+    disable_nagle_algorithm = True      # otherwise every keep-alive response waits on a delayed ack (~40ms)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def _handle(self, method):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length) if length else b''
+        split_path = urlsplit(self.path)
+        status, response = self.server.stub.handle(method, split_path.path, self.headers, body, split_path.query)
+        self._sendJson(status, response, method == 'GET' and status == 200 and self.server.stub.use_etags)
+
+    def _sendJson(self, status, response, use_etag=False):
+        data = b'' if response is None else json.dumps(response).encode('UTF-8')
+        etag = None
+        if use_etag:
+            etag = '"%s"' % hashlib.md5(data).hexdigest()
+            if self.headers.get('If-None-Match') == etag:
+                with self.server.stub._lock:
+                    self.server.stub.not_modified_count += 1
+                status, data = 304, b''
+        self.send_response(status)
+        if etag is not None:
+            self.send_header('ETag', etag)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logging.debug('plantOS stub: ' + format, *args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the plantOS REST API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('-p', '--port', type=int, default=8000)
+    parser.add_argument('-l', '--latency', type=float, default=0, help='seconds added to every response')
+    parser.add_argument('-s', '--sensing-points', type=int, default=6,
+                        help='sensing points of the made up topology, see addTopology')
+    parser.add_argument('-a', '--actuators', type=int, default=3, help='actuators of the made up topology')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    stub = PlantosStub(args.host, args.port, args.latency)
+    stub.start()
+    stub.addTopology(args.sensing_points, args.actuators)
+    try:
+        while True:
+            time.sleep(10)
+            logging.info('%d requests, %d data points', stub.request_count, len(stub.datapoint_list))
+    except KeyboardInterrupt:
+        stub.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,448 @@
+#!/usr/bin/env python3
+"""Simulated groduino on a pseudo-terminal, for running Groduino/Bot without the hardware.
+
+Does what the firmware does on the serial side: the ENQ/ACK handshake, baud rate changes (GBAU/GPRB/GBOK, see
+Groduino._negotiateBaudRate), binary frames if asked (GBIN, see Groduino._negotiateProtocol), streaming frames of
+every key, and taking actuator commands. Bytes are paced to baud_rate, so throughput is what a real link of that
+speed would give. Sensing point values follow the actuators that affect them, so control has something to act on.
+Closing the port and opening it again is like resetting the board: the device goes back to its handshake.
+Faults can be injected to reproduce what goes wrong on real links: corrupted frames, bursts of frames sent all at once
+(what overflows Groduino's buffers), and stalls where the device goes quiet.
+Runs in a thread (see VirtualGroduino) or standalone:
+    python3 -m simulation.virtualGroduino --sensing-points 20 --actuators 5 --rate 2
+Then point grodaemon.py at the port it prints with -p
+"""
+
+import argparse
+import logging
+import os
+import random
+import select
+import termios
+import threading
+import time
+import tty
+
+from services.arduino.communication.communication import BinaryFrameDecoder, Crc8, FrameDecoder
+
+from .plantosStub import PlantosStub
+
+# termios speed constant -> baud rate, to see what the other side set the port to
+_BAUD_RATE_DICTBY_SPEED = {getattr(termios, 'B%d' % baud_rate): baud_rate
+                           for baud_rate in (1200, 2400, 4800, 9600, 19200, 38400, 57600, 115200, 230400, 460800,
+                                             921600) if hasattr(termios, 'B%d' % baud_rate)}
+
+
+def makeKeyList(sensing_point_count, actuator_count):
+    """Message keys for the made up bot of PlantosStub.addTopology with the same counts, ex ['SATM 1', 'AAHE 1']"""
+    key_list = []
+    property_list = PlantosStub.topology_properties
+    for i in range(sensing_point_count):
+        type_code, property_code, _ = property_list[i % len(property_list)]
+        key_list.append('S%s%s %d' % (type_code, property_code, i // len(property_list) + 1))
+    actuator_type_list = PlantosStub.topology_actuator_types
+    for i in range(actuator_count):
+        type_code, effect_code = actuator_type_list[i % len(actuator_type_list)][:2]
+        key_list.append('A%s%s %d' % (type_code, effect_code, i // len(actuator_type_list) + 1))
+    return key_list
+
+
+class VirtualGroduino:
+    """Groduino stand-in on the master side of a pty. Open port_name with Groduino like a real port
+
+    Sensing point keys (S...) report a value that wanders a little every frame, drifts back to where it started, and
+    moves with the state of the actuators of the same resource type and property (see
+    PlantosStub.topology_actuator_types), ex 'AAHE 1' on warms every 'SATM'. Actuator keys (A...) report the state last
+    sent to them with Groduino.send. Frames have every key, then GEND.
+    Bytes are written at most baud_rate / 10 per second, like 8N1 on a real port. If the other side doesn't read and
+    its buffer fills up, what doesn't fit is dropped (counted in dropped_byte_count), like a real port overrunning.
+    If the other side set the port to another baud rate than ours, everything both ways is garbage, and above
+    reliable_baud_rate each byte is corrupted with probability byte_error_rate (like a long cable).
+    """
+    enquire_period = 0.1        # send ENQ this often until the other side answers
+    bits_per_byte = 10          # 8N1: start bit, 8 data bits, stop bit
+    write_chunk_size = 256      # bytes written to the pty at once. Frames bigger than its buffer would be cut off
+    baud_confirm_timeout = 1    # after switching baud rate, go back if GBOK doesn't come in this long
+    value_noise = 0.05          # sensing point values move up to this much each frame at random
+    actuator_effect_rate = 0.5  # change per second of the sensing points an actuator affects, at state 1
+    ambient_pull = 0.02         # fraction per second of the way back to the starting value
+
+    def __init__(self, key_list=None, baud_rate=9600, frame_rate=1.0, supports_binary=True, seed=None,
+                 supports_baud_change=True, reliable_baud_rate=115200, byte_error_rate=0.01, corrupt_frame_rate=0):
+        """
+        :param key_list: message keys to report, ex ['SATM 1', 'AAHE 1']. Default is makeKeyList(6, 3)
+        :param baud_rate: link speed to start at, like the firmware's Serial.begin
+        :param frame_rate: frames per second. 0 sends them as fast as the link allows
+        :param supports_binary: answer GBIN and switch to binary frames. False is like old firmware. Only if there
+            are at most BinaryFrameDecoder.max_key_count keys, like the firmware
+        :param seed: for the random values
+        :param supports_baud_change: answer GBAU and switch baud rate. False is like old firmware
+        :param reliable_baud_rate: above this, bytes get corrupted
+        :param byte_error_rate: chance of corrupting each byte above reliable_baud_rate
+        :param corrupt_frame_rate: chance of flipping a bit in each frame, at any baud rate
+        """
+        self.key_list = list(key_list) if key_list is not None else makeKeyList(6, 3)
+        self.baud_rate = baud_rate
+        self.initial_baud_rate = baud_rate      # what a reset goes back to
+        self.frame_rate = frame_rate
+        self.supports_binary = supports_binary
+        self.supports_baud_change = supports_baud_change
+        self.reliable_baud_rate = reliable_baud_rate
+        self.byte_error_rate = byte_error_rate
+        self.corrupt_frame_rate = corrupt_frame_rate
+        self.corrupted_byte_count = 0
+        self.corrupted_frame_count = 0
+        self.protocol = 'ascii'
+        self.port_name = None           # set by start
+        self.is_connected = False       # handshake done
+        self.frame_count = 0
+        self.sent_byte_count = 0
+        self.dropped_byte_count = 0
+        self.command_count = 0
+        self.connect_count = 0
+        self.burst_count = 0
+        self.stall_count = 0
+
+        self._random = random.Random(seed)
+        self.value_dictby_key = {key: (round(self._random.uniform(15, 30), 2) if key.startswith('S') else 0.0)
+                                 for key in self.key_list}
+        self._ambient_value_dictby_key = {key: value for key, value in self.value_dictby_key.items()
+                                          if key.startswith('S')}
+        self._effect_list = self._makeEffectList()      # [(actuator key, sensing point key, effect on active)]
+        self._value_time = None         # when the values were last moved
+        self._decoder = FrameDecoder()
+        self._master_fd = None
+        self._pending_burst_frame_count = 0
+        self._stall_end_time = 0
+        self._link_free_time = 0        # when the bytes written so far are done going out at baud_rate
+        self._previous_baud_rate = None     # to go back to if the new one isn't confirmed
+        self._baud_confirm_deadline = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _makeEffectList(self):
+        effect_dictby_code = {type_code + effect_code: (type_code + property_code, effect_on_active)
+                              for type_code, effect_code, property_code, effect_on_active, _
+                              in PlantosStub.topology_actuator_types}
+        effect_list = []
+        for actuator_key in self.key_list:
+            if not actuator_key.startswith('A') or actuator_key[1:4] not in effect_dictby_code:
+                continue
+            property_code, effect_on_active = effect_dictby_code[actuator_key[1:4]]
+            effect_list += [(actuator_key, key, effect_on_active) for key in self.key_list
+                            if key.startswith('S') and key[1:4] == property_code]
+        return effect_list
+
+    def start(self):
+        """Open the pty and start the device thread. port_name is the path to open"""
+        self._master_fd, slave_fd = os.openpty()
+        tty.setraw(slave_fd)        # no echo or line editing before the other side sets the port up
+        attributes = termios.tcgetattr(slave_fd)
+        speed = getattr(termios, 'B%d' % self.baud_rate)
+        attributes[4] = attributes[5] = speed
+        termios.tcsetattr(slave_fd, termios.TCSANOW, attributes)
+        os.set_blocking(self._master_fd, False)
+        self.port_name = os.ttyname(slave_fd)
+        os.close(slave_fd)          # the settings stay with the pty. Reads get EIO until the other side opens it
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='virtual groduino', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(2)
+            self._thread = None
+        if self._master_fd is not None:
+            os.close(self._master_fd)
+            self._master_fd = None
+
+    def burst(self, frame_count):
+        """Send frame_count frames at once, as fast as the pty takes them, like a board flushing a backlog.
+        Enough of them overflows Groduino's buffers"""
+        self._pending_burst_frame_count += frame_count
+
+    def stall(self, duration):
+        """Go quiet for duration secs: send nothing and read nothing, like a board stuck in a slow sensor read"""
+        self._stall_end_time = time.time() + duration
+        self.stall_count += 1
+
+    def getStatusList(self):
+        return ['Virtual groduino on %s: %s, %d baud, %s frames, %d connects' %
+                (self.port_name, 'connected' if self.is_connected else 'waiting for handshake', self.baud_rate,
+                 self.protocol, self.connect_count),
+                'Virtual groduino: %d frames, %d bytes sent, %d dropped, %d commands' %
+                (self.frame_count, self.sent_byte_count, self.dropped_byte_count, self.command_count),
+                'Virtual groduino faults: %d corrupted frames, %d corrupted bytes, %d bursts, %d stalls' %
+                (self.corrupted_frame_count, self.corrupted_byte_count, self.burst_count, self.stall_count)]
+
+    @property
+    def bytes_per_second(self):
+        return self.baud_rate / self.bits_per_byte
+
+    # ----- Device loop -----
+
+    def _run(self):
+        while self._handshake():
+            self._stream()
+            self._reset()
+
+    def _stream(self):
+        """Send frames and take commands until stopped or the other side closes the port"""
+        next_frame_time = time.time()
+        while not self._stop.is_set():
+            now = time.time()
+            if now < self._stall_end_time:
+                self._stop.wait(self._stall_end_time - now)
+                next_frame_time = time.time()
+                continue
+            if self._pending_burst_frame_count:
+                self._sendBurst()
+            wait = max(next_frame_time, self._link_free_time) - now
+            readable, _, _ = select.select([self._master_fd], [], [], min(max(0, wait), 0.1))
+            if readable and not self._readCommands():
+                logging.info('Virtual groduino: port closed, waiting for a new handshake')
+                return
+            now = time.time()
+            if self._baud_confirm_deadline is not None and now > self._baud_confirm_deadline:
+                logging.info('Virtual groduino: %d baud not confirmed, back to %d', self.baud_rate,
+                             self._previous_baud_rate)
+                self.baud_rate = self._previous_baud_rate
+                self._baud_confirm_deadline = None
+            if now >= next_frame_time and now >= self._link_free_time:
+                self._write(self._maybeCorruptFrame(self.makeFrame()))
+                self.frame_count += 1
+                if self.frame_rate:         # if the link can't keep up, it sets the pace
+                    next_frame_time = max(next_frame_time + 1 / self.frame_rate, now)
+
+    def _handshake(self):
+        """Send ENQ until we get ACK, then ACK back. Like the firmware's setup
+        :return: True once connected, False if stopped first
+        """
+        while not self._stop.is_set():
+            self._write(b'\x05')
+            readable, _, _ = select.select([self._master_fd], [], [], self.enquire_period)
+            if not readable:
+                continue
+            data = self._read()
+            if data is None:                # nobody has the port open yet
+                self._stop.wait(self.enquire_period)
+            elif b'\x06' in data:
+                self._write(b'\x06')
+                self.is_connected = True
+                self.connect_count += 1
+                logging.info('Virtual groduino connected on %s', self.port_name)
+                return True
+        return False
+
+    def _reset(self):
+        """Back to how the board starts, like a reset when the port is opened again"""
+        self.is_connected = False
+        self.protocol = 'ascii'
+        self.baud_rate = self.initial_baud_rate
+        self._baud_confirm_deadline = None
+        self._decoder = FrameDecoder()
+        self._link_free_time = 0
+
+    def _read(self):
+        """:return: bytes read, b'' if none, None if the other side doesn't have the port open"""
+        try:
+            return os.read(self._master_fd, 4096)
+        except BlockingIOError:
+            return b''
+        except OSError:         # EIO: the slave side isn't open
+            return None
+
+    def _write(self, data, paced=True):
+        """Write at baud_rate, write_chunk_size bytes at a time: wait for the link to be free, then write the next
+        chunk. Drops what doesn't fit in the pty
+        :param paced: False writes it all right away, without waiting for the link or holding it up after
+        """
+        data = self._corrupt(data)
+        for start in range(0, len(data), self.write_chunk_size):
+            chunk = data[start:start + self.write_chunk_size]
+            now = time.time()
+            if paced and self._link_free_time > now:
+                time.sleep(self._link_free_time - now)
+                now = self._link_free_time
+            try:
+                written = os.write(self._master_fd, chunk)
+            except BlockingIOError:
+                written = 0
+            self.sent_byte_count += written
+            self.dropped_byte_count += len(chunk) - written
+            if paced:
+                self._link_free_time = now + len(chunk) / self.bytes_per_second
+
+    def _sendBurst(self):
+        frame_count, self._pending_burst_frame_count = self._pending_burst_frame_count, 0
+        self.burst_count += 1
+        for _ in range(frame_count):
+            self._write(self._maybeCorruptFrame(self.makeFrame()), paced=False)
+            self.frame_count += 1
+
+    def _maybeCorruptFrame(self, frame):
+        """Flip a bit in one byte of frame with probability corrupt_frame_rate"""
+        if not self.corrupt_frame_rate or self._random.random() >= self.corrupt_frame_rate:
+            return frame
+        corrupted = bytearray(frame)
+        corrupted[self._random.randrange(len(corrupted))] ^= 1 << self._random.randrange(8)
+        self.corrupted_frame_count += 1
+        return bytes(corrupted)
+
+    def _corrupt(self, data):
+        """What the other side would get: garbage if the baud rates don't match, else maybe a few bad bytes"""
+        if self._isBaudRateMismatched():
+            self.corrupted_byte_count += len(data)
+            return bytes(self._random.getrandbits(8) for i in range(len(data)))
+        if self.baud_rate <= self.reliable_baud_rate or not self.byte_error_rate:
+            return data
+        corrupted = bytearray(data)
+        for i in range(len(corrupted)):
+            if self._random.random() < self.byte_error_rate:
+                corrupted[i] ^= 1 << self._random.randrange(8)
+                self.corrupted_byte_count += 1
+        return bytes(corrupted)
+
+    def _isBaudRateMismatched(self):
+        """Whether the other side set the port to another baud rate than ours (False if we can't tell)"""
+        try:
+            speed = termios.tcgetattr(self._master_fd)[5]
+        except termios.error:
+            return False
+        port_baud_rate = _BAUD_RATE_DICTBY_SPEED.get(speed)
+        return port_baud_rate is not None and port_baud_rate != self.baud_rate
+
+    def _readCommands(self):
+        """:return: False if the other side closed the port"""
+        data = self._read()
+        if data is None:
+            return False
+        if self._isBaudRateMismatched():        # all we would get is garbage
+            return True
+        self._decoder.feed(data)
+        for text, crc in self._decoder.frames():
+            if crc != Crc8.crc(text):
+                logging.error('Virtual groduino got a bad crc, ignoring: %r', text)
+                continue
+            self.command_count += 1
+            self.handleCommand(text.decode('ASCII', 'replace'))
+        return True
+
+    def handleCommand(self, command):
+        """Handle a message from Groduino.send. ex 'AAHE 1 1.000000' or 'GBIN 1'"""
+        parts = command.split()
+        if parts[:1] == ['GBIN']:
+            if self.supports_binary and len(self.key_list) <= BinaryFrameDecoder.max_key_count:
+                self._write(self._makeAsciiFrame('{"GBIN":1,"keys":[%s]}' %
+                                                 ','.join('"%s"' % key for key in self.key_list)))
+                self.protocol = 'binary'
+            return
+        if parts[:1] == ['GBAU'] and len(parts) == 2:
+            baud_rate = int(parts[1])
+            if self.supports_baud_change and hasattr(termios, 'B%d' % baud_rate):
+                self._write(self._makeAsciiFrame('{"GBAU":%d}' % baud_rate))     # at the old rate
+                self._previous_baud_rate = self.baud_rate
+                self.baud_rate = baud_rate
+                self._baud_confirm_deadline = time.time() + self.baud_confirm_timeout
+            return
+        if parts[:1] == ['GBOK'] and len(parts) == 2:
+            if int(parts[1]) == self.baud_rate:         # echoed every time, the host resends it if the echo is lost
+                self._baud_confirm_deadline = None
+                self._write(self._makeAsciiFrame('{"GBOK":%d}' % self.baud_rate))
+            return
+        if parts[:1] == ['GPRB'] and len(parts) == 2:
+            self._write(self._makeAsciiFrame('{"GPRB":"%s"}' % parts[1]))
+            return
+        if len(parts) == 3 and parts[0].startswith('A'):
+            key = parts[0] + ' ' + parts[1]
+            if key in self.value_dictby_key:
+                self.value_dictby_key[key] = float(parts[2])
+                return
+        logging.warning('Virtual groduino got an unknown command: %s', command)
+
+    # ----- Frames -----
+
+    def makeFrame(self):
+        """Next frame of every key, ASCII or binary depending on what was agreed
+        :return: frame bytes
+        """
+        self._updateValues()
+        if self.protocol == 'binary':
+            return BinaryFrameDecoder.packFrame([(element_id, self.value_dictby_key[key])
+                                                 for element_id, key in enumerate(self.key_list)])
+        return self._makeAsciiFrame('{%s,"GEND":0}' % ','.join('"%s":%.2f' % (key, self.value_dictby_key[key])
+                                                               for key in self.key_list))
+
+    def _updateValues(self):
+        """Move the sensing point values for the time since the last frame: noise, the pull back to where they
+        started, and the actuators that affect them"""
+        now = time.time()
+        elapsed = now - self._value_time if self._value_time is not None else 0
+        self._value_time = now
+        value_dictby_key = self.value_dictby_key
+        for key, ambient_value in self._ambient_value_dictby_key.items():
+            value = value_dictby_key[key]
+            value_dictby_key[key] = (value + (ambient_value - value) * min(1, self.ambient_pull * elapsed) +
+                                     self._random.uniform(-self.value_noise, self.value_noise))
+        for actuator_key, key, effect_on_active in self._effect_list:
+            value_dictby_key[key] += effect_on_active * value_dictby_key[actuator_key] * self.actuator_effect_rate * \
+                elapsed
+        for key in self._ambient_value_dictby_key:
+            value_dictby_key[key] = round(value_dictby_key[key], 2)
+
+    @staticmethod
+    def _makeAsciiFrame(text):
+        text_bytes = text.encode('ASCII')
+        return (b'\x01' + str(len(text_bytes)).encode('ASCII') + b'\x02' + text_bytes + b'\x03' +
+                str(Crc8.crc(text_bytes)).encode('ASCII') + b'\x04')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulated groduino on a pseudo-terminal')
+    parser.add_argument('-s', '--sensing-points', type=int, default=6)
+    parser.add_argument('-a', '--actuators', type=int, default=3)
+    parser.add_argument('-r', '--rate', type=float, default=1,
+                        help='frames per second, 0 for as fast as the link allows')
+    parser.add_argument('-b', '--baud', type=int, default=9600, help='baud rate to start at')
+    parser.add_argument('--no-binary', action='store_true', help="don't answer GBIN, like old firmware")
+    parser.add_argument('--corrupt-rate', type=float, default=0, help='chance of corrupting each frame')
+    parser.add_argument('--burst-every', type=float, default=0, help='secs between bursts, 0 for none')
+    parser.add_argument('--burst-frames', type=int, default=50, help='frames per burst')
+    parser.add_argument('--stall-every', type=float, default=0, help='secs between stalls, 0 for none')
+    parser.add_argument('--stall-time', type=float, default=5, help='secs each stall lasts')
+    parser.add_argument('--status-every', type=float, default=10, help='secs between status logs')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    device = VirtualGroduino(makeKeyList(args.sensing_points, args.actuators), baud_rate=args.baud,
+                             frame_rate=args.rate, supports_binary=not args.no_binary,
+                             corrupt_frame_rate=args.corrupt_rate)
+    device.start()
+    print('Virtual groduino on %s, run: python3 grodaemon.py -p %s' % (device.port_name, device.port_name), flush=True)
+    next_time_dictby_name = {name: time.time() + period for name, period in
+                             (('burst', args.burst_every), ('stall', args.stall_every), ('status', args.status_every))
+                             if period}
+    try:
+        while True:
+            time.sleep(0.1)
+            now = time.time()
+            for name, next_time in next_time_dictby_name.items():
+                if now < next_time:
+                    continue
+                if name == 'burst':
+                    device.burst(args.burst_frames)
+                    next_time_dictby_name[name] = now + args.burst_every
+                elif name == 'stall':
+                    device.stall(args.stall_time)
+                    next_time_dictby_name[name] = now + args.stall_every
+                else:
+                    for status in device.getStatusList():
+                        logging.info(status)
+                    next_time_dictby_name[name] = now + args.status_every
+    except KeyboardInterrupt:
+        device.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""ControlEngine against Actuator.simpleControl, on a Bot set up from the local plantOS stub.
+Run from the repo root: python3 -m pytest tests
+"""
+
+import logging
+import random
+
+import pytest
+
+from services.bot import Bot
+from services.bot.controlEngine import ControlEngine
+from services.server import Server
+from simulation.plantosStub import PlantosStub
+
+pytest.importorskip('numpy')
+
+
+class _NoGroduino:
+    def getStatusList(self):
+        return []
+
+
+@pytest.fixture(scope='module')
+def bot():
+    logging.disable(logging.ERROR)          # the made up topology has inactive bits it complains about
+    outbox_file_name = Server._outbox_file_name
+    Server._outbox_file_name = None
+    stub = PlantosStub()
+    stub.start()
+    stub.addTopology(12, 6)         # every actuator type, so binary and not
+    server = Server(stub.base_url)
+    try:
+        yield Bot(_NoGroduino(), server)
+    finally:
+        server.close()
+        stub.stop()
+        Server._outbox_file_name = outbox_file_name
+        logging.disable(logging.NOTSET)
+
+
+def randomize(bot, rng):
+    """Random values/set points (some missing) and actuator states (some None, some 0)"""
+    for sensing_point in bot.getElementByCodeIndex('sensing_point'):
+        sensing_point._last_value = None if rng.random() < 0.05 else rng.uniform(0, 40)
+        sensing_point._desired_value = None if rng.random() < 0.05 else rng.uniform(0, 40)
+    for actuator in bot.getElementByCodeIndex('actuator'):
+        actuator._state = rng.choice([None, 0, 0, 1, rng.uniform(0, 1)])
+
+
+def getResults(bot):
+    return [(a._state, a._controlled_sensing_point) for a in bot.getElementByCodeIndex('actuator')]
+
+
+def runSimpleControl(bot):
+    for actuator in bot.getElementByCodeIndex('actuator'):
+        actuator.simpleControl()
+
+
+def test_engine_matches_simple_control(bot):
+    engine = ControlEngine(bot)
+    engine.compile()
+    assert any(not a.actuator_type_dict['is_binary'] for a in engine.actuator_list)
+    rng = random.Random(1)
+    for check in range(200):
+        randomize(bot, rng)
+        start_state_list = [a._state for a in bot.getElementByCodeIndex('actuator')]
+        runSimpleControl(bot)
+        expected_list = getResults(bot)
+        for actuator, state in zip(bot.getElementByCodeIndex('actuator'), start_state_list):
+            actuator._state = state
+        engine.evaluate()
+        assert getResults(bot) == expected_list
+
+
+def test_zero_operating_range(bot):
+    """simpleControl divides by the operating range and raises, the engine gets inf for the state"""
+    actuator = next(a for a in bot.getElementByCodeIndex('actuator') if not a.actuator_type_dict['is_binary'])
+    old_effects_dict = dict(actuator.effects_dictby_sensing_point_url)
+    try:
+        for url, effects_dict in old_effects_dict.items():
+            zero_range_dict = dict(effects_dict, operating_range_max=effects_dict['operating_range_min'])
+            actuator.effects_dictby_sensing_point_url[url] = zero_range_dict
+            sensing_point = bot.getElementByUrl(url)
+            sensing_point._last_value = 10
+            sensing_point._desired_value = 10 + 2 * effects_dict['threshold'] * effects_dict['effect_on_active']
+        actuator._state = 0
+        with pytest.raises(ZeroDivisionError):
+            actuator.simpleControl()
+
+        engine = ControlEngine(bot)
+        engine.compile()
+        actuator._state = 0
+        engine.evaluate()
+        assert actuator.state == float('inf')
+        assert actuator._controlled_sensing_point is not None
+    finally:
+        actuator.effects_dictby_sensing_point_url.update(old_effects_dict)
@@ -0,0 +1,43 @@
+"""Crc8 against the original byte at a time implementation. Run from the repo root: python3 -m pytest tests"""
+
+import random
+
+from services.arduino.communication.communication import Crc8
+
+
+def legacyCrc(text):
+    """The Crc8 digest before it took bytes: one char at a time through ord and TABLE"""
+    crc = 0
+    for ch in text:
+        crc = Crc8.TABLE[crc ^ ord(ch)]
+    return crc
+
+
+def makeTextList():
+    rng = random.Random(1)
+    text_list = ['', 'a', '{"GEND":0}', '{"SATM 1":22.80,"SAHU 1":40.10,"GEND":0}']
+    for length in (15, 16, 17, 255, 256, 1000):     # around _min_table16_length, odd and even
+        text_list.append(''.join(chr(rng.randrange(32, 127)) for i in range(length)))
+    return text_list
+
+
+def test_crc_matches_legacy():
+    for text in makeTextList():
+        expected = legacyCrc(text)
+        assert Crc8.crc(text.encode('ASCII')) == expected
+        assert Crc8.crc(bytearray(text.encode('ASCII'))) == expected
+        assert Crc8.crc(memoryview(text.encode('ASCII'))) == expected
+        assert Crc8.crc(text) == expected
+        assert Crc8().digest(text) == expected
+
+
+def test_crc_many_matches_legacy():
+    text_list = makeTextList() * 10         # over numpy_min_frames, so numpy is used if it is installed
+    frame_list = [text.encode('ASCII') for text in text_list]
+    expected_list = [legacyCrc(text) for text in text_list]
+    assert Crc8.crcMany(frame_list) == expected_list
+    assert Crc8.crcMany(frame_list[:3]) == expected_list[:3]
+
+    checked_list = [(frame, crc if i % 3 else (crc + 1) % 256) for i, (frame, crc) in
+                    enumerate(zip(frame_list, expected_list))]
+    assert Crc8.checkMany(checked_list) == [i % 3 != 0 for i in range(len(frame_list))]
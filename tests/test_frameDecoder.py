@@ -0,0 +1,92 @@
+"""FrameDecoder and BinaryFrameDecoder on split and corrupted input.
+Run from the repo root: python3 -m pytest tests
+"""
+
+from services.arduino.communication.communication import BinaryFrameDecoder, Crc8, FrameDecoder
+
+
+def makeFrame(text):
+    return b'\x01%d\x02%s\x03%d\x04' % (len(text), text, Crc8.crc(text))
+
+
+def decodeAll(data, chunk_size=None):
+    """Feed data (all at once, or chunk_size bytes at a time) and get every frame
+    :return: (list of (text, crc), decoder)
+    """
+    decoder = FrameDecoder()
+    frame_list = []
+    chunk_size = chunk_size or len(data)
+    for start in range(0, len(data), chunk_size):
+        decoder.feed(data[start:start + chunk_size])
+        frame_list += decoder.frames()
+    return frame_list, decoder
+
+
+def test_corrupted_length_resyncs_on_next_frame():
+    good_list = [b'"STMP 1":22.5,"SHUM 1":40.1', b'"SLIT 1":1200', b'"STMP 2":19']
+    # length digit corrupted to 99999, its text would swallow the frames after it
+    data = b'\x0199999\x02"STMP 1":22.5\x0312\x04' + b''.join(makeFrame(text) for text in good_list)
+    for chunk_size in (None, 1, 7):
+        frame_list, decoder = decodeAll(data, chunk_size)
+        assert [text for text, _ in frame_list] == good_list
+        assert decoder.invalid_frame_count == 1
+
+
+def test_length_over_buffer_size_is_invalid():
+    decoder = FrameDecoder(max_buffer_size=100, cut_buffer_size=50)
+    decoder.feed(b'\x01500\x02' + b'x' * 20)
+    assert decoder.nextFrame() is None
+    assert decoder.invalid_frame_count == 1
+
+
+def test_frames_split_over_feeds():
+    text_list = [b'"STMP %d":%d.5' % (i, i) for i in range(20)]
+    data = b''.join(makeFrame(text) for text in text_list)
+    for chunk_size in (1, 2, 3, 5, 64):
+        frame_list, decoder = decodeAll(data, chunk_size)
+        assert frame_list == [(text, Crc8.crc(text)) for text in text_list]
+        assert decoder.invalid_frame_count == 0
+        assert decoder.discarded_byte_count == 0
+
+
+def test_garbage_is_skipped():
+    good_list = [b'"STMP 1":22.5', b'"SHUM 1":40.1', b'"SLIT 1":1200', b'"STMP 2":19', b'"SCO2 1":400']
+    data = (b'\xff\xfe noise' + makeFrame(good_list[0]) +
+            b'\x01x2\x02ab\x03' + makeFrame(good_list[1]) +         # letter in the length
+            b'\x013\x02abcd\x0312\x04' + makeFrame(good_list[2]) +  # text longer than the length, no endOfText
+            b'\x012\x02ab\x031x\x04' + makeFrame(good_list[3]) +     # letter in the crc
+            b'\x011234567\x02' + makeFrame(good_list[4]))            # too many length digits
+    for chunk_size in (None, 1):
+        frame_list, decoder = decodeAll(data, chunk_size)
+        assert [text for text, _ in frame_list] == good_list
+        assert decoder.invalid_frame_count == 4
+
+
+def test_bad_crc_is_left_to_the_caller():
+    data = b'\x012\x02ab\x0399\x04'
+    frame_list, decoder = decodeAll(data)
+    assert frame_list == [(b'ab', 99)]
+    assert Crc8.checkMany(frame_list) == [False]
+
+
+def test_buffer_is_cut_down_to_the_newest_bytes():
+    decoder = FrameDecoder(max_buffer_size=100, cut_buffer_size=50)
+    decoder.feed(b'\x01' + b'9' * 3 + b'x' * 200)       # never completes
+    assert len(decoder) == 50
+    decoder.feed(makeFrame(b'"STMP 1":1'))
+    assert [text for text, _ in decoder.frames()] == [b'"STMP 1":1']
+
+
+def test_binary_decoder_resyncs():
+    frame = BinaryFrameDecoder.packFrame([(0, 22.5), (1, 40.25)])
+    bad_end = frame[:-1] + b'\x00'
+    bad_length = b'\x0e\xff\xff' + b'\x00' * 10
+    decoder = BinaryFrameDecoder()
+    for data in (b'noise', frame, bad_end, bad_length, frame):
+        decoder.feed(data)
+    frame_list = list(decoder.frames())
+    assert len(frame_list) == 2
+    for payload, crc in frame_list:
+        assert crc == Crc8.crc(payload)
+        assert BinaryFrameDecoder.unpackSamples(payload) == [(0, 22.5), (1, 40.25)]
+    assert decoder.invalid_frame_count == 2
@@ -0,0 +1,26 @@
+"""decodeMessage against json.loads (it uses orjson if installed).
+Run from the repo root: python3 -m pytest tests
+"""
+
+import json
+
+import pytest
+
+from services.bot.messageDecoder import decodeMessage
+
+
+@pytest.mark.parametrize('message', [
+    '{"GEND":0}',
+    '{"SATM 1":22.8,"SAHU 1":40.1,"SACO 1":400,"GEND":0}',
+    '{"SATM 1":"ERROR","SLIN 1":[1,2],"SWPH 1":{"a":1},"GEND":0}',
+    '{"SATM 1":NaN,"GEND":0}',          # orjson rejects NaN, json.loads takes it
+    '{"SATM 1":1e400,"GEND":0}',
+])
+def test_same_as_json(message):
+    assert repr(decodeMessage(message)) == repr(list(json.loads(message).items()))
+
+
+@pytest.mark.parametrize('message', ['', '{"SATM 1":', '[1,2]', '22.8'])
+def test_bad_message_raises(message):
+    with pytest.raises(ValueError):
+        decodeMessage(message)
@@ -0,0 +1,121 @@
+"""DataPointOutbox group commits, claim/ack/release and failed commits.
+Run from the repo root: python3 -m pytest tests
+"""
+
+import logging
+import sqlite3
+
+import pytest
+
+from services.server.outbox import DataPointOutbox
+
+
+def makeBatch(value, point_count=1):
+    return [{'sensing_point': 'sp', 'timestamp': 1, 'value': value}] * point_count
+
+
+def storedBatchCount(outbox):
+    return sqlite3.connect(outbox.file_name).execute('SELECT COUNT(*) FROM batch').fetchone()[0]
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    outbox = DataPointOutbox(str(tmp_path / 'outbox.db'))
+    yield outbox
+    outbox.close()
+
+
+def test_append_only_buffers(outbox):
+    assert outbox.append(makeBatch(1, 10)) is False
+    assert outbox.append([]) is False
+    assert storedBatchCount(outbox) == 0
+    assert outbox.point_count == 10
+    assert outbox.append(makeBatch(2, outbox.commit_point_count)) is True      # due, but still not written
+    assert storedBatchCount(outbox) == 0
+
+
+def test_claim_commits_when_due(outbox):
+    outbox.append(makeBatch(1))
+    assert outbox.claim(100) == ([], [])        # not due yet
+    outbox.append(makeBatch(2, outbox.commit_point_count))
+    id_list, values_list = outbox.claim(10000)
+    assert len(id_list) == 2
+    assert [point['value'] for point in values_list] == [1] + [2] * outbox.commit_point_count
+    assert outbox.commit_count == 1
+
+
+def test_claim_ack_release(outbox):
+    for value in range(5):
+        outbox.append(makeBatch(value, 3))
+    outbox.flush()
+
+    id_list, values_list = outbox.claim(6)      # two batches fit
+    assert [point['value'] for point in values_list] == [0, 0, 0, 1, 1, 1]
+    other_id_list, other_values_list = outbox.claim(1)      # always at least one batch, never a claimed one
+    assert [point['value'] for point in other_values_list] == [2, 2, 2]
+
+    outbox.release(id_list)
+    assert outbox.claim(3)[0] == id_list[:1]
+    outbox.ack(other_id_list)
+    assert outbox.point_count == 12
+    assert storedBatchCount(outbox) == 4
+
+
+def test_batches_are_replayed_after_reopen(tmp_path):
+    file_name = str(tmp_path / 'outbox.db')
+    outbox = DataPointOutbox(file_name)
+    outbox.append(makeBatch(1, 2))
+    outbox.claim(100)           # claimed but never acked
+    outbox.close()
+    assert outbox.claim(100) == ([], [])
+    outbox.ack([1])             # ignored once closed
+
+    outbox = DataPointOutbox(file_name)
+    assert outbox.point_count == 2
+    assert len(outbox.claim(100)[1]) == 2
+    outbox.close()
+
+
+def test_trim_drops_oldest_unclaimed(outbox):
+    outbox.max_bytes = 1
+    outbox.append(makeBatch(1))
+    outbox.flush()
+    assert outbox.point_count == 0
+    assert outbox.dropped_point_count == 1
+
+
+class _FailingDatabase:
+    """Wraps the outbox's connection, fails inserts while fail is set"""
+    def __init__(self, db):
+        self.db = db
+        self.fail = True
+
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+
+    def executemany(self, *args):
+        if self.fail:
+            raise sqlite3.OperationalError('database or disk is full')
+        return self.db.executemany(*args)
+
+
+def test_failed_commit_keeps_the_batches(outbox):
+    logging.disable(logging.ERROR)
+    try:
+        failing_db = outbox._db = _FailingDatabase(outbox._db)
+        outbox.append(makeBatch(1, 2))
+        outbox.append(makeBatch(2))
+        outbox.flush()
+        assert not failing_db.in_transaction
+        assert outbox.point_count == 3
+        assert storedBatchCount(outbox) == 0
+
+        outbox.append(makeBatch(3))
+        failing_db.fail = False
+        outbox.flush()
+        id_list, values_list = outbox.claim(100)
+        assert [point['value'] for point in values_list] == [1, 1, 2, 3]
+        outbox.ack(id_list)
+        assert outbox.point_count == 0
+    finally:
+        logging.disable(logging.NOTSET)